@@ -1,14 +1,24 @@
-import cv2
-import zmq
 import threading
 import time
 import socket
-import base64
+import struct
 import json
-import queue
 import argparse
 import logging
+import collections
+import hashlib
+import importlib
+import math
+import heapq
+import itertools
+import mmap
+import multiprocessing
+import queue
+import select
+import re
+import secrets
 import os  # Needed for secret key and potentially restart logic if added later
+from multiprocessing import shared_memory
 from flask import (
     Flask,
     Response,
@@ -20,12 +30,121 @@ from flask import (
     url_for,
 )
 
+# --- Lazy Imports ---
+
+
+class LazyModule:
+    """Stands in for a heavy module until it is first used, then imports it.
+
+    On that first use the module also replaces the stand-in in namespace, so later
+    lookups of the global cost nothing extra. Keeps OpenCV, NumPy and pyzmq out of
+    process startup: the setup page is served before they are loaded (see WarmStandby).
+    """
+
+    def __init__(self, module_name, namespace, binding=None):
+        self._module_name = module_name
+        self._namespace = namespace
+        self._binding = binding or module_name
+        self._module = None
+
+    def load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self._module_name)
+            self._namespace[self._binding] = self._module
+        return self._module
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+
+np = LazyModule("numpy", globals(), "np")
+cv2 = LazyModule("cv2", globals())
+zmq = LazyModule("zmq", globals())
+HEAVY_MODULES = (np, cv2, zmq)  # Imported in the background by --warm-standby
+
 # --- Configuration ---
 BROADCAST_PORT = 30001  # UDP port for discovery broadcasts
 HEARTBEAT_INTERVAL = 5  # Seconds between discovery heartbeats
 PEER_TIMEOUT = 15  # Seconds before considering a peer disconnected
-MAX_FRAME_QUEUE_SIZE = 10  # Max frames to buffer per peer for SSE
+# Discovery announcement: magic, format version, ZMQ port, send time.time(), room length,
+# then the room and a length-prefixed name, all UTF-8. Newer versions only append fields.
+ANNOUNCE_HEADER = struct.Struct("!2sBHdH")
+ANNOUNCE_MAGIC = b"PV"
+ANNOUNCE_VERSION = 2
+# Version 2 appends receiver reports: a count byte, then per peer whose video we receive
+# its IPv4 address, ZMQ port and the share of its frames lost since our last report (/255)
+RECEIVER_REPORT = struct.Struct("!4sHB")
+RECEIVER_REPORT_MAX = 64  # Reports per heartbeat, keeps it well inside one datagram
+DISCOVERY_MAX_DATAGRAM = 2048  # Receive buffer per discovery datagram
+DISCOVERY_REPLY_HOLDOFF = 0.5  # Min seconds between early heartbeats answering new peers
+# Multicast discovery (optional, --discovery multicast): each room announces on its own
+# group inside this organization-local prefix (RFC 2365), hashed from the room name
+DISCOVERY_MULTICAST_PREFIX = "239.192"
+DISCOVERY_MULTICAST_TTL = 1  # Keep announcements on the local network segment
 JPEG_QUALITY = 70  # JPEG quality (0-100)
+CAMERA_DEVICE = 0  # cv2.VideoCapture device index shared by publisher and self-view
+SYNTHETIC_MOTION = 4  # Pixels per frame the synthetic source's square moves (0: static)
+CAPTURE_SIZE = (640, 480)  # Resolution the capture hub requests from the camera
+# Capture worker process (optional, --capture-process): frames reach the main process
+# through a ring of shared-memory slots, each CAPTURE_SLOT_HEADER, the raw BGR frame,
+# then per JPEG CAPTURE_SLOT_JPEG and its bytes
+CAPTURE_SLOT_HEADER = struct.Struct("<QdHHB")  # seq (0 while written), time, width, height, JPEGs
+CAPTURE_SLOT_JPEG = struct.Struct("<HHBI")  # width, height, quality, length
+CAPTURE_RING_SLOTS = 4  # Frames the main process may fall behind before one is dropped
+CAPTURE_RING_JPEG_BYTES = 512 * 1024  # Room per slot for the encodings of one frame
+CAPTURE_WORKER_START_TIMEOUT = 30.0  # Seconds to wait for the worker to open the source
+CAPTURE_WORKER_READ_TIMEOUT = 1.0  # Seconds read() waits for the worker's next frame
+CAPTURE_WORKER_ENCODING_TTL = 1.0  # Seconds an encoding is produced after its last use
+SELF_VIEW_SIZE = (320, 240)  # Reduced resolution for the local self-view stream
+PUBLISH_FPS = 25  # Target publish rate before any adaptive degradation
+SELF_VIEW_FPS = 20  # Target rate of the local self-view stream
+PACING_REPORT_INTERVAL = 5.0  # Seconds between achieved-vs-target fps measurements
+SSE_CONTROL_LANE_LIMIT = 500  # Pending control events before a client is resynced instead
+PEER_STATS_EVENT_INTERVAL = 1.0  # Seconds between peer_stats SSE events per peer
+SSE_KEEPALIVE_INTERVAL = 30  # Seconds of SSE silence before a keep-alive comment is sent
+PACING_WARN_RATIO = 0.9  # Log a warning when a loop achieves less than this share of its target
+PUB_SNDHWM = 5  # Frames queued per subscriber before ZMQ drops that subscriber's messages
+# Adaptive publisher bounds (overridable from the command line)
+MIN_JPEG_QUALITY = 30
+MAX_JPEG_QUALITY = JPEG_QUALITY
+MIN_PUBLISH_FPS = 5
+MAX_PUBLISH_FPS = PUBLISH_FPS
+ADAPTIVE_SCALES = (1.0, 0.75, 0.5)  # Resolution ladder, as fractions of CAPTURE_SIZE
+ADAPTIVE_WINDOW = 1.0  # Seconds of observations per controller decision
+# Delta publishing (optional, --delta): skip static frames, send only changed tiles
+DELTA_TILE_SIZE = 80  # Tile edge in capture pixels
+DELTA_SAMPLE_STEP = 8  # Compare every Nth pixel in both directions
+DELTA_DIFF_THRESHOLD = 6.0  # Mean absolute difference per channel that marks a tile dirty
+DELTA_MAX_DIRTY_RATIO = 0.5  # Above this share of dirty tiles a full frame is cheaper
+DELTA_REFRESH_INTERVAL = 2.0  # Seconds between full refresh frames (late joiners, losses)
+# Video messages are [topic, header, jpeg] (full frame) or [topic, header, meta, tile...]
+# (delta patch). The header carries kind, sequence number, capture time and encode time.
+FRAME_HEADER = struct.Struct("!BIdf")  # kind, seq, capture time.time(), encode seconds
+FRAME_KIND_FULL = 1
+FRAME_KIND_PATCH = 2
+# Simulcast: every frame is published in these layers, (topic suffix, share of the
+# adaptive publish size), on topics room|peer_id|layer; receivers pick one per peer
+SIMULCAST_LAYERS = (("f", 1.0), ("h", 0.5), ("q", 0.25))
+SIMULCAST_SCALES = dict(SIMULCAST_LAYERS)
+SUBSCRIPTION_SYNC_INTERVAL = 0.25  # Seconds between subscriber checks of peers and viewer sizes
+# Mosaic (/video_feed_mosaic): all peers composited into one stream for thin clients
+MOSAIC_WIDTH = 1280  # Pixel width of the grid image
+MOSAIC_FPS = 15  # Compose/encode ticks per second, shared by all mosaic clients
+MOSAIC_QUALITY = JPEG_QUALITY
+# (factor, cv2 imdecode flag) for decoding JPEGs at reduced size, largest reduction first
+MOSAIC_REDUCED_DECODES = (
+    (8, "IMREAD_REDUCED_COLOR_8"),
+    (4, "IMREAD_REDUCED_COLOR_4"),
+    (2, "IMREAD_REDUCED_COLOR_2"),
+)
+# Recording (optional, --record-dir): received JPEGs appended per peer, plus a seek index
+RECORD_INDEX = struct.Struct("<dQI")  # Per frame: arrival time.time(), segment offset, length
+RECORD_INDEX_DTYPE = [("t", "<f8"), ("offset", "<u8"), ("length", "<u4")]  # Same, as NumPy dtype
+RECORD_META_FILE = "recording.json"  # Room, start time and peer names of one recording
+RECORD_NAME = re.compile(r"[A-Za-z0-9_-][A-Za-z0-9._-]*")  # Valid recording/peer file names
+RECORD_QUEUE_SIZE = 256  # Frames waiting for the writer before new ones are left out
+RECORD_MAX_GAP = 1.0  # Longest pause playback keeps where nothing was received
+CLOCK_OFFSET_SAMPLES = 12  # Heartbeats kept per peer for the clock offset estimate
 DEFAULT_FLASK_PORT = 5000  # Default port for the local Flask web server
 
 # --- Logging ---
@@ -35,14 +154,16 @@ logging.basicConfig(
 )
 
 # --- Global State (Thread Safety Considerations) ---
-peers = {}  # { peer_id: {'name': str, 'addr': (ip, zmq_port), 'last_seen': time.time()} }
-peers_lock = threading.Lock()
-frame_queues = {}  # { peer_id: queue.Queue(maxsize=MAX_FRAME_QUEUE_SIZE) }
-frame_queues_lock = threading.Lock()
-sse_clients = []  # List of Server-Sent Event queues to push updates to clients
+# Known peers, their mailboxes and stream stats: peer_registry (see PeerRegistry)
+peer_feed_clients = {}  # { peer_id: [FeedViewer, ...] } one per open /video_feed/<peer_id>
+peer_feed_clients_lock = threading.Lock()
+sse_clients = []  # List of SSEClient outboxes to push peer events to browser clients
 sse_clients_lock = threading.Lock()
+viewer_budgets = {}  # { viewer_id: ViewerBudget } one per connected SSE client (browser page)
+viewer_budgets_lock = threading.Lock()
 my_info = {}  # Populated after setup form submission { 'name': str, 'room': str, 'ip': str, 'zmq_port': int, 'peer_id': str }
 my_info_lock = threading.Lock()  # Protect access/modification of my_info
+session_version = 0  # Bumped with my_info by /switch_room; the loops then reconfigure in place
 shutdown_flag = threading.Event()  # To signal threads to stop
 threads = []  # Keep track of running background threads
 threads_started = (
@@ -52,6 +173,245 @@ threads_started = (
 config_lock = threading.Lock()
 
 
+# --- Metrics (Prometheus text exposition, served at /metrics) ---
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+class Metric:
+    """Base for the few metric types this app exports; values are keyed by label tuples."""
+
+    type_name = "untyped"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._lock = threading.Lock()
+        self._values = {}  # { ((label, value), ...): value }
+        metrics_registry.append(self)
+
+    def remove(self, **labels):
+        """Drops one label set, e.g. for a peer that has left."""
+        with self._lock:
+            self._values.pop(tuple(sorted(labels.items())), None)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.type_name}"]
+        for name, key, value in self.samples():
+            lines.append(f"{name}{_format_labels(key)} {value}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def __init__(self, name, help_text, labelled=False):
+        super().__init__(name, help_text)
+        if not labelled:
+            self._values[()] = 0  # Export 0 rather than nothing before the first event
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """Gauge read at scrape time from a callback returning a number or {label_value: number}."""
+
+    type_name = "gauge"
+
+    def __init__(self, name, help_text, callback, label=None):
+        super().__init__(name, help_text)
+        self.callback = callback
+        self.label = label
+
+    def samples(self):
+        value = self.callback()
+        if self.label is None:
+            return [(self.name, (), value)]
+        return [(self.name, ((self.label, key),), v) for key, v in value.items()]
+
+
+class CallbackCounter(Gauge):
+    """Counter read at scrape time, for counts kept elsewhere (e.g. on peer records)."""
+
+    type_name = "counter"
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+    DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self._sum = 0.0
+
+    def observe(self, value):
+        with self._lock:
+            self._sum += value
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self._counts[i] += 1
+                    break
+            else:
+                self._counts[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), counts):
+            cumulative += count
+            samples.append((f"{self.name}_bucket", (("le", bound),), cumulative))
+        samples.append((f"{self.name}_sum", (), total))
+        samples.append((f"{self.name}_count", (), cumulative))
+        return samples
+
+
+metrics_registry = []  # Every Metric, in registration order
+
+frames_captured_total = Counter(
+    "p2p_frames_captured_total", "Frames read from the camera by the capture hub."
+)
+frames_encoded_total = Counter(
+    "p2p_frames_encoded_total", "JPEG encodes performed (full frames and delta tiles)."
+)
+frames_published_total = Counter(
+    "p2p_frames_published_total", "Video messages sent on the ZMQ PUB socket."
+)
+Gauge(
+    "p2p_subscriber_loss_ratio",
+    "Share of our frames each subscriber reported lost in its last heartbeat.",
+    lambda: {
+        peer_id: lost
+        for peer_id, lost in subscriber_loss.snapshot().items()
+        if peer_registry.get(peer_id) is not None
+    },
+    label="peer",
+)
+CallbackCounter(
+    "p2p_peer_frames_received_total",
+    "Video messages received per peer.",
+    lambda: {
+        peer_id: record.frames_received
+        for peer_id, record in peer_registry.snapshot().items()
+    },
+    label="peer",
+)
+CallbackCounter(
+    "p2p_peer_frames_dropped_total",
+    "Received frames replaced in the peer's mailbox before any viewer read them.",
+    lambda: {
+        peer_id: record.mailbox.dropped for peer_id, record in peer_registry.snapshot().items()
+    },
+    label="peer",
+)
+encode_duration = Histogram("p2p_encode_seconds", "Time to JPEG-encode one outgoing message.")
+recorder_frames_written_total = Counter(
+    "p2p_recorder_frames_written_total", "Received frames appended to the recording."
+)
+recorder_frames_dropped_total = Counter(
+    "p2p_recorder_frames_dropped_total",
+    "Received frames left out of the recording because its writer queue was full.",
+)
+feed_frames_coalesced_total = Counter(
+    "p2p_feed_frames_coalesced_total",
+    "Received frames a rate-capped feed skipped because a newer one arrived before its slot.",
+)
+serialize_duration = Histogram(
+    "p2p_serialize_seconds", "Time to serialize one SSE event or peer feed frame part."
+)
+
+
+def _sse_queue_depths():
+    with sse_clients_lock:
+        return [client.depth() for client in sse_clients]
+
+
+Gauge(
+    "p2p_discovery_peers", "Peers currently known through discovery.", lambda: len(peer_registry)
+)
+Gauge("p2p_sse_clients", "Connected SSE clients.", lambda: len(sse_clients))
+Gauge(
+    "p2p_sse_queued_messages",
+    "Messages waiting across all SSE client queues.",
+    lambda: sum(_sse_queue_depths()),
+)
+Gauge(
+    "p2p_sse_queue_depth_max",
+    "Deepest SSE client queue.",
+    lambda: max(_sse_queue_depths(), default=0),
+)
+
+
+def _thread_component(name):
+    # Per-request threads are pooled under one label each
+    if "process_request_thread" in name:
+        return "http"  # werkzeug, one thread per request
+    if name.startswith("asyncio_"):
+        return "executor"  # Default executor of the asyncio runtime
+    return name
+
+
+def _thread_cpu_seconds():
+    """CPU seconds used so far by the live threads, summed per component (Unix only)."""
+    if not hasattr(time, "pthread_getcpuclockid"):
+        return {}
+    totals = {}
+    for thread in threading.enumerate():
+        try:
+            used = time.clock_gettime(time.pthread_getcpuclockid(thread.ident))
+        except (OSError, TypeError):
+            continue  # Thread exited meanwhile (or was never started)
+        component = _thread_component(thread.name)
+        totals[component] = totals.get(component, 0.0) + used
+    return totals
+
+
+Gauge(
+    "p2p_thread_cpu_seconds",
+    "CPU seconds used by the live threads of each component (werkzeug request threads "
+    "are 'http', asyncio executor threads 'executor').",
+    _thread_cpu_seconds,
+    label="component",
+)
+
+
+def _feed_viewer_counts():
+    # Leaves out the recorder's internal viewers, which are not connections
+    with peer_feed_clients_lock:
+        counts = {
+            peer_id: sum(not viewer.internal for viewer in viewers)
+            for peer_id, viewers in peer_feed_clients.items()
+        }
+    return {peer_id: count for peer_id, count in counts.items() if count}
+
+
+Gauge(
+    "p2p_peer_feed_viewers",
+    "Open /video_feed connections per peer.",
+    _feed_viewer_counts,
+    label="peer",
+)
+
+
 # --- Flask App ---
 app = Flask(__name__)
 # Secret key is needed for session management if we ever use flask session cookies more extensively
@@ -86,34 +446,2746 @@ def generate_peer_id(ip, port):
     return f"{ip}:{port}"
 
 
-def notify_sse_clients(event_type, data):
-    """Sends an event to all connected SSE clients."""
+def encoded_view(buffer):
+    """Flat memoryview of a cv2.imencode() result, so it can be sent without a copy.
+
+    JPEGs stay in their encode buffer (or, on the receiving side, in the zmq.Frame they
+    arrived in) all the way to the HTTP response, where mjpeg_part() makes the one copy.
+    """
+    return memoryview(buffer).cast("B")
+
+
+# --- Frame Pacing ---
+
+
+class FramePacer:
+    """Paces a loop against time.monotonic() deadlines instead of fixed sleeps.
+
+    Each wait() sleeps only for what is left of the current frame interval, so capture
+    and encode time no longer add to the period. When the loop falls behind, missed
+    deadlines are skipped rather than caught up, so lag never accumulates. Achieved
+    versus target fps is measured over PACING_REPORT_INTERVAL windows.
+    """
+
+    def __init__(self, name, target_fps, report_interval=PACING_REPORT_INTERVAL):
+        self.name = name
+        self.target_fps = target_fps
+        self.report_interval = report_interval
+        self.achieved_fps = 0.0
+        self.skipped_total = 0  # Deadlines given up because the loop was late
+        self._next_deadline = None
+        self._window_start = time.monotonic()
+        self._window_frames = 0
+
+    def set_target(self, target_fps):
+        self.target_fps = target_fps
+
+    def reset(self):
+        """Starts over after the loop idled on purpose (e.g. a paused feed), so the idle
+        time counts neither as skipped deadlines nor against the achieved fps."""
+        self._next_deadline = None
+        self._window_start = time.monotonic()
+        self._window_frames = 0
+
+    def wait(self):
+        """Marks one frame as done and sleeps until the next deadline."""
+        time.sleep(self.next_delay())
+
+    def next_delay(self):
+        """Marks one frame as done and returns the seconds left until the next deadline.
+
+        For callers that sleep themselves, e.g. coroutines using asyncio.sleep().
+        """
+        now = time.monotonic()
+        interval = 1.0 / self.target_fps
+        self._window_frames += 1
+        self._measure(now)
+
+        if self._next_deadline is None:
+            self._next_deadline = now
+        self._next_deadline += interval
+        if self._next_deadline < now:
+            # Behind schedule: drop the missed slots and realign to the next one
+            missed = int((now - self._next_deadline) / interval) + 1
+            self.skipped_total += missed
+            self._next_deadline += missed * interval
+        return self._next_deadline - now
+
+    def _measure(self, now):
+        elapsed = now - self._window_start
+        if elapsed < self.report_interval:
+            return
+        self.achieved_fps = self._window_frames / elapsed
+        self._window_start = now
+        self._window_frames = 0
+        if self.achieved_fps < PACING_WARN_RATIO * self.target_fps:
+            logging.warning(
+                f"[Pacing] {self.name} can't keep up: {self.achieved_fps:.1f}/"
+                f"{self.target_fps} fps ({self.skipped_total} deadlines skipped so far)"
+            )
+
+    def stats(self):
+        return {
+            "target_fps": round(self.target_fps, 2),
+            "achieved_fps": round(self.achieved_fps, 2),
+            "skipped_deadlines": self.skipped_total,
+        }
+
+
+pacers = {}  # { name: FramePacer } for every running paced loop, reported by /api/stats
+pacers_lock = threading.Lock()
+_pacer_ids = itertools.count(1)
+
+
+def register_pacer(name, target_fps, unique=False):
+    """Creates a FramePacer and lists it for reporting. unique=True suffixes a counter,
+    for loops that run once per client such as self-view streams."""
+    if unique:
+        name = f"{name}#{next(_pacer_ids)}"
+    pacer = FramePacer(name, target_fps)
+    with pacers_lock:
+        pacers[name] = pacer
+    return pacer
+
+
+def unregister_pacer(pacer):
+    with pacers_lock:
+        if pacers.get(pacer.name) is pacer:
+            del pacers[pacer.name]
+
+
+# --- Stream Statistics ---
+
+
+class PeerStreamStats:
+    """Loss, reordering, one-way latency and jitter of one peer's video stream.
+
+    Loss and reordering come from the header sequence numbers. Latency compares the
+    header's capture time with local arrival time, corrected by a clock offset taken as
+    the minimum of (arrival - send time) over recent discovery heartbeats; the minimum
+    filters out queueing delay, leaving offset plus the (small, LAN) base delay.
+    Jitter is the RFC 3550 interarrival estimate.
+    """
+
+    EWMA_WEIGHT = 1 / 16  # Same smoothing RFC 3550 uses for jitter
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clock_samples = collections.deque(maxlen=CLOCK_OFFSET_SAMPLES)
+        self._last_report = 0.0
+        self._reset_sequence()
+
+    def _reset_sequence(self):
+        self.received = 0
+        self.reordered = 0
+        self.first_seq = None
+        self.highest_seq = None
+        self._expected_before = 0  # Frames expected in earlier subscriptions (restart_sequence)
+        self.latency = None  # Smoothed one-way latency in seconds
+        self.jitter = 0.0
+        self.encode = None  # Smoothed sender encode time in seconds
+        self._last_transit = None
+        self._reported_expected = 0  # expected and received at the last take_interval_loss()
+        self._reported_received = 0
+
+    def record_clock_sample(self, remote_time, local_time):
+        """Adds one (heartbeat send time, local arrival time) pair."""
+        with self._lock:
+            self._clock_samples.append(local_time - remote_time)
+
+    def clock_offset(self):
+        """Estimated local minus remote clock, or None before the first heartbeat."""
+        return min(self._clock_samples) if self._clock_samples else None
+
+    def restart_sequence(self):
+        """Starts a new sequence baseline when we subscribe to the peer again.
+
+        Frames sent while we were not subscribed were never meant for us, so the gap in
+        sequence numbers must not count as loss. Totals of earlier subscriptions are kept.
+        """
+        with self._lock:
+            self._expected_before = self._expected()
+            self.first_seq = self.highest_seq = None
+            self._last_transit = None
+
+    def _expected(self):
+        segment = self.highest_seq - self.first_seq + 1 if self.first_seq is not None else 0
+        return self._expected_before + segment
+
+    def record_frame(self, seq, captured_at, encode_seconds, arrived_at):
+        with self._lock:
+            if self.highest_seq is not None and seq + 1000 < self.highest_seq:
+                # Far behind the stream: the sender restarted its counter
+                self._reset_sequence()
+            if self.first_seq is None:
+                self.first_seq = self.highest_seq = seq
+            elif seq > self.highest_seq:
+                self.highest_seq = seq
+            elif seq < self.highest_seq:
+                self.reordered += 1
+            self.received += 1
+
+            w = self.EWMA_WEIGHT
+            self.encode = (
+                encode_seconds
+                if self.encode is None
+                else self.encode + w * (encode_seconds - self.encode)
+            )
+
+            offset = self.clock_offset()
+            transit = arrived_at - captured_at - (offset or 0.0)
+            if offset is not None:
+                self.latency = (
+                    transit
+                    if self.latency is None
+                    else self.latency + w * (transit - self.latency)
+                )
+            if self._last_transit is not None:
+                self.jitter += w * (abs(transit - self._last_transit) - self.jitter)
+            self._last_transit = transit
+
+    def take_interval_loss(self):
+        """Share of frames lost since the previous call, or None if none were expected.
+
+        This is what our heartbeats report back to the sender, as RTCP receiver reports do.
+        """
+        with self._lock:
+            expected = self._expected()
+            interval_expected = expected - self._reported_expected
+            interval_received = self.received - self._reported_received
+            self._reported_expected = expected
+            self._reported_received = self.received
+            if interval_expected <= 0:
+                return None
+            return max(0, interval_expected - interval_received) / interval_expected
+
+    def report_due(self, interval):
+        """True at most once per interval, for rate-limited stats reporting."""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_report < interval:
+                return False
+            self._last_report = now
+            return True
+
+    def snapshot(self):
+        with self._lock:
+            expected = self._expected()
+            lost = max(0, expected - self.received)
+            offset = self.clock_offset()
+            return {
+                "received": self.received,
+                "lost": lost,
+                "loss_rate": round(lost / expected, 4) if expected else 0.0,
+                "reordered": self.reordered,
+                "latency_ms": round(self.latency * 1000, 2)
+                if self.latency is not None
+                else None,
+                "jitter_ms": round(self.jitter * 1000, 2),
+                "encode_ms": round(self.encode * 1000, 2)
+                if self.encode is not None
+                else None,
+                "clock_offset_ms": round(offset * 1000, 2) if offset is not None else None,
+            }
+
+
+class SubscriberLossReports:
+    """Loss our subscribers reported back in their heartbeats, per subscriber.
+
+    The PUB socket drops messages for a slow subscriber on its own, without telling the
+    sender, so this is how the adaptive publisher learns about congestion.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latest = {}  # { peer_id: share of our frames lost in its last report }
+        self._worst = None  # Highest share reported since the last take_worst()
+
+    def add(self, peer_id, lost):
+        with self._lock:
+            self._latest[peer_id] = lost
+            self._worst = lost if self._worst is None else max(self._worst, lost)
+
+    def take_worst(self):
+        """The highest loss reported since the previous call, or None if nothing came in."""
+        with self._lock:
+            worst, self._worst = self._worst, None
+            return worst
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._latest)
+
+
+subscriber_loss = SubscriberLossReports()
+
+
+# --- Frame Mailboxes ---
+
+
+class ChangeListeners:
+    """Callbacks a producer runs after publishing something new.
+
+    The blocking wait methods serve threads; listeners let other consumers, such as
+    coroutines of the asyncio runtime, be woken without parking a thread per consumer.
+    Callbacks run on the producer's thread and must be quick and non-blocking.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._callbacks = ()  # Replaced on change, so notify() iterates without the lock
+
+    def add(self, callback):
+        with self._lock:
+            self._callbacks = self._callbacks + (callback,)
+
+    def remove(self, callback):
+        with self._lock:
+            self._callbacks = tuple(cb for cb in self._callbacks if cb is not callback)
+
+    def notify(self):
+        for callback in self._callbacks:
+            callback()
+
+
+class FrameMailbox:
+    """Latest-wins single-slot buffer: a new frame replaces the previous one.
+
+    Consumers always get the freshest frame and memory stays at one frame per mailbox.
+    Each consumer remembers the version it saw last and blocks in wait_newer() until
+    the producer's put() notifies it, so nothing polls. dropped counts frames that were
+    replaced before any consumer read them, while one was watching.
+    """
+
+    def __init__(self):
+        self._changed = threading.Condition(threading.Lock())
+        self._frame = None
+        self._captured_at = None  # Sender's capture time.time() of _frame
+        self._read = True  # Whether any consumer has read the current version
+        self.version = 0
+        self.dropped = 0
+        self.listeners = ChangeListeners()
+
+    def put(self, frame, captured_at=None, watched=True):
+        """Stores frame and wakes waiting consumers. Returns True if an unread frame was dropped.
+
+        watched=False means no consumer is reading, so an unread frame is not a drop.
+        """
+        with self._changed:
+            dropped = watched and not self._read
+            if dropped:
+                self.dropped += 1
+            self._frame = frame
+            self._captured_at = captured_at
+            self._read = False
+            self.version += 1
+            self._changed.notify_all()
+        self.listeners.notify()
+        return dropped
+
+    def wait_newer(self, version, timeout=None):
+        """Waits for a frame newer than version. Returns (version, frame, captured_at), or
+        (version, None, None) on timeout."""
+        with self._changed:
+            if self.version == version:
+                self._changed.wait_for(lambda: self.version != version, timeout)
+            if self.version == version:
+                return version, None, None
+            self._read = True
+            return self.version, self._frame, self._captured_at
+
+
+class FeedViewer:
+    """One open /video_feed/<peer_id> connection."""
+
+    __slots__ = ("peer_id", "version", "width", "throttle", "internal")
+
+    def __init__(self, peer_id, width=None, throttle=None, internal=False):
+        self.peer_id = peer_id
+        self.version = 0  # Mailbox version last sent to this viewer
+        self.width = width  # Pixels the browser shows the feed at, picks the simulcast layer
+        self.throttle = throttle or FeedThrottle()
+        # Keeps the peer received without reading its mailbox (the recorder's viewers);
+        # left out of the viewer and dropped-frame metrics
+        self.internal = internal
+
+
+# --- Viewer Budgets ---
+
+
+class ViewerBudget:
+    """What one browser page wants streamed: a frame-rate cap and the peers it shows.
+
+    Declared with /events?fps=&peers= and changed through POST /api/viewer/<viewer_id>,
+    e.g. to fps 0 while the page is hidden. Every feed opened with ?viewer=<viewer_id>
+    follows it. fps None means uncapped and 0 paused; peers None means every peer.
+    """
+
+    def __init__(self, fps=None, peers=None):
+        self.viewer_id = secrets.token_hex(8)
+        self._changed = threading.Condition(threading.Lock())
+        self.fps = None
+        self.peers = None
+        self.version = 0
+        self.listeners = ChangeListeners()
+        self.update(fps, peers)
+
+    def update(self, fps=None, peers=None):
+        """Replaces the budget and wakes the feeds following it."""
+        with self._changed:
+            self.fps = None if fps is None else max(0.0, float(fps))
+            self.peers = None if peers is None else frozenset(peers)
+            self.version += 1
+            self._changed.notify_all()
+        self.listeners.notify()
+
+    def shows(self, peer_id=None):
+        """Whether the page wants anything streamed (of peer_id, if given) right now."""
+        if self.fps == 0:
+            return False
+        return peer_id is None or self.peers is None or peer_id in self.peers
+
+    def wait_changed(self, version, timeout):
+        """Waits up to timeout seconds for a budget newer than version. Returns the version."""
+        with self._changed:
+            if self.version == version:
+                self._changed.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+    def stats(self):
+        peers = None if self.peers is None else sorted(self.peers)
+        return {"fps": self.fps, "peers": peers}
+
+
+class FeedThrottle:
+    """Frame-rate cap of one MJPEG feed: its own ?fps= and its page's ViewerBudget.
+
+    Nothing is queued for a throttled feed. It sleeps until its next slot and then
+    sends whatever frame is newest, so the frames in between coalesce away for free.
+    """
+
+    __slots__ = ("fps", "budget", "_budget_version", "_next_due")
+
+    def __init__(self, fps=None, budget=None):
+        self.fps = fps if fps and fps > 0 else None
+        self.budget = budget
+        self._budget_version = budget.version if budget else 0
+        self._next_due = 0.0
+
+    def target_fps(self):
+        """Frames per second this feed may send: None if uncapped, 0 while paused."""
+        budget_fps = self.budget.fps if self.budget else None
+        if budget_fps is None:
+            return self.fps
+        if self.fps is None:
+            return budget_fps
+        return min(self.fps, budget_fps)
+
+    def limit(self, fps):
+        """The lower of fps and this feed's cap."""
+        target = self.target_fps()
+        return fps if target is None else min(fps, target)
+
+    def active(self, peer_id=None):
+        """Whether the feed should stream at all, i.e. its page is visible and shows peer_id."""
+        if self.target_fps() == 0:
+            return False
+        return self.budget is None or self.budget.shows(peer_id)
+
+    def delay(self):
+        """Seconds until this feed may send its next frame (0 if now)."""
+        if not self.target_fps():
+            return 0.0
+        return max(0.0, self._next_due - time.monotonic())
+
+    def sent(self):
+        """Books the slot of a frame that was just sent."""
+        fps = self.target_fps()
+        if fps:
+            interval = 1.0 / fps
+            now = time.monotonic()
+            # A slightly late frame keeps the average rate exact; after idling (or the
+            # first frame) the next slot is a full interval away, no slots are saved up
+            if now - self._next_due < interval:
+                self._next_due += interval
+            else:
+                self._next_due = now + interval
+
+    def wait(self, timeout):
+        """Sleeps up to timeout seconds, returning early once the page changes its budget."""
+        if self.budget is None:
+            time.sleep(timeout)
+            return
+        self._budget_version = self.budget.wait_changed(self._budget_version, timeout)
+
+
+# --- Peer Registry ---
+
+
+class PeerRecord:
+    """Everything this node keeps about one peer of the room.
+
+    name, addr and last_seen are written by discovery only; the frame counters by the
+    subscriber only. The mailbox and stats do their own locking, per peer.
+    """
+
+    __slots__ = (
+        "peer_id",
+        "name",
+        "addr",
+        "last_seen",
+        "mailbox",
+        "stats",
+        "frames_received",
+        "source_width",
+    )
+
+    def __init__(self, peer_id, name, addr, last_seen):
+        self.peer_id = peer_id
+        self.name = name
+        self.addr = addr  # (ip, zmq_port)
+        self.last_seen = last_seen  # Local time.time() of the latest heartbeat
+        self.mailbox = FrameMailbox()  # Latest received frame
+        self.stats = PeerStreamStats()  # Loss/latency/jitter of the peer's stream
+        self.frames_received = 0
+        self.source_width = None  # Width of the peer's full layer, learned from its frames
+
+
+class PeerRegistry:
+    """The peers of the current room, by peer ID.
+
+    Reads take no lock: the table is a dict that is never changed once published, only
+    replaced by a modified copy (copy-on-write) when a peer joins or leaves. So looking
+    up a peer for every received frame costs a dict lookup, and snapshot() hands out a
+    table that stays consistent while the caller iterates. Writers are serialized by
+    _write_lock; joins and leaves are rare next to frames.
+    """
+
+    def __init__(self):
+        self._write_lock = threading.Lock()
+        self._records = {}  # { peer_id: PeerRecord }, replaced on every change
+
+    def __len__(self):
+        return len(self._records)
+
+    def get(self, peer_id):
+        return self._records.get(peer_id)
+
+    def snapshot(self):
+        """The current table; do not modify it."""
+        return self._records
+
+    def update(self, heartbeats):
+        """Records { peer_id: (name, addr, last_seen) }. Returns the records of new peers."""
+        with self._write_lock:
+            records = self._records
+            added = []
+            for peer_id, (name, addr, last_seen) in heartbeats.items():
+                record = records.get(peer_id)
+                if record is None:
+                    added.append(PeerRecord(peer_id, name, addr, last_seen))
+                    continue
+                record.name = name
+                record.addr = addr
+                record.last_seen = last_seen
+            if added:
+                records = dict(records)
+                records.update((record.peer_id, record) for record in added)
+                self._records = records
+            return added
+
+    def remove_if(self, peer_id, predicate):
+        """Removes peer_id if predicate(record) holds. Returns the removed record or None."""
+        with self._write_lock:
+            record = self._records.get(peer_id)
+            if record is None or not predicate(record):
+                return None
+            records = dict(self._records)
+            del records[peer_id]
+            self._records = records
+            return record
+
+    def clear(self):
+        """Removes every peer. Returns their records."""
+        with self._write_lock:
+            departed, self._records = self._records, {}
+        return list(departed.values())
+
+
+peer_registry = PeerRegistry()
+
+
+# --- Frame Sources ---
+
+
+class FrameSource:
+    """Where the capture hub gets its frames from (--source).
+
+    open() may be called again after close(); read() blocks for up to one frame interval
+    and returns (ok, frame) like cv2.VideoCapture.read(). Every frame must be a new array,
+    since consumers keep references to the frames they were handed.
+    """
+
+    def open(self, size):
+        """Starts producing frames, at size if the source can choose. Returns False on failure."""
+        raise NotImplementedError
+
+    def read(self):
+        raise NotImplementedError
+
+    def read_encoded(self):
+        """read() plus the capture time and the JPEGs the source already encoded: returns
+        (ok, frame, captured_at, { (width, height, quality): jpeg })."""
+        ret, frame = self.read()
+        return ret, frame, time.time(), {}
+
+    def want_jpegs(self, keys):
+        """Told the (width, height, quality) encodings consumers used of the last frame,
+        for sources that can encode them in advance."""
+
+    def close(self):
+        pass
+
+
+class CameraSource(FrameSource):
+    """A capture device, paced by the camera itself."""
+
+    def __init__(self, device=CAMERA_DEVICE):
+        self.device = device
+        self._cap = None
+
+    def __str__(self):
+        return f"camera {self.device}"
+
+    def open(self, size):
+        cap = cv2.VideoCapture(self.device)
+        if not cap.isOpened():
+            cap.release()
+            return False
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, size[0])
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, size[1])
+        logging.info(
+            f"[CaptureHub] Camera opened with resolution "
+            f"{cap.get(cv2.CAP_PROP_FRAME_WIDTH)}x{cap.get(cv2.CAP_PROP_FRAME_HEIGHT)}"
+        )
+        self._cap = cap
+        return True
+
+    def read(self):
+        return self._cap.read()
+
+    def close(self):
+        if self._cap is not None:
+            self._cap.release()
+            self._cap = None
+
+
+class PacedSource(FrameSource):
+    """Base for sources that can produce frames faster than real time (generated or
+    replayed); read() paces them to fps."""
+
+    def __init__(self, fps):
+        self.fps = fps
+        self._pacer = None
+
+    def open(self, size):
+        self._pacer = register_pacer("capture", self.fps)
+        return True
+
+    def read(self):
+        time.sleep(self._pacer.next_delay())
+        return self.next_frame()
+
+    def next_frame(self):
+        raise NotImplementedError
+
+    def close(self):
+        if self._pacer is not None:
+            unregister_pacer(self._pacer)
+            self._pacer = None
+
+
+class SyntheticSource(PacedSource):
+    """Deterministic test pattern: a gradient with a square moving motion pixels per frame
+    and the frame number printed on it. Frame n is the same on every run and host."""
+
+    def __init__(self, size=CAPTURE_SIZE, fps=PUBLISH_FPS, motion=SYNTHETIC_MOTION):
+        super().__init__(fps)
+        self.size = size
+        self.motion = motion
+        self._index = 0
+        self._background = None
+
+    def __str__(self):
+        return f"synthetic {self.size[0]}x{self.size[1]}@{self.fps},motion={self.motion}"
+
+    def open(self, size):
+        width, height = self.size
+        x = np.linspace(0, 255, width, dtype=np.uint8)
+        y = np.linspace(0, 255, height, dtype=np.uint8)
+        background = np.empty((height, width, 3), np.uint8)
+        background[:, :, 0] = x[np.newaxis, :]
+        background[:, :, 1] = y[:, np.newaxis]
+        background[:, :, 2] = 128
+        self._background = background
+        self._index = 0
+        return super().open(size)
+
+    def next_frame(self):
+        width, height = self.size
+        frame = self._background.copy()
+        side = max(8, min(width, height) // 6)
+        span_x, span_y = max(1, width - side), max(1, height - side)
+        x = (self._index * self.motion) % span_x
+        y = (self._index * self.motion // 2) % span_y
+        frame[y : y + side, x : x + side] = 255
+        cv2.putText(
+            frame, str(self._index), (10, height - 10), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 0, 0), 2
+        )
+        self._index += 1
+        return True, frame
+
+
+class VideoFileSource(PacedSource):
+    """A video file played in a loop at its own frame rate."""
+
+    def __init__(self, path):
+        super().__init__(PUBLISH_FPS)
+        self.path = path
+        self._cap = None
+
+    def __str__(self):
+        return f"file {self.path}"
+
+    def open(self, size):
+        cap = cv2.VideoCapture(self.path)
+        if not cap.isOpened():
+            cap.release()
+            return False
+        self.fps = cap.get(cv2.CAP_PROP_FPS) or PUBLISH_FPS  # 0 if the container has none
+        self._cap = cap
+        logging.info(f"[CaptureHub] Playing {self.path} at {self.fps:.1f} fps")
+        return super().open(size)
+
+    def next_frame(self):
+        ret, frame = self._cap.read()
+        if not ret:
+            # End of file: rewind and loop
+            self._cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self._cap.read()
+        return ret, frame
+
+    def close(self):
+        super().close()
+        if self._cap is not None:
+            self._cap.release()
+            self._cap = None
+
+
+class ImageSequenceSource(PacedSource):
+    """The JPEG files of a directory, in name order, replayed in a loop at fps."""
+
+    def __init__(self, directory, fps=PUBLISH_FPS):
+        super().__init__(fps)
+        self.directory = directory
+        self._paths = []
+        self._index = 0
+
+    def __str__(self):
+        return f"images {self.directory}@{self.fps}"
+
+    def open(self, size):
+        try:
+            names = sorted(os.listdir(self.directory))
+        except OSError as e:
+            logging.error(f"[CaptureHub] Cannot list {self.directory}: {e}")
+            return False
+        self._paths = [
+            os.path.join(self.directory, name)
+            for name in names
+            if name.lower().endswith((".jpg", ".jpeg"))
+        ]
+        if not self._paths:
+            logging.error(f"[CaptureHub] No JPEG files in {self.directory}")
+            return False
+        self._index = 0
+        logging.info(f"[CaptureHub] Replaying {len(self._paths)} images from {self.directory}")
+        return super().open(size)
+
+    def next_frame(self):
+        path = self._paths[self._index]
+        self._index = (self._index + 1) % len(self._paths)
+        frame = cv2.imread(path, cv2.IMREAD_COLOR)
+        return frame is not None, frame
+
+
+def parse_frame_source(spec):
+    """Builds a FrameSource from a --source value:
+
+    camera[:DEVICE]                          capture device (index or path)
+    synthetic[:WxH][@FPS][,motion=PIXELS]    generated test pattern
+    file:PATH                                video file, looped
+    images:DIR[@FPS]                         JPEG files of a directory, looped
+    """
+    kind, _, arg = spec.partition(":")
+    if kind == "camera":
+        if not arg:
+            return CameraSource()
+        return CameraSource(int(arg) if arg.isdigit() else arg)
+    if kind == "synthetic":
+        match = re.fullmatch(r"(?:(\d+)x(\d+))?(?:@(\d+))?(?:,motion=(\d+))?", arg)
+        if not match:
+            raise argparse.ArgumentTypeError(
+                f"bad synthetic source '{arg}', expected WxH@FPS,motion=PIXELS"
+            )
+        width, height, fps, motion = match.groups()
+        return SyntheticSource(
+            size=(int(width), int(height)) if width else CAPTURE_SIZE,
+            fps=int(fps) if fps else PUBLISH_FPS,
+            motion=int(motion) if motion is not None else SYNTHETIC_MOTION,
+        )
+    if kind == "file" and arg:
+        return VideoFileSource(arg)
+    if kind == "images" and arg:
+        directory, at, fps = arg.rpartition("@")
+        if at and fps.isdigit():
+            return ImageSequenceSource(directory, int(fps))
+        return ImageSequenceSource(arg)
+    raise argparse.ArgumentTypeError(f"unknown frame source '{spec}'")
+
+
+class CaptureWorker(FrameSource):
+    """Runs another source, plus the JPEG encodes, in a worker process (--capture-process).
+
+    Capture and encoding then get their own core and interpreter, so neither stalls nor is
+    stalled by the web server and ZMQ threads. The worker writes each frame, raw and in
+    every encoding consumers asked for recently, into a slot of a shared-memory ring and
+    sends its sequence number over a pipe; read_encoded() copies the slot out.
+
+    Each slot starts with CAPTURE_SLOT_HEADER, whose sequence number the worker zeroes
+    before rewriting the slot and sets last, so a reader that was overtaken by the ring
+    sees a different number afterwards and drops the frame instead of using a torn one.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self._process = None
+        self._conn = None
+        self._ring = None
+        self._slot_size = 0
+        self._wanted = {}  # { (width, height, quality): monotonic() it was last used }
+        self._requested = frozenset()  # Encodings the worker was last told to produce
+
+    def __str__(self):
+        return f"{self.source} (worker process)"
+
+    def open(self, size):
+        raw_bytes = size[0] * size[1] * 3
+        self._slot_size = CAPTURE_SLOT_HEADER.size + raw_bytes + CAPTURE_RING_JPEG_BYTES
+        self._ring = shared_memory.SharedMemory(
+            create=True, size=self._slot_size * CAPTURE_RING_SLOTS
+        )
+        # spawn: a fresh interpreter, not a fork of this one with its threads and sockets
+        context = multiprocessing.get_context("spawn")
+        self._conn, worker_conn = context.Pipe()
+        self._process = context.Process(
+            target=capture_worker_main,
+            args=(self.source, size, self._ring.name, self._slot_size, worker_conn),
+            name="CaptureWorker",
+            daemon=True,
+        )
+        self._process.start()
+        worker_conn.close()
+        self._wanted = {}
+        self._requested = frozenset()
+        # The worker imports this module first, which takes a moment
+        if self._conn.poll(CAPTURE_WORKER_START_TIMEOUT):
+            try:
+                kind, value = self._conn.recv()
+                if kind == "ready" and value:
+                    logging.info(f"[CaptureHub] Worker process {self._process.pid} started.")
+                    return True
+            except EOFError:
+                pass
+        return False
+
+    def read(self):
+        ret, frame, _, _ = self.read_encoded()
+        return ret, frame
+
+    def read_encoded(self):
+        try:
+            if not self._conn.poll(CAPTURE_WORKER_READ_TIMEOUT):
+                return False, None, None, {}
+            seq = None
+            while seq is None or self._conn.poll():
+                kind, value = self._conn.recv()
+                if kind == "frame":
+                    seq = value  # Only the latest counts, like every consumer of the hub
+                else:
+                    return False, None, None, {}  # ("error", text): the grab failed
+        except (EOFError, OSError):
+            return False, None, None, {}  # Worker gone
+        return self._read_slot(seq)
+
+    def _read_slot(self, seq):
+        buf = self._ring.buf
+        offset = (seq % CAPTURE_RING_SLOTS) * self._slot_size
+        slot_seq, captured_at, width, height, count = CAPTURE_SLOT_HEADER.unpack_from(buf, offset)
+        if slot_seq != seq:
+            return False, None, None, {}  # Already being overwritten
+        position = offset + CAPTURE_SLOT_HEADER.size
+        frame = (
+            np.frombuffer(buf, np.uint8, width * height * 3, position)
+            .reshape(height, width, 3)
+            .copy()
+        )
+        position += frame.nbytes
+        jpegs = {}
+        for _ in range(count):
+            jpeg_width, jpeg_height, quality, length = CAPTURE_SLOT_JPEG.unpack_from(
+                buf, position
+            )
+            position += CAPTURE_SLOT_JPEG.size
+            jpegs[(jpeg_width, jpeg_height, quality)] = bytes(buf[position : position + length])
+            position += length
+        if CAPTURE_SLOT_HEADER.unpack_from(buf, offset)[0] != seq:
+            return False, None, None, {}  # Overwritten while copying
+        return True, frame, captured_at, jpegs
+
+    def want_jpegs(self, keys):
+        now = time.monotonic()
+        for key in keys:
+            self._wanted[key] = now
+        for key, used_at in list(self._wanted.items()):
+            if now - used_at > CAPTURE_WORKER_ENCODING_TTL:
+                del self._wanted[key]
+        wanted = frozenset(self._wanted)
+        if wanted != self._requested:
+            self._requested = wanted
+            try:
+                self._conn.send(("encodings", sorted(wanted)))
+            except OSError:
+                pass  # Worker gone, read_encoded() reports it
+
+    def close(self):
+        if self._process is not None:
+            try:
+                self._conn.send(("stop", None))
+            except OSError:
+                pass
+            self._process.join(timeout=2.0)
+            if self._process.is_alive():
+                logging.warning("[CaptureHub] Worker process did not stop, terminating it.")
+                self._process.terminate()
+                self._process.join()
+            self._process = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        if self._ring is not None:
+            self._ring.close()
+            self._ring.unlink()
+            self._ring = None
+
+
+def capture_worker_main(source, size, ring_name, slot_size, conn):
+    """Body of the CaptureWorker process: capture, encode, write the ring, notify."""
+    ring = shared_memory.SharedMemory(name=ring_name)
+    buf = ring.buf
+    raw_bytes = size[0] * size[1] * 3
+    encodings = []  # [(width, height, quality), ...] requested by the main process
+    seq = 0
+    opened = source.open(size)
+    try:
+        conn.send(("ready", opened))
+        while opened:
+            while conn.poll():
+                kind, value = conn.recv()
+                if kind == "stop":
+                    return
+                encodings = value
+            ret, frame = source.read()
+            captured_at = time.time()
+            if not ret:
+                conn.send(("error", None))
+                time.sleep(0.1)
+                continue
+            if frame.nbytes > raw_bytes:
+                frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+            seq += 1
+            offset = (seq % CAPTURE_RING_SLOTS) * slot_size
+            end = offset + slot_size
+            CAPTURE_SLOT_HEADER.pack_into(buf, offset, 0, 0.0, 0, 0, 0)  # Invalidate
+            position = offset + CAPTURE_SLOT_HEADER.size
+            height, width = frame.shape[:2]
+            buf[position : position + frame.nbytes] = np.ascontiguousarray(frame).reshape(-1)
+            position += frame.nbytes
+            count = 0
+            for jpeg_width, jpeg_height, quality in encodings:
+                image = frame
+                if (width, height) != (jpeg_width, jpeg_height):
+                    image = cv2.resize(
+                        frame, (jpeg_width, jpeg_height), interpolation=cv2.INTER_AREA
+                    )
+                ret, jpeg = cv2.imencode(".jpg", image, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+                if not ret or position + CAPTURE_SLOT_JPEG.size + len(jpeg) > end:
+                    continue  # The main process encodes what is missing itself
+                CAPTURE_SLOT_JPEG.pack_into(
+                    buf, position, jpeg_width, jpeg_height, quality, len(jpeg)
+                )
+                position += CAPTURE_SLOT_JPEG.size
+                buf[position : position + len(jpeg)] = jpeg.reshape(-1)
+                position += len(jpeg)
+                count += 1
+            CAPTURE_SLOT_HEADER.pack_into(buf, offset, seq, captured_at, width, height, count)
+            conn.send(("frame", seq))
+    except (EOFError, OSError, KeyboardInterrupt):
+        pass  # Main process gone or interrupted
+    finally:
+        source.close()
+        del buf
+        ring.close()
+
+
+# --- Camera Capture Hub ---
+
+
+class CaptureHub:
+    """Owns the frame source and shares each captured frame with all registered consumers.
+
+    The source (the camera unless --source says otherwise) is opened when the first
+    consumer acquires the hub and closed when the last one leaves. JPEG encodings are
+    cached per (size, quality) for the latest frame, so the publisher and any number of
+    self-view streams share one capture and one encode.
+    """
+
+    def __init__(self, source=None, size=CAPTURE_SIZE):
+        self.source = source or CameraSource()
+        self.size = size
+        self._device_lock = threading.Lock()  # Serializes opening/closing the device
+        self._lock = threading.Lock()
+        self._frame_ready = threading.Condition(self._lock)
+        self._consumers = 0
+        self._thread = None
+        self._stop = threading.Event()  # Replaced on every open so an old loop never revives
+        self._seq = 0  # Incremented for every captured frame
+        self._frame = None
+        self._frame_time = 0.0  # Wall-clock capture time of _frame
+        self._frame_interval = None  # Smoothed seconds between captured frames
+        self._encode_lock = threading.Lock()
+        self._jpeg_cache_seq = -1
+        self._jpeg_cache = {}  # { (width, height, quality): jpeg_bytes } for _jpeg_cache_seq
+        self._jpeg_used = set()  # Keys get_jpeg() was asked for since the last frame
+        self.listeners = ChangeListeners()  # Run after every captured frame
+
+    def acquire(self):
+        """Registers a consumer, opening the source if needed. Returns False if it cannot be opened."""
+        with self._device_lock:
+            with self._lock:
+                if self._consumers > 0:
+                    self._consumers += 1
+                    return True
+            # Open under _device_lock only: a capture worker may take up to
+            # CAPTURE_WORKER_START_TIMEOUT to start, and wait_frame() needs _lock
+            source = self.source
+            if not source.open(self.size):
+                source.close()
+                logging.error(f"[CaptureHub] Cannot open {source}.")
+                return False
+            stop = threading.Event()
+            thread = threading.Thread(
+                target=self._capture_loop,
+                args=(source, stop),
+                name="CaptureHubThread",
+                daemon=True,
+            )
+            with self._lock:
+                self._frame = None  # Never hand out a frame from a previous session
+                self._frame_interval = None
+                self._stop = stop
+                self._thread = thread
+                self._consumers = 1
+            thread.start()
+            return True
+
+    def release(self):
+        """Unregisters a consumer, closing the camera when the last one leaves."""
+        with self._device_lock:
+            with self._lock:
+                if self._consumers == 0:
+                    return
+                self._consumers -= 1
+                if self._consumers > 0:
+                    return
+                self._stop.set()
+                thread, self._thread = self._thread, None
+                self._frame_ready.notify_all()
+            # Join outside _lock (the loop needs it) but inside _device_lock, so a new
+            # acquire cannot reopen the device before this loop has released it
+            thread.join(timeout=2.0)
+            if thread.is_alive():
+                logging.warning("[CaptureHub] Capture thread did not shut down gracefully.")
+
+    def wait_frame(self, last_seq, timeout=1.0):
+        """Blocks until a frame newer than last_seq is available.
+
+        Returns (seq, frame, capture_time), or (last_seq, None, None) on timeout.
+        """
+        with self._frame_ready:
+            self._frame_ready.wait_for(
+                lambda: (self._seq != last_seq and self._frame is not None)
+                or self._stop.is_set(),
+                timeout,
+            )
+            if self._seq == last_seq or self._frame is None:
+                return last_seq, None, None
+            return self._seq, self._frame, self._frame_time
+
+    def limit_fps(self, fps):
+        """The lower of fps and the rate the source actually delivers, so loops paced
+        on captured frames do not aim for more frames than exist."""
+        interval = self._frame_interval
+        return fps if interval is None else min(fps, 1.0 / interval)
+
+    def get_jpeg(self, seq, frame, size, quality):
+        """Returns the JPEG for frame seq at size/quality, encoding it only once per frame."""
+        key = (size[0], size[1], quality)
+        with self._encode_lock:
+            self._jpeg_used.add(key)
+            if seq > self._jpeg_cache_seq:
+                self._jpeg_cache_seq = seq
+                self._jpeg_cache = {}
+            # A consumer still on an older frame is served but must not replace the
+            # cache of the newer one (which may hold the source's own encodings)
+            cache = self._jpeg_cache if seq == self._jpeg_cache_seq else {}
+            jpeg = cache.get(key)
+            if jpeg is None:
+                if (frame.shape[1], frame.shape[0]) != size:
+                    frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+                ret, buffer = cv2.imencode(
+                    ".jpg", frame, [int(cv2.IMWRITE_JPEG_QUALITY), quality]
+                )
+                if not ret:
+                    return None
+                frames_encoded_total.inc()
+                jpeg = encoded_view(buffer)
+                cache[key] = jpeg
+            return jpeg
+
+    def _capture_loop(self, source, stop):
+        """Reads frames from the source and wakes consumers until the last one releases the hub."""
+        logging.info(f"[CaptureHub] Capture loop starting ({source}).")
+        last_read = None
+        while not stop.is_set():
+            with self._encode_lock:
+                used, self._jpeg_used = self._jpeg_used, set()
+            source.want_jpegs(used)
+            ret, frame, captured_at, jpegs = source.read_encoded()
+            if not ret:
+                logging.warning(f"[CaptureHub] Failed to grab frame from {source}")
+                time.sleep(0.1)  # Avoid busy loop if camera fails temporarily
+                continue
+            frames_captured_total.inc()
+            now = time.monotonic()
+            if last_read is not None:
+                interval = now - last_read
+                self._frame_interval = (
+                    interval
+                    if self._frame_interval is None
+                    else self._frame_interval + (interval - self._frame_interval) / 16
+                )
+            last_read = now
+            if jpegs:
+                frames_encoded_total.inc(len(jpegs))
+            # The frame, its seq and the source's encodings change together, so nobody
+            # sees a seq paired with another frame's JPEGs
+            with self._encode_lock, self._frame_ready:
+                self._seq += 1
+                self._frame = frame
+                self._frame_time = captured_at
+                if jpegs:
+                    # Encoded by the source (a worker process): get_jpeg() serves them as cached
+                    self._jpeg_cache_seq = self._seq
+                    self._jpeg_cache = jpegs
+                self._frame_ready.notify_all()
+            self.listeners.notify()
+        source.close()
+        logging.info(f"[CaptureHub] Capture loop stopped, {source} released.")
+
+
+capture_hub = CaptureHub()
+
+
+# --- Adaptive Publisher Control ---
+
+
+class AdaptivePublishController:
+    """Closed-loop controller for the publisher's JPEG quality, resolution and frame rate.
+
+    Once per window it looks at the loss subscribers report in their heartbeats (network
+    congestion), the average encode time (CPU pressure) and the achieved send rate, and
+    moves one step along the quality -> resolution -> fps ladder. It degrades immediately
+    on trouble and only upgrades after several healthy windows in which the target rate
+    was reached, and not while the latest receiver report still showed loss.
+
+    Congestion is only known from those receiver reports: the PUB socket drops messages
+    for a subscriber at its high water mark without telling the sender.
+    """
+
+    QUALITY_STEP_DOWN = 10
+    QUALITY_STEP_UP = 5
+    FPS_STEP = 5
+    LOSS_RATIO_LIMIT = 0.05  # Share of frames a subscriber lost that counts as congestion
+    ENCODE_BUDGET = 0.5  # Share of the frame interval encoding may use
+    HEALTHY_WINDOWS_TO_UPGRADE = 3
+
+    def __init__(
+        self,
+        min_quality=MIN_JPEG_QUALITY,
+        max_quality=MAX_JPEG_QUALITY,
+        min_fps=MIN_PUBLISH_FPS,
+        max_fps=MAX_PUBLISH_FPS,
+        scales=ADAPTIVE_SCALES,
+        window=ADAPTIVE_WINDOW,
+    ):
+        self.min_quality = min_quality
+        self.max_quality = max(max_quality, min_quality)
+        self.min_fps = min_fps
+        self.max_fps = max(max_fps, min_fps)
+        self.scales = scales
+        self.window = window
+        self.quality = min(max(JPEG_QUALITY, self.min_quality), self.max_quality)
+        self.fps = self.max_fps
+        self.scale_index = 0
+        self._healthy_windows = 0
+        self._receivers_lossy = False  # Whether the latest receiver report showed loss
+        self._reset_window(time.monotonic())
+
+    def _reset_window(self, now):
+        self._window_start = now
+        self._sent = 0
+        self._reported_loss = 0.0
+        self._encode_total = 0.0
+        self._encoded = 0
+
+    @property
+    def scale(self):
+        return self.scales[self.scale_index]
+
+    def frame_size(self, base_size=CAPTURE_SIZE):
+        """Returns the (width, height) to encode base_size at for the current resolution step."""
+        # Keep dimensions even; some decoders dislike odd JPEG sizes
+        return (
+            int(base_size[0] * self.scale) // 2 * 2,
+            int(base_size[1] * self.scale) // 2 * 2,
+        )
+
+    def record_encode(self, seconds):
+        self._encode_total += seconds
+        self._encoded += 1
+
+    def record_sent(self):
+        self._sent += 1
+
+    def record_receiver_loss(self, lost):
+        """Adds the share of frames a subscriber reported lost (see SubscriberLossReports)."""
+        self._reported_loss = max(self._reported_loss, lost)
+        self._receivers_lossy = lost > self.LOSS_RATIO_LIMIT
+
+    def update(self, now=None):
+        """Closes the observation window if it has elapsed. Returns True if settings changed."""
+        now = time.monotonic() if now is None else now
+        elapsed = now - self._window_start
+        if elapsed < self.window:
+            return False
+
+        avg_encode = self._encode_total / self._encoded if self._encoded else 0.0
+        send_fps = self._sent / elapsed
+        reported_loss = self._reported_loss
+        self._reset_window(now)
+
+        congested = reported_loss > self.LOSS_RATIO_LIMIT
+        cpu_bound = avg_encode > self.ENCODE_BUDGET / self.fps
+        before = (self.quality, self.scale_index, self.fps)
+        if congested:
+            self._healthy_windows = 0
+            self._degrade_for_network()
+        elif cpu_bound:
+            self._healthy_windows = 0
+            self._degrade_for_cpu()
+        elif send_fps >= 0.9 * self.fps and not self._receivers_lossy:
+            # Only probe upwards when the current target is actually being met
+            self._healthy_windows += 1
+            if self._healthy_windows >= self.HEALTHY_WINDOWS_TO_UPGRADE:
+                self._healthy_windows = 0
+                self._upgrade()
+        else:
+            self._healthy_windows = 0
+
+        after = (self.quality, self.scale_index, self.fps)
+        if after != before:
+            logging.info(
+                f"[AdaptivePublish] reported_loss={reported_loss:.0%} "
+                f"encode={avg_encode * 1000:.1f}ms sent={send_fps:.1f}fps -> "
+                f"quality={self.quality} "
+                f"scale={self.scale} fps={self.fps}"
+            )
+            return True
+        return False
+
+    def _degrade_for_network(self):
+        """Shrinks frames first (cheapest visually), then lowers resolution, then fps."""
+        if self.quality > self.min_quality:
+            self.quality = max(self.min_quality, self.quality - self.QUALITY_STEP_DOWN)
+        elif self.scale_index < len(self.scales) - 1:
+            self.scale_index += 1
+        elif self.fps > self.min_fps:
+            self.fps = max(self.min_fps, self.fps - self.FPS_STEP)
+
+    def _degrade_for_cpu(self):
+        """Encode cost tracks pixel count and rate, so quality is not worth touching."""
+        if self.scale_index < len(self.scales) - 1:
+            self.scale_index += 1
+        elif self.fps > self.min_fps:
+            self.fps = max(self.min_fps, self.fps - self.FPS_STEP)
+
+    def _upgrade(self):
+        """Restores settings in the reverse order they were given up."""
+        if self.fps < self.max_fps:
+            self.fps = min(self.max_fps, self.fps + self.FPS_STEP)
+        elif self.scale_index > 0:
+            self.scale_index -= 1
+        elif self.quality < self.max_quality:
+            self.quality = min(self.max_quality, self.quality + self.QUALITY_STEP_UP)
+
+
+# --- Delta Frame Publishing ---
+
+
+class DeltaFrameEncoder:
+    """Publisher side of delta mode: decides per frame whether to skip it, send a full
+    frame, or send only the tiles that changed since what was last published.
+
+    Change detection runs on a strided sample of the frame (every DELTA_SAMPLE_STEP-th
+    pixel), reduced to per-tile means with np.add.reduceat, so it costs far less than a
+    JPEG encode. The reference only advances for tiles that were actually sent, so slow
+    drift still crosses the threshold eventually.
+    """
+
+    def __init__(
+        self,
+        tile=DELTA_TILE_SIZE,
+        step=DELTA_SAMPLE_STEP,
+        threshold=DELTA_DIFF_THRESHOLD,
+        max_dirty_ratio=DELTA_MAX_DIRTY_RATIO,
+        refresh_interval=DELTA_REFRESH_INTERVAL,
+    ):
+        self.tile = tile
+        self.step = step
+        self.threshold = threshold
+        self.max_dirty_ratio = max_dirty_ratio
+        self.refresh_interval = refresh_interval
+        self._reference = None  # int16 sample of what receivers currently show
+        self._encode_size = None
+        self._last_full = 0.0
+        self._pending = None  # (sample, dirty_mask or None for full, encode_size, now)
+
+    def plan(self, frame, encode_size, now=None):
+        """Returns ("skip", None), ("full", None) or ("patch", [(x, y, w, h), ...]).
+
+        Patch rectangles are in encode_size coordinates. Call commit() once the
+        resulting message has been sent so the reference moves forward.
+        """
+        now = time.monotonic() if now is None else now
+        sample = frame[:: self.step, :: self.step].astype(np.int16)
+        if (
+            self._reference is None
+            or self._reference.shape != sample.shape
+            or self._encode_size != encode_size
+            or now - self._last_full >= self.refresh_interval
+        ):
+            self._pending = (sample, None, encode_size, now)
+            return "full", None
+
+        # Mean absolute difference per tile, summed per row band and column band
+        cell = self.tile // self.step
+        diff = np.abs(sample - self._reference).sum(axis=2)
+        row_starts = np.arange(0, diff.shape[0], cell)
+        col_starts = np.arange(0, diff.shape[1], cell)
+        tile_sums = np.add.reduceat(np.add.reduceat(diff, row_starts, axis=0), col_starts, axis=1)
+        ones = np.ones(diff.shape, dtype=np.int32)
+        tile_counts = np.add.reduceat(np.add.reduceat(ones, row_starts, axis=0), col_starts, axis=1)
+        dirty = tile_sums / (tile_counts * sample.shape[2]) > self.threshold
+
+        dirty_count = int(dirty.sum())
+        if dirty_count == 0:
+            return "skip", None
+        if dirty_count > self.max_dirty_ratio * dirty.size:
+            self._pending = (sample, None, encode_size, now)
+            return "full", None
+
+        self._pending = (sample, dirty, encode_size, now)
+        return "patch", self._dirty_rects(dirty, frame.shape, encode_size)
+
+    def commit(self):
+        """Marks the last planned full frame or patch as delivered."""
+        if self._pending is None:
+            return
+        sample, dirty, encode_size, now = self._pending
+        self._pending = None
+        if dirty is None:
+            self._reference = sample
+            self._encode_size = encode_size
+            self._last_full = now
+            return
+        # Only the tiles that were sent change what receivers show
+        cell = self.tile // self.step
+        mask = np.repeat(np.repeat(dirty, cell, axis=0), cell, axis=1)
+        mask = mask[: sample.shape[0], : sample.shape[1]]
+        self._reference[mask] = sample[mask]
+
+    def patch_rects(self, frame_shape, encode_size):
+        """The last planned patch's rectangles for another encode size (simulcast layers)."""
+        return self._dirty_rects(self._pending[1], frame_shape, encode_size)
+
+    def reset(self):
+        """Forces the next frame to be a full frame."""
+        self._reference = None
+        self._pending = None
+
+    def _dirty_rects(self, dirty, frame_shape, encode_size):
+        """Merges horizontal runs of dirty tiles and scales them to encode_size."""
+        frame_h, frame_w = frame_shape[:2]
+        sx = encode_size[0] / frame_w
+        sy = encode_size[1] / frame_h
+        rects = []
+        for row in range(dirty.shape[0]):
+            cols = np.flatnonzero(dirty[row])
+            if cols.size == 0:
+                continue
+            # Split the dirty columns into consecutive runs
+            runs = np.split(cols, np.flatnonzero(np.diff(cols) != 1) + 1)
+            y0 = int(round(row * self.tile * sy))
+            y1 = int(round(min((row + 1) * self.tile, frame_h) * sy))
+            for run in runs:
+                x0 = int(round(run[0] * self.tile * sx))
+                x1 = int(round(min((run[-1] + 1) * self.tile, frame_w) * sx))
+                if x1 > x0 and y1 > y0:
+                    rects.append((x0, y0, x1 - x0, y1 - y0))
+        return rects
+
+
+def encode_patches(frame, frame_size, rects, quality):
+    """JPEG-encodes each (x, y, w, h) rectangle of frame scaled to frame_size."""
+    if (frame.shape[1], frame.shape[0]) != frame_size:
+        frame = cv2.resize(frame, frame_size, interpolation=cv2.INTER_AREA)
+    params = [int(cv2.IMWRITE_JPEG_QUALITY), quality]
+    patches = []
+    for x, y, w, h in rects:
+        ret, buffer = cv2.imencode(".jpg", frame[y : y + h, x : x + w], params)
+        patches.append(encoded_view(buffer) if ret else b"")
+    frames_encoded_total.inc(len(rects))
+    return patches
+
+
+def pack_patch_meta(frame_size, rects):
+    """Packs the patch header: full frame size, patch count, then x, y, w, h per patch."""
+    meta = struct.pack("!HHH", frame_size[0], frame_size[1], len(rects))
+    return meta + b"".join(struct.pack("!HHHH", *rect) for rect in rects)
+
+
+def unpack_patch_meta(meta):
+    """Inverse of pack_patch_meta. Returns ((width, height), [(x, y, w, h), ...])."""
+    width, height, count = struct.unpack_from("!HHH", meta)
+    rects = [struct.unpack_from("!HHHH", meta, 6 + 8 * i) for i in range(count)]
+    return (width, height), rects
+
+
+class DeltaCompositor:
+    """Subscriber side of delta mode: applies tile patches onto each peer's last frame.
+
+    Full frames are only decoded when a patch actually arrives for them, so peers that
+    never send patches cost nothing extra. The composited canvas is re-encoded once per
+    patch message and handed on like any other received frame.
+    """
+
+    def __init__(self, quality=JPEG_QUALITY):
+        self.quality = quality
+        self._base_jpegs = {}  # { peer_id: last full JPEG, not yet decoded }
+        self._canvases = {}  # { peer_id: decoded BGR canvas with patches applied }
+
+    def on_full(self, peer_id, jpeg):
+        self._base_jpegs[peer_id] = jpeg
+        self._canvases.pop(peer_id, None)
+
+    def on_patch(self, peer_id, meta, patches):
+        """Returns the composited JPEG, or None until a full frame has been seen."""
+        frame_size, rects = unpack_patch_meta(meta)
+        if len(rects) != len(patches):
+            return None
+        canvas = self._canvases.get(peer_id)
+        if canvas is None:
+            base = self._base_jpegs.pop(peer_id, None)
+            if base is None:
+                return None  # Joined mid-stream, wait for the next refresh frame
+            canvas = cv2.imdecode(np.frombuffer(base, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if canvas is None:
+                return None
+            self._canvases[peer_id] = canvas
+        if (canvas.shape[1], canvas.shape[0]) != frame_size:
+            return None  # Resolution changed, the publisher follows up with a full frame
+
+        for (x, y, w, h), patch in zip(rects, patches):
+            tile = cv2.imdecode(np.frombuffer(patch, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if tile is None or tile.shape[:2] != (h, w):
+                continue
+            canvas[y : y + h, x : x + w] = tile
+
+        ret, buffer = cv2.imencode(
+            ".jpg", canvas, [int(cv2.IMWRITE_JPEG_QUALITY), self.quality]
+        )
+        return encoded_view(buffer) if ret else None
+
+    def forget(self, peer_id):
+        self._base_jpegs.pop(peer_id, None)
+        self._canvases.pop(peer_id, None)
+
+
+def format_sse(event_type, data):
+    """Serializes one Server-Sent Event."""
+    serialize_start = time.perf_counter()
     message = f"event: {event_type}\ndata: {json.dumps(data)}\n\n"
+    serialize_duration.observe(time.perf_counter() - serialize_start)
+    return message
+
+
+def current_peer_messages():
+    """peer_join events describing every currently known peer, for a (re)starting client."""
+    return [
+        format_sse("peer_join", {"peer_id": record.peer_id, "name": record.name})
+        for record in peer_registry.snapshot().values()
+    ]
+
+
+class SSEClient:
+    """Outbox of one SSE connection with two lanes.
+
+    The control lane (peer_join/peer_leave) is lossless and always drained first. The
+    media lane coalesces: it keeps only the latest message per key (e.g. one
+    peer_stats event per peer), so a slow client never holds more than one per key.
+    If a stalled client lets the control lane reach SSE_CONTROL_LANE_LIMIT, its
+    backlog is replaced by a reset plus the current peer list instead of growing.
+    budget is the page's ViewerBudget; media events of peers it hides are not queued.
+    """
+
+    def __init__(self, remote_addr, budget):
+        self.remote_addr = remote_addr
+        self.budget = budget
+        self._ready = threading.Condition(threading.Lock())
+        self._control = collections.deque()
+        self._media = {}  # { key: message }, insertion ordered
+        self.listeners = ChangeListeners()
+
+    def push_control(self, message):
+        """Queues a lossless event. Returns False if the client needs a resync instead."""
+        with self._ready:
+            if len(self._control) >= SSE_CONTROL_LANE_LIMIT:
+                return False
+            self._control.append(message)
+            self._ready.notify()
+        self.listeners.notify()
+        return True
+
+    def push_media(self, key, message):
+        """Queues a coalescing event, replacing any pending one with the same key."""
+        with self._ready:
+            self._media.pop(key, None)  # Re-insert so the key moves to the back
+            self._media[key] = message
+            self._ready.notify()
+        self.listeners.notify()
+
+    def resync(self, messages):
+        """Drops the backlog and starts over with a reset and the given state."""
+        with self._ready:
+            self._control.clear()
+            self._media.clear()
+            self._control.append(format_sse("reset", {}))
+            self._control.extend(messages)
+            self._ready.notify()
+        self.listeners.notify()
+
+    def get(self, timeout):
+        """Returns the next message (control first), or None after timeout seconds (0 polls)."""
+        with self._ready:
+            self._ready.wait_for(lambda: self._control or self._media, timeout)
+            if self._control:
+                return self._control.popleft()
+            if self._media:
+                key = next(iter(self._media))
+                return self._media.pop(key)
+            return None
+
+    def depth(self):
+        with self._ready:
+            return len(self._control) + len(self._media)
+
+
+def notify_sse_clients(event_type, data, coalesce_key=None):
+    """Sends an event to all connected SSE clients.
+
+    Events with a coalesce_key go to the media lane, where a newer event with the same
+    key replaces an undelivered one. All others are lossless control events. Media events
+    are per peer (coalesce_key is the peer id) and skip clients whose page hides the peer.
+    """
+    message = format_sse(event_type, data)
+    overflowed = []
     with sse_clients_lock:
         # Iterate over a copy in case a client disconnects during iteration
-        for client_queue in list(sse_clients):
-            try:
-                client_queue.put_nowait(message)
-            except queue.Full:
-                logging.warning(
-                    f"SSE client queue full for event {event_type}. Skipping."
+        for client in list(sse_clients):
+            if coalesce_key is not None:
+                if client.budget.shows(coalesce_key):
+                    client.push_media((event_type, coalesce_key), message)
+            elif not client.push_control(message):
+                overflowed.append(client)
+
+    # Resync outside sse_clients_lock, which every notification needs
+    for client in overflowed:
+        logging.warning(
+            f"SSE client {client.remote_addr} fell too far behind on {event_type}. Resyncing."
+        )
+        client.resync(current_peer_messages())
+
+
+# --- Video Publishing ---
+
+
+class VideoPublisher:
+    """Turns captured frames into publish messages for one session.
+
+    Owns the adaptive controller, the optional delta encoder and the "publisher" pacer.
+    Sending is left to the caller, so the publisher thread and the asyncio runtime share
+    everything but the socket and the waiting.
+
+    Each frame is published as simulcast layers (SIMULCAST_LAYERS), one topic per layer,
+    all encoded from the same capture. Subscriptions reported by the XPUB socket decide
+    which layers are encoded at all, so a layer nobody watches costs nothing.
+    """
+
+    def __init__(self, room_number, peer_id, room_tag):
+        self.room_tag = room_tag
+        self.peer_id = peer_id
+        # Topics use the room and peer_id for this specific run, plus the layer name
+        self.layer_topics = self._topics(room_number)
+        self.layers = ()  # Names of the layers somebody subscribed to
+        self._subscriptions = set()  # Topic prefixes subscribers asked for
+        self.controller = AdaptivePublishController(
+            min_quality=app.config.get("MIN_JPEG_QUALITY", MIN_JPEG_QUALITY),
+            max_quality=app.config.get("MAX_JPEG_QUALITY", MAX_JPEG_QUALITY),
+            min_fps=app.config.get("MIN_PUBLISH_FPS", MIN_PUBLISH_FPS),
+            max_fps=app.config.get("MAX_PUBLISH_FPS", MAX_PUBLISH_FPS),
+        )
+        # Optional delta mode: skip static frames, publish only changed tiles
+        self.delta_encoder = DeltaFrameEncoder() if app.config.get("DELTA_MODE") else None
+        self.pacer = register_pacer("publisher", self.controller.fps)
+        # Sequence number of the next frame, shared by all layers so a subscriber that
+        # switches layers sees one continuous stream; only advances when a frame is sent
+        self.publish_seq = 0
+
+    def _topics(self, room_number):
+        return {
+            name: f"{room_number}|{self.peer_id}|{name}".encode("utf-8")
+            for name, _ in SIMULCAST_LAYERS
+        }
+
+    def switch_room(self, room_number, room_tag):
+        """Moves to the topics of another room; its receivers subscribe to them anew."""
+        self.room_tag = room_tag
+        self.layer_topics = self._topics(room_number)
+        self._subscriptions.clear()
+        self.layers = ()
+        if self.delta_encoder:
+            self.delta_encoder.reset()
+        logging.info(f"{room_tag} Publishing to room {room_number}")
+
+    def on_subscription(self, message):
+        """Applies one XPUB subscription message (b"\\x01" or b"\\x00" + topic prefix)."""
+        if not message or message[0] not in (0, 1):
+            return
+        prefix = message[1:]
+        # Subscribers send their whole filter list to every publisher they are connected
+        # to, so most prefixes are other peers' topics
+        if not any(topic.startswith(prefix) for topic in self.layer_topics.values()):
+            return
+        if message[0] == 1:
+            self._subscriptions.add(prefix)
+            if self.delta_encoder:
+                # A new receiver has no picture to patch yet
+                self.delta_encoder.reset()
+        else:
+            self._subscriptions.discard(prefix)
+        layers = tuple(
+            name
+            for name, topic in self.layer_topics.items()
+            if any(topic.startswith(p) for p in self._subscriptions)
+        )
+        if layers != self.layers:
+            logging.info(f"{self.room_tag} Publishing layers: {', '.join(layers) or 'none'}")
+            self.layers = layers
+
+    def prepare(self, seq, frame, captured_at):
+        """Encodes capture hub frame seq for every subscribed layer. Returns the multipart
+        messages, or an empty list if there is nothing to send (no subscribers, unchanged
+        frame in delta mode, or a failed encode)."""
+        controller = self.controller
+        join_timer.mark("ready")
+        if not self.layers:
+            # Nobody receives us: skip the encode, which counts as delivered
+            controller.record_sent()
+            return []
+        # Layers scale what the source actually delivers (e.g. a 1280x720 --source),
+        # keeping its aspect ratio
+        source_width, source_height = frame.shape[1], frame.shape[0]
+        frame_size = controller.frame_size((source_width, source_height))
+        action = "full"
+        if self.delta_encoder:
+            action, _ = self.delta_encoder.plan(frame, frame_size)
+        if action == "skip":
+            # Nothing changed: receivers already show this frame, which counts as delivered
+            controller.record_sent()
+            return []
+
+        encode_start = time.perf_counter()
+        encoded = []  # (topic, kind, payload) per layer
+        for name in self.layers:
+            scale = SIMULCAST_SCALES[name]
+            layer_size = controller.frame_size(
+                (int(source_width * scale), int(source_height * scale))
+            )
+            if action == "patch":
+                rects = self.delta_encoder.patch_rects(frame.shape, layer_size)
+                payload = [pack_patch_meta(layer_size, rects)]
+                payload.extend(encode_patches(frame, layer_size, rects, controller.quality))
+                encoded.append((self.layer_topics[name], FRAME_KIND_PATCH, payload))
+                continue
+            # Encode frame as JPEG at the controller's current settings (cached, so a
+            # self-view at the same settings reuses it)
+            jpeg = capture_hub.get_jpeg(seq, frame, layer_size, controller.quality)
+            if jpeg is None:
+                logging.warning(f"{self.room_tag} Failed to encode frame")
+                return []
+            encoded.append((self.layer_topics[name], FRAME_KIND_FULL, [jpeg]))
+        encode_time = time.perf_counter() - encode_start
+        controller.record_encode(encode_time)
+        encode_duration.observe(encode_time)
+        # Topic + header + frame data (or patch header + tiles)
+        return [
+            [topic, FRAME_HEADER.pack(kind, self.publish_seq, captured_at, encode_time)]
+            + payload
+            for topic, kind, payload in encoded
+        ]
+
+    def record_results(self, sent, prepared):
+        """Accounts for one frame of which sent of the prepared layer messages went out.
+
+        The PUB socket never reports messages it drops for a slow subscriber, so sent
+        only falls short of prepared on a socket error; congestion reaches the
+        controller through receiver reports (see frame_done).
+        """
+        frames_published_total.inc(sent)
+        if sent == prepared:
+            self.controller.record_sent()
+            if self.delta_encoder:
+                # Only when every layer went out, otherwise the tiles are sent again
+                self.delta_encoder.commit()
+        if sent:
+            join_timer.mark("published")
+            self.publish_seq = (self.publish_seq + 1) & 0xFFFFFFFF
+
+    def frame_done(self):
+        """Updates the controller and returns the seconds to wait before the next frame."""
+        lost = subscriber_loss.take_worst()
+        if lost is not None:
+            self.controller.record_receiver_loss(lost)
+        self.controller.update()
+        # Limit frame rate server-side to the controller's current target, which the
+        # source may not reach (e.g. a 15 fps camera)
+        self.pacer.set_target(capture_hub.limit_fps(self.controller.fps))
+        return self.pacer.next_delay()
+
+    def close(self):
+        unregister_pacer(self.pacer)
+
+
+def create_pub_socket(context, zmq_pub_port):
+    """Creates and binds the XPUB socket for this node's stream; raises zmq.ZMQError if the bind fails."""
+    pub_socket = context.socket(zmq.XPUB)
+    # Keep the per-subscriber queue short. A full queue drops messages for that
+    # subscriber only, so one stalled receiver cannot freeze the room; the adaptive
+    # controller learns about the loss from receiver reports (SubscriberLossReports)
+    pub_socket.setsockopt(zmq.SNDHWM, PUB_SNDHWM)
+    # Report every subscribe, not just the first per topic, so each new receiver of a
+    # layer triggers a full frame in delta mode
+    pub_socket.setsockopt(zmq.XPUB_VERBOSE, 1)
+    try:
+        pub_socket.bind(f"tcp://*:{zmq_pub_port}")
+    except zmq.ZMQError:
+        pub_socket.close()
+        raise
+    return pub_socket
+
+
+def drain_subscriptions(pub_socket, publisher):
+    """Hands all pending XPUB subscription messages to publisher without blocking."""
+    while True:
+        try:
+            publisher.on_subscription(pub_socket.recv(zmq.DONTWAIT))
+        except zmq.Again:
+            return
+
+
+# --- Video Receiving ---
+
+
+def choose_layer(peer_id):
+    """Picks the smallest simulcast layer at least as wide as the widest viewer of peer_id.
+
+    Returns None if no browser currently shows the peer, so nothing is received from it.
+    Viewers whose page is hidden or has paged the peer away do not count.
+    """
+    with peer_feed_clients_lock:
+        widths = [
+            viewer.width
+            for viewer in peer_feed_clients.get(peer_id, ())
+            if viewer.throttle.active(peer_id)
+        ]
+    if not widths:
+        return None
+    if None in widths:
+        return SIMULCAST_LAYERS[0][0]  # A viewer that did not say how big it shows the peer
+    wanted = max(widths)
+    record = peer_registry.get(peer_id)
+    # Until the first frame tells how wide the peer's source is, assume the usual size
+    source_width = record.source_width if record and record.source_width else CAPTURE_SIZE[0]
+    for name, scale in reversed(SIMULCAST_LAYERS):
+        if source_width * scale >= wanted:
+            return name
+    return SIMULCAST_LAYERS[0][0]
+
+
+def sync_subscriptions(sub_socket, connected_peer_addrs, layer_subscriptions, room_number, room_tag):
+    """Receives exactly the peers some browser is showing, each in the layer it needs.
+
+    Peers nobody watches (off-page tiles, closed tabs) are unsubscribed and disconnected,
+    so their frames are never transferred. The caller owns connected_peer_addrs and
+    layer_subscriptions ({ peer_id: layer name }).
+    """
+    sync_layer_subscriptions(sub_socket, layer_subscriptions, room_number, room_tag)
+    sync_peer_connections(sub_socket, connected_peer_addrs, layer_subscriptions, room_tag)
+
+
+def drop_subscriptions(sub_socket, connected_peer_addrs, layer_subscriptions, room_number, room_tag):
+    """Unsubscribes and disconnects sub_socket from every peer, e.g. when leaving room_number."""
+    for peer_id, layer in layer_subscriptions.items():
+        sub_socket.setsockopt(
+            zmq.UNSUBSCRIBE, f"{room_number}|{peer_id}|{layer}".encode("utf-8")
+        )
+    layer_subscriptions.clear()
+    sync_peer_connections(sub_socket, connected_peer_addrs, (), room_tag)
+
+
+def sync_layer_subscriptions(sub_socket, layer_subscriptions, room_number, room_tag):
+    """Subscribes sub_socket to one layer per watched peer, following its viewers' sizes."""
+    peer_ids = peer_registry.snapshot().keys()
+    for peer_id in peer_ids:
+        layer = choose_layer(peer_id)
+        current = layer_subscriptions.get(peer_id)
+        if layer == current:
+            continue
+        if layer is not None:
+            if current is None:
+                # Frames sent while we were not subscribed are no loss (layers of one
+                # peer share sequence numbers, so switching layers needs no restart)
+                record = peer_registry.get(peer_id)
+                if record is not None:
+                    record.stats.restart_sequence()
+            sub_socket.setsockopt(
+                zmq.SUBSCRIBE, f"{room_number}|{peer_id}|{layer}".encode("utf-8")
+            )
+            layer_subscriptions[peer_id] = layer
+            logging.info(f"{room_tag} Receiving layer '{layer}' of {peer_id}")
+        else:
+            del layer_subscriptions[peer_id]
+            logging.info(f"{room_tag} No viewers left for {peer_id}, unsubscribing")
+        if current is not None:
+            sub_socket.setsockopt(
+                zmq.UNSUBSCRIBE, f"{room_number}|{peer_id}|{current}".encode("utf-8")
+            )
+
+    # Peers that have left
+    for peer_id in set(layer_subscriptions) - set(peer_ids):
+        layer = layer_subscriptions.pop(peer_id)
+        sub_socket.setsockopt(
+            zmq.UNSUBSCRIBE, f"{room_number}|{peer_id}|{layer}".encode("utf-8")
+        )
+
+
+def sync_peer_connections(sub_socket, connected_peer_addrs, peer_ids, room_tag):
+    """Connects sub_socket to the given peers and disconnects from all others."""
+    # Discovery only lists peers of our room; we only need the addresses to connect
+    records = peer_registry.snapshot()
+    target_peer_addrs = {records[peer_id].addr for peer_id in peer_ids if peer_id in records}
+
+    # Connect to new peers
+    new_connections = target_peer_addrs - connected_peer_addrs
+    for ip, port in new_connections:
+        connect_addr = f"tcp://{ip}:{port}"
+        try:
+            logging.info(f"{room_tag} Connecting ZMQ SUB to {connect_addr}")
+            sub_socket.connect(connect_addr)
+            connected_peer_addrs.add((ip, port))
+        except zmq.ZMQError as e:
+            logging.error(f"{room_tag} Failed to connect ZMQ SUB to {connect_addr}: {e}")
+
+    # Disconnect from peers that left or that nobody watches any more
+    disconnected = connected_peer_addrs - target_peer_addrs
+    for ip, port in disconnected:
+        disconnect_addr = f"tcp://{ip}:{port}"
+        try:
+            logging.info(f"{room_tag} Disconnecting ZMQ SUB from {disconnect_addr}")
+            sub_socket.disconnect(disconnect_addr)
+            connected_peer_addrs.remove((ip, port))
+        except zmq.ZMQError as e:
+            # Can happen if connection already closed, usually safe to ignore warning
+            logging.warning(
+                f"{room_tag} Error disconnecting ZMQ SUB from {disconnect_addr}: {e}"
+            )
+
+
+def handle_video_message(multipart_msg, room_number, compositor, room_tag):
+    """Processes one received frame message: stats, delta reassembly and the peer's mailbox.
+
+    multipart_msg holds the zmq.Frame parts of recv_multipart(copy=False); their payloads
+    are used in place, as memoryviews.
+    """
+    multipart_msg = [part.buffer for part in multipart_msg]
+    # [topic, header, jpeg] is a full frame, [topic, header, meta, tile...] a patch
+    if len(multipart_msg) < 3 or len(multipart_msg[1]) != FRAME_HEADER.size:
+        return  # Received message with unexpected part count
+    topic = multipart_msg[0]
+    try:
+        kind, frame_seq, captured_at, sender_encode = FRAME_HEADER.unpack(
+            multipart_msg[1]
+        )
+        topic_str = str(topic, "utf-8")
+        topic_parts = topic_str.split("|")
+        if len(topic_parts) != 3:
+            return
+        rcv_room, sender_peer_id, layer = topic_parts
+
+        # Check if the message is for the room this node is in
+        if rcv_room != room_number:
+            # Message received for a different room, ZMQ filter might have race condition on unsubscribe? Ignore.
+            return
+        # Check if sender is still considered an active peer (mitigates late messages)
+        record = peer_registry.get(sender_peer_id)
+        if record is None:
+            return
+
+        record.frames_received += 1
+        stats = record.stats
+        stats.record_frame(frame_seq, captured_at, sender_encode, time.time())
+        if stats.report_due(PEER_STATS_EVENT_INTERVAL):
+            # Media lane: a slow client only gets the latest
+            notify_sse_clients(
+                "peer_stats",
+                dict(stats.snapshot(), peer_id=sender_peer_id),
+                coalesce_key=sender_peer_id,
+            )
+        frame_data = None
+        if kind == FRAME_KIND_FULL:
+            frame_data = multipart_msg[2]
+            compositor.on_full(sender_peer_id, frame_data)
+        elif kind == FRAME_KIND_PATCH:
+            # Rebuild the whole picture so viewers still get plain JPEGs
+            frame_data = compositor.on_patch(
+                sender_peer_id, multipart_msg[2], multipart_msg[3:]
+            )
+
+        if frame_data is not None:
+            size = jpeg_size(frame_data)
+            scale = SIMULCAST_SCALES.get(layer)
+            if size and scale:
+                record.source_width = round(size[0] / scale)  # For choose_layer()
+            # Replace the previous frame and wake the peer's viewers; an unread previous
+            # frame is counted as dropped by the mailbox, unless only the recorder wanted it
+            record.mailbox.put(frame_data, captured_at, has_mailbox_readers(sender_peer_id))
+            recorder.offer(room_number, sender_peer_id, frame_data)
+
+    except UnicodeDecodeError:
+        logging.warning(f"{room_tag} Received message with non-UTF8 topic.")
+    except Exception as e:  # Catch errors processing message parts
+        logging.error(f"{room_tag} Error processing received ZMQ message parts: {e}")
+
+
+# --- Mosaic Compositor ---
+
+
+def jpeg_size(data):
+    """(width, height) from the SOF marker of a JPEG, without decoding it; None if not found."""
+    i, end = 2, len(data) - 9
+    while i < end:
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:
+            i += 1  # Fill byte
+            continue
+        # SOF0..SOF15, except DHT, JPG and DAC which share the range
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack_from("!HH", data, i + 5)
+            return width, height
+        i += 2 + struct.unpack_from("!H", data, i + 2)[0]
+    return None
+
+
+def mosaic_layout(count):
+    """Returns (columns, rows, tile size) of a near-square grid for count tiles."""
+    columns = max(1, math.ceil(math.sqrt(count)))
+    rows = max(1, math.ceil(count / columns))
+    tile_width = MOSAIC_WIDTH // columns
+    tile_height = tile_width * CAPTURE_SIZE[1] // CAPTURE_SIZE[0]
+    return columns, rows, (tile_width, tile_height)
+
+
+def decode_tile(jpeg, tile_size, label):
+    """Decodes jpeg straight to tile_size with its label on it.
+
+    libjpeg can decode at 1/2, 1/4 or 1/8 scale for a fraction of the work; the largest
+    reduction that still covers the tile is used, and only the rest is left to resize.
+    """
+    flags = cv2.IMREAD_COLOR
+    size = jpeg_size(jpeg)
+    if size:
+        for factor, reduced in MOSAIC_REDUCED_DECODES:
+            if size[0] // factor >= tile_size[0] and size[1] // factor >= tile_size[1]:
+                flags = getattr(cv2, reduced)
+                break
+    image = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), flags)
+    if image is None:
+        return None
+    if (image.shape[1], image.shape[0]) != tile_size:
+        image = cv2.resize(image, tile_size, interpolation=cv2.INTER_AREA)
+    cv2.putText(
+        image, label, (6, tile_size[1] - 8), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1
+    )
+    return image
+
+
+class MosaicHub:
+    """Composites the latest frame of every peer into one grid image for /video_feed_mosaic.
+
+    Runs while at least one mosaic client is connected. Every tick it takes the frames
+    that changed since the last one, decodes them (reduced, see decode_tile) into tiles,
+    assembles the grid with one reshape and encodes it once for all clients. The hub is
+    a feed viewer of every peer, at tile width, so the subscriber receives each of them
+    in the smallest simulcast layer that covers a tile.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._mosaic_ready = threading.Condition(self._lock)
+        self._clients = 0
+        self._thread = None
+        self._stop = threading.Event()  # Replaced on every start so an old loop never revives
+        self._seq = 0  # Incremented for every encoded mosaic
+        self._jpeg = None
+        self.listeners = ChangeListeners()  # Run after every encoded mosaic
+
+    def acquire(self):
+        with self._lock:
+            if self._clients == 0:
+                self._jpeg = None
+                self._stop = threading.Event()
+                self._thread = threading.Thread(
+                    target=self._loop, args=(self._stop,), name="MosaicThread", daemon=True
                 )
-            except Exception as e:
-                logging.error(
-                    f"Error putting message in SSE client queue: {e}. Removing queue."
+                self._thread.start()
+            self._clients += 1
+
+    def release(self):
+        with self._lock:
+            if self._clients == 0:
+                return
+            self._clients -= 1
+            if self._clients > 0:
+                return
+            self._stop.set()
+            self._mosaic_ready.notify_all()
+
+    def wait_mosaic(self, last_seq, timeout=1.0):
+        """Blocks until a mosaic newer than last_seq exists. Returns (seq, jpeg), or
+        (last_seq, None) on timeout."""
+        with self._mosaic_ready:
+            self._mosaic_ready.wait_for(
+                lambda: (self._seq != last_seq and self._jpeg is not None)
+                or self._stop.is_set(),
+                timeout,
+            )
+            if self._seq == last_seq or self._jpeg is None:
+                return last_seq, None
+            return self._seq, self._jpeg
+
+    def _loop(self, stop):
+        logging.info("[Mosaic] Compositor starting.")
+        pacer = register_pacer("mosaic", MOSAIC_FPS)
+        viewers = {}  # { peer_id: FeedViewer } one per peer, as if a tile were a browser
+        tiles = {}  # { peer_id: decoded tile at the current tile size }
+        tile_size = None
+        try:
+            while not stop.is_set():
+                roster = sorted(
+                    (record.name, peer_id) for peer_id, record in peer_registry.snapshot().items()
                 )
-                # Remove problematic queue
+                changed = False
+
+                columns, rows, size = mosaic_layout(len(roster))
+                if size != tile_size:
+                    # Grid changed shape: every tile is rebuilt from the next frame
+                    tile_size = size
+                    tiles.clear()
+                    with peer_feed_clients_lock:  # choose_layer() reads the widths
+                        for viewer in viewers.values():
+                            viewer.width = tile_size[0]
+                            viewer.version = 0
+                    changed = True
+
+                present = {peer_id for _, peer_id in roster}
+                for peer_id in list(viewers):
+                    if peer_id not in present:
+                        detach_feed_viewer(viewers.pop(peer_id))
+                        tiles.pop(peer_id, None)
+                        changed = True
+                for name, peer_id in roster:
+                    viewer = viewers.get(peer_id)
+                    if viewer is None:
+                        viewer = viewers[peer_id] = attach_feed_viewer(peer_id, tile_size[0])
+                        changed = True
+                    mailbox = peer_mailbox(peer_id)
+                    if mailbox is None:
+                        continue
+                    version, jpeg, _ = mailbox.wait_newer(viewer.version, timeout=0)
+                    if jpeg is None:
+                        continue
+                    viewer.version = version
+                    tile = decode_tile(jpeg, tile_size, name)
+                    if tile is not None:
+                        tiles[peer_id] = tile
+                        changed = True
+
+                if changed:
+                    self._publish(self._compose(roster, tiles, columns, rows, tile_size))
+                time.sleep(pacer.next_delay())
+        finally:
+            for viewer in viewers.values():
+                detach_feed_viewer(viewer)
+            unregister_pacer(pacer)
+            logging.info("[Mosaic] Compositor stopped.")
+
+    @staticmethod
+    def _compose(roster, tiles, columns, rows, tile_size):
+        tile_width, tile_height = tile_size
+        grid = np.zeros((rows * columns, tile_height, tile_width, 3), np.uint8)
+        for slot, (_, peer_id) in enumerate(roster):
+            tile = tiles.get(peer_id)
+            if tile is not None:
+                grid[slot] = tile
+        if not roster:
+            cv2.putText(
+                grid[0], "Waiting for peers...", (20, tile_height // 2),
+                cv2.FONT_HERSHEY_SIMPLEX, 1.0, (200, 200, 200), 2,
+            )
+        # (row, column, y, x) -> (row, y, column, x): tiles side by side, one image
+        return (
+            grid.reshape(rows, columns, tile_height, tile_width, 3)
+            .transpose(0, 2, 1, 3, 4)
+            .reshape(rows * tile_height, columns * tile_width, 3)
+        )
+
+    def _publish(self, image):
+        ret, buffer = cv2.imencode(".jpg", image, [int(cv2.IMWRITE_JPEG_QUALITY), MOSAIC_QUALITY])
+        if not ret:
+            return
+        frames_encoded_total.inc()
+        with self._mosaic_ready:
+            self._seq += 1
+            self._jpeg = encoded_view(buffer)
+            self._mosaic_ready.notify_all()
+        self.listeners.notify()
+
+
+mosaic_hub = MosaicHub()
+
+
+# --- Call Recording ---
+
+
+def record_slug(text):
+    """A file-name-safe form of a room name or peer ID."""
+    return re.sub(r"[^A-Za-z0-9.-]+", "_", text).strip("_.") or "_"
+
+
+class RecordingWriter:
+    """One recording directory: <peer>.mjpg and <peer>.idx per peer, plus recording.json.
+
+    Each JPEG is appended to the peer's segment file as received, then a RECORD_INDEX
+    entry (arrival time, offset, length) to its index file. Both are flushed in that
+    order, so a reader never finds an index entry pointing past written data.
+    """
+
+    def __init__(self, root, room, started_at):
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(started_at))
+        self.room = room
+        self.path = os.path.join(root, f"{stamp}_{record_slug(room)}")
+        os.makedirs(self.path, exist_ok=True)
+        self._files = {}  # { peer_id: (segment file, index file) }
+        self._meta = {"room": room, "started_at": started_at, "peers": {}}
+        self._write_meta()
+        logging.info(f"[Recorder] Recording room '{room}' to {self.path}")
+
+    def append(self, peer_id, arrived_at, jpeg):
+        files = self._files.get(peer_id)
+        if files is None:
+            files = self._files[peer_id] = self._open_peer(peer_id)
+        segment, index = files
+        offset = segment.tell()
+        segment.write(jpeg)
+        segment.flush()
+        index.write(RECORD_INDEX.pack(arrived_at, offset, len(jpeg)))
+        index.flush()
+
+    def close(self):
+        for segment, index in self._files.values():
+            segment.close()
+            index.close()
+        self._files.clear()
+
+    def _open_peer(self, peer_id):
+        record = peer_registry.get(peer_id)
+        name = record.name if record else ""
+        slug = record_slug(peer_id)
+        self._meta["peers"][slug] = {"peer_id": peer_id, "name": name}
+        self._write_meta()
+        base = os.path.join(self.path, slug)
+        return open(base + ".mjpg", "ab"), open(base + ".idx", "ab")
+
+    def _write_meta(self):
+        # Replaced atomically, /recordings may read it at any time
+        temp_path = os.path.join(self.path, RECORD_META_FILE + ".tmp")
+        with open(temp_path, "w") as meta_file:
+            json.dump(self._meta, meta_file)
+        os.replace(temp_path, os.path.join(self.path, RECORD_META_FILE))
+
+
+class Recorder:
+    """Records the frames every peer sends, without re-encoding (optional, --record-dir).
+
+    The subscriber only offers each frame to a bounded queue; a writer thread does the
+    disk I/O. If the writer falls behind, frames are left out of the recording rather
+    than delaying the live path. Every join or room switch starts a new recording.
+
+    The subscriber only receives peers somebody views, so while recording the writer
+    thread also registers a full-layer viewer for every peer, as MosaicHub does for its
+    tiles: every peer is recorded, at full size, whether a browser shows it or not.
+    These viewers are internal: frames reach the recorder through offer(), not the
+    mailbox, so they count neither as feed viewers nor towards dropped frames.
+    """
+
+    def __init__(self):
+        self.directory = None  # Root of all recordings; None disables recording
+        self._queue = queue.Queue(RECORD_QUEUE_SIZE)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.directory is None or self._thread is not None:
+            return
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._loop, args=(self._stop,), name="RecorderThread", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Writes out what is still queued and closes the recording."""
+        thread = self._thread
+        if thread is None:
+            return
+        self._thread = None
+        self._stop.set()
+        thread.join(timeout=5.0)
+        if thread.is_alive():
+            logging.warning("[Recorder] Writer did not finish in time.")
+
+    def offer(self, room, peer_id, jpeg):
+        """Queues one received JPEG (any bytes-like object, kept by reference)."""
+        if self._thread is None:
+            return
+        try:
+            self._queue.put_nowait((room, peer_id, time.time(), jpeg))
+        except queue.Full:
+            recorder_frames_dropped_total.inc()
+
+    def _loop(self, stop):
+        recording = None
+        viewers = {}  # { peer_id: FeedViewer } one full-layer viewer per peer
+        next_sync = 0.0
+        try:
+            while not (stop.is_set() and self._queue.empty()):
+                now = time.monotonic()
+                if now >= next_sync and not stop.is_set():
+                    self._sync_viewers(viewers)
+                    next_sync = now + SUBSCRIPTION_SYNC_INTERVAL
                 try:
-                    sse_clients.remove(client_queue)
-                except ValueError:
-                    pass  # Already removed
+                    room, peer_id, arrived_at, jpeg = self._queue.get(
+                        timeout=SUBSCRIPTION_SYNC_INTERVAL
+                    )
+                except queue.Empty:
+                    continue
+                if recording is None or recording.room != room:
+                    if recording is not None:
+                        recording.close()
+                    recording = RecordingWriter(self.directory, room, arrived_at)
+                recording.append(peer_id, arrived_at, jpeg)
+                recorder_frames_written_total.inc()
+        except OSError as e:
+            logging.error(f"[Recorder] Recording stopped: {e}")
+            self._thread = None  # Stop queueing, nothing would write the frames
+        finally:
+            for viewer in viewers.values():
+                detach_feed_viewer(viewer)
+            if recording is not None:
+                recording.close()
+            # Release frames left behind by an error
+            while not self._queue.empty():
+                self._queue.get_nowait()
+
+    @staticmethod
+    def _sync_viewers(viewers):
+        """Attaches a full-layer viewer to every known peer and detaches departed ones."""
+        present = peer_registry.snapshot().keys()
+        for peer_id in list(viewers):
+            if peer_id not in present:
+                detach_feed_viewer(viewers.pop(peer_id))
+        for peer_id in present:
+            if peer_id not in viewers:
+                # No width: choose_layer() picks the full layer for it
+                viewers[peer_id] = attach_feed_viewer(peer_id, internal=True)
+
+
+recorder = Recorder()
+
+
+class RecordingReader:
+    """Memory-mapped playback of one peer's part of a recording.
+
+    The index is used in place as a NumPy array, so seeking is a binary search over its
+    timestamps, and each frame is a slice of the mapped segment file: nothing is read
+    ahead or decoded. Frames appended after opening are not included.
+    """
+
+    def __init__(self, path, peer):
+        self._maps = []
+        index_map = self._map(os.path.join(path, peer + ".idx"))
+        self._segment = memoryview(self._map(os.path.join(path, peer + ".mjpg")))
+        self.index = np.frombuffer(
+            index_map, RECORD_INDEX_DTYPE, count=len(index_map) // RECORD_INDEX.size
+        )
+
+    def _map(self, file_path):
+        with open(file_path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)  # ValueError if empty
+        self._maps.append(mapped)
+        return mapped
+
+    def __len__(self):
+        return len(self.index)
+
+    def seek(self, timestamp):
+        """Position of the first frame that arrived at or after timestamp."""
+        return int(np.searchsorted(self.index["t"], timestamp))
+
+    def frame(self, position):
+        """Returns (arrival time.time(), JPEG as a memoryview into the segment)."""
+        timestamp, offset, length = self.index[position].tolist()
+        return timestamp, self._segment[offset : offset + length]
+
+    def close(self):
+        self.index = None
+        self._segment = None
+        for mapped in self._maps:
+            try:
+                mapped.close()
+            except BufferError:
+                pass  # A frame slice is still referenced; unmapped when it is freed
+
+
+class PlaybackClock:
+    """Paces recorded frames at the intervals they arrived at.
+
+    Pauses longer than RECORD_MAX_GAP (nothing was received) are shortened to it, and a
+    late reader is realigned instead of being sent a burst of frames to catch up.
+    """
+
+    def __init__(self):
+        self._offset = None  # monotonic() minus recorded time
+
+    def delay(self, timestamp):
+        """Seconds to wait before sending the frame recorded at timestamp."""
+        now = time.monotonic()
+        if self._offset is None:
+            self._offset = now - timestamp
+        wait = timestamp + self._offset - now
+        if wait > RECORD_MAX_GAP:
+            self._offset -= wait - RECORD_MAX_GAP
+            wait = RECORD_MAX_GAP
+        elif wait < 0:
+            self._offset -= wait
+            wait = 0.0
+        return wait
+
+
+def recording_path(recording):
+    """Directory of a recording named as in list_recordings(), or None if there is none."""
+    if recorder.directory is None or not RECORD_NAME.fullmatch(recording):
+        return None
+    path = os.path.join(recorder.directory, recording)
+    return path if os.path.isfile(os.path.join(path, RECORD_META_FILE)) else None
+
+
+def read_recording_meta(path):
+    with open(os.path.join(path, RECORD_META_FILE)) as meta_file:
+        return json.load(meta_file)
+
+
+def open_recording(recording, peer, offset=0.0):
+    """Opens peer's part of recording for playback from offset seconds after the
+    recording started. Returns (reader, start position), or None if not found."""
+    path = recording_path(recording)
+    if path is None or not RECORD_NAME.fullmatch(peer):
+        return None
+    try:
+        meta = read_recording_meta(path)
+        reader = RecordingReader(path, peer)
+    except (OSError, ValueError):
+        return None  # Unknown peer, or nothing written yet
+    return reader, reader.seek(meta["started_at"] + offset)
+
+
+def list_recordings():
+    """Every recording under --record-dir with its peers' frame counts and time ranges."""
+    recordings = []
+    try:
+        names = sorted(os.listdir(recorder.directory))
+    except OSError:
+        return recordings  # Nothing recorded yet
+    for name in names:
+        path = recording_path(name)
+        if path is None:
+            continue
+        try:
+            meta = read_recording_meta(path)
+        except (OSError, ValueError):
+            continue
+        peer_entries = []
+        for slug, info in meta["peers"].items():
+            try:
+                with open(os.path.join(path, slug + ".idx"), "rb") as index_file:
+                    frames = os.fstat(index_file.fileno()).st_size // RECORD_INDEX.size
+                    if frames == 0:
+                        continue
+                    first = RECORD_INDEX.unpack(index_file.read(RECORD_INDEX.size))[0]
+                    index_file.seek((frames - 1) * RECORD_INDEX.size)
+                    last = RECORD_INDEX.unpack(index_file.read(RECORD_INDEX.size))[0]
+            except OSError:
+                continue
+            peer_entries.append(
+                dict(
+                    info,
+                    peer=slug,
+                    frames=frames,
+                    first=round(first - meta["started_at"], 3),
+                    last=round(last - meta["started_at"], 3),
+                )
+            )
+        recordings.append(
+            {
+                "recording": name,
+                "room": meta["room"],
+                "started_at": meta["started_at"],
+                "peers": peer_entries,
+            }
+        )
+    return recordings
+
+
+# --- Peer Discovery ---
+
+
+def room_multicast_group(room):
+    """Multicast group the nodes of a room announce on, the same on every host."""
+    digest = hashlib.sha1(room.encode("utf-8")).digest()
+    return f"{DISCOVERY_MULTICAST_PREFIX}.{digest[0]}.{digest[1]}"
+
+
+def open_discovery_sockets(session, room_tag):
+    """Creates (listen_sock, send_sock, destination) for the configured discovery mode.
+
+    In broadcast mode every node on the LAN receives every room's heartbeats. In multicast
+    mode the listening socket joins only the room's group, so the kernel drops other
+    rooms' traffic. Raises OSError if the sockets cannot be set up.
+    """
+    listen_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    send_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        listen_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        send_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if app.config.get("DISCOVERY_MODE") != "multicast":
+            send_sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+            listen_sock.bind(("", BROADCAST_PORT))  # Listen on all interfaces
+            logging.info(f"{room_tag} Listening for broadcasts on UDP port {BROADCAST_PORT}")
+            return listen_sock, send_sock, ("<broadcast>", BROADCAST_PORT)
+
+        group = room_multicast_group(session["room"])
+        interface = socket.inet_aton(session["ip"])
+        try:
+            # Binding to the group address (Linux) also keeps out other groups on this port
+            listen_sock.bind((group, BROADCAST_PORT))
+        except OSError:
+            listen_sock.bind(("", BROADCAST_PORT))
+        listen_sock.setsockopt(
+            socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, socket.inet_aton(group) + interface
+        )
+        send_sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, interface)
+        send_sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, DISCOVERY_MULTICAST_TTL)
+        # Deliver our heartbeats to other nodes on this host as well
+        send_sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        logging.info(f"{room_tag} Listening on multicast group {group}:{BROADCAST_PORT}")
+        return listen_sock, send_sock, (group, BROADCAST_PORT)
+    except OSError:
+        listen_sock.close()
+        send_sock.close()
+        raise
+
+
+class DiscoveryEngine:
+    """Peer table maintenance for one session: announcements in, peers and expiries out.
+
+    Heartbeats use a compact versioned binary format (ANNOUNCE_HEADER, then the room and
+    name, then receiver reports on the peers we receive video from). Datagrams for other
+    rooms are rejected by comparing raw room bytes, before any decoding. The text format
+    "ALIVE|room|name|port|peer_id[|time]" of older nodes is still understood. Datagrams
+    are applied in batches, taking each lock once per batch, and peers expire from a
+    heap of deadlines instead of a scan of the whole table.
+
+    Used by one thread (or the asyncio loop) at a time; the peer table itself is shared.
+    """
+
+    MAX_BATCH = 256  # Datagrams drained per batch before timers are serviced again
+
+    def __init__(self, session, room_tag):
+        self.session = None  # Copy of my_info, set by reconfigure()
+        self._deadlines = []  # Heap of (expires_at, peer_id); stale entries are skipped
+        self._replied_at = 0.0  # time.time() of the last heartbeat answering new peers
+        self.reconfigure(session, room_tag)
+
+    def reconfigure(self, session, room_tag):
+        """Switches to a new session (copy of my_info). Peers of a room being left are
+        dropped; the new name or room is announced right away."""
+        if self.session and session["room"] != self.session["room"]:
+            self.forget_peers()
+        self.session = session
+        self.room_tag = room_tag
+        self._room = session["room"].encode("utf-8")
+        name = session["name"].encode("utf-8")[:255].decode("utf-8", "ignore").encode("utf-8")
+        # Everything after the header is fixed for the session
+        self._announce_tail = self._room + bytes([len(name)]) + name
+        self.next_heartbeat = 0.0  # time.time() when the next heartbeat is due
+
+    def build_heartbeat(self, now=None):
+        """Encodes the announcement of this node and schedules the next one."""
+        now = time.time() if now is None else now
+        self.next_heartbeat = now + HEARTBEAT_INTERVAL
+        # The send time lets receivers estimate our clock offset
+        header = ANNOUNCE_HEADER.pack(
+            ANNOUNCE_MAGIC, ANNOUNCE_VERSION, self.session["zmq_port"], now, len(self._room)
+        )
+        return header + self._announce_tail + self.build_receiver_reports()
+
+    def build_receiver_reports(self):
+        """Encodes the loss of every peer received from since the previous heartbeat."""
+        reports = []
+        for record in peer_registry.snapshot().values():
+            lost = record.stats.take_interval_loss()
+            if lost is None or len(reports) == RECEIVER_REPORT_MAX:
+                continue
+            ip, port = record.addr
+            try:
+                packed_ip = socket.inet_aton(ip)
+            except OSError:
+                continue  # Not an IPv4 address
+            reports.append(RECEIVER_REPORT.pack(packed_ip, port, round(lost * 255)))
+        return bytes([len(reports)]) + b"".join(reports)
+
+    def next_timeout(self, now=None):
+        """Seconds until the next heartbeat or peer expiry is due."""
+        now = time.time() if now is None else now
+        due = self.next_heartbeat
+        if self._deadlines:
+            due = min(due, self._deadlines[0][0])
+        return max(0.0, due - now)
+
+    def parse(self, data, sender_ip):
+        """Returns (peer_id, name, zmq_port, sent_at or None, lost or None) for an
+        announcement from a peer of our room, or None for anything else (other rooms,
+        ourselves, garbage). lost is the share of our frames the peer reported lost."""
+        if data[:2] == ANNOUNCE_MAGIC:
+            parsed = self._parse_binary(data)
+        elif data[:6] == b"ALIVE|":
+            parsed = self._parse_legacy(data, sender_ip)
+        else:
+            return None
+        if parsed is None:
+            return None
+        name, port, sent_at, lost = parsed
+        if sender_ip == self.session["ip"] and port == self.session["zmq_port"]:
+            return None  # Our own heartbeat looped back
+        return generate_peer_id(sender_ip, port), name, port, sent_at, lost
+
+    def _parse_binary(self, data):
+        if len(data) < ANNOUNCE_HEADER.size:
+            return None
+        magic, version, port, sent_at, room_len = ANNOUNCE_HEADER.unpack_from(data)
+        if version < 1:
+            return None  # Newer versions may only append fields after the name
+        room_end = ANNOUNCE_HEADER.size + room_len
+        if data[ANNOUNCE_HEADER.size : room_end] != self._room:
+            return None  # Another room; nothing was decoded
+        if len(data) <= room_end:
+            return None
+        name_len = data[room_end]
+        name_end = room_end + 1 + name_len
+        name = data[room_end + 1 : name_end].decode("utf-8", "replace")
+        lost = None
+        if version >= 2 and len(data) > name_end:
+            lost = self._find_own_report(data, name_end)
+        return name, port, sent_at, lost
+
+    def _find_own_report(self, data, offset):
+        """The loss a heartbeat's receiver reports give for our stream, or None."""
+        try:
+            own_ip = socket.inet_aton(self.session["ip"])
+        except OSError:
+            return None
+        count = data[offset]
+        for i in range(count):
+            start = offset + 1 + i * RECEIVER_REPORT.size
+            if start + RECEIVER_REPORT.size > len(data):
+                return None  # Truncated
+            ip, port, lost = RECEIVER_REPORT.unpack_from(data, start)
+            if ip == own_ip and port == self.session["zmq_port"]:
+                return lost / 255
+        return None
+
+    def _parse_legacy(self, data, sender_ip):
+        try:
+            parts = data.decode("utf-8").split("|")
+        except UnicodeDecodeError:
+            return None
+        # Older nodes send no timestamp field
+        if len(parts) not in (5, 6) or parts[1] != self.session["room"]:
+            return None
+        try:
+            port = int(parts[3])
+            sent_at = float(parts[5]) if len(parts) == 6 else None
+        except ValueError:
+            logging.warning(f"{self.room_tag} Malformed announcement from {sender_ip}: {parts[3:]}")
+            return None
+        # Verify received peer_id matches the one calculated from sender IP and port
+        if parts[4] != generate_peer_id(sender_ip, port):
+            logging.warning(
+                f"{self.room_tag} Peer ID mismatch from {sender_ip}. Got {parts[4]}. Ignoring."
+            )
+            return None
+        return parts[2], port, sent_at, None
+
+    def handle_batch(self, datagrams):
+        """Applies [(data, sender_ip, received_at), ...] to the peer table."""
+        latest = {}  # { peer_id: (name, addr, sent_at, received_at) }, last one wins
+        for data, sender_ip, received_at in datagrams:
+            parsed = self.parse(data, sender_ip)
+            if parsed is not None:
+                peer_id, name, port, sent_at, lost = parsed
+                latest[peer_id] = (name, (sender_ip, port), sent_at, received_at)
+                if lost is not None:
+                    subscriber_loss.add(peer_id, lost)
+        if not latest:
+            return
+
+        # Always update last_seen and potentially name/addr
+        new_peers = peer_registry.update(
+            {
+                peer_id: (name, addr, received_at)
+                for peer_id, (name, addr, _, received_at) in latest.items()
+            }
+        )
+        records = peer_registry.snapshot()
+        for peer_id, (_, _, sent_at, received_at) in latest.items():
+            heapq.heappush(self._deadlines, (received_at + PEER_TIMEOUT, peer_id))
+            if sent_at is not None:
+                records[peer_id].stats.record_clock_sample(sent_at, received_at)
+
+        for record in new_peers:
+            logging.info(f"{self.room_tag} Discovered new peer: {record.name} ({record.peer_id})")
+            # Notify web clients about the new peer
+            notify_sse_clients("peer_join", {"peer_id": record.peer_id, "name": record.name})
+
+        # Answer newcomers early so they need not wait a full HEARTBEAT_INTERVAL for us
+        now = time.time()
+        if new_peers and now - self._replied_at >= DISCOVERY_REPLY_HOLDOFF:
+            self._replied_at = now
+            self.next_heartbeat = min(self.next_heartbeat, now)
+
+    def expire(self, now=None):
+        """Removes peers whose last heartbeat is older than PEER_TIMEOUT and announces their leave."""
+        now = time.time() if now is None else now
+        timed_out_peers = []
+        while self._deadlines and self._deadlines[0][0] <= now:
+            _, peer_id = heapq.heappop(self._deadlines)
+            # A later heartbeat pushed a later deadline; then this entry is stale
+            record = peer_registry.remove_if(
+                peer_id, lambda record: now - record.last_seen >= PEER_TIMEOUT
+            )
+            if record is not None:
+                timed_out_peers.append(record)
+        self._drop_peers(timed_out_peers, "Peer timed out")
+
+    def forget_peers(self):
+        """Drops every known peer, e.g. when leaving the room."""
+        self._deadlines.clear()
+        self._drop_peers(peer_registry.clear(), "Left peer")
+
+    def _drop_peers(self, departed, reason):
+        for record in departed:
+            logging.info(f"{self.room_tag} {reason}: {record.name} ({record.peer_id})")
+            notify_sse_clients("peer_leave", {"peer_id": record.peer_id, "name": record.name})
 
 
 # --- Thread Functions ---
 
 
 def discovery_thread():
-    """Handles broadcasting presence and discovering peers."""
+    """Handles announcing presence and discovering peers."""
     # Wait until my_info is populated and threads are officially started
     threads_started.wait()
     if shutdown_flag.is_set():
@@ -124,164 +3196,95 @@ def discovery_thread():
         if not my_info:
             logging.error("Discovery: my_info not set.")
             return
-        room_number = my_info["room"]
-        name = my_info["name"]
-        zmq_port = my_info["zmq_port"]
-        my_ip = my_info["ip"]
-        my_peer_id = my_info["peer_id"]
-    room_tag = f"[Discovery-{room_number}-{name[:5]}]"  # Short identifier for logs
+        seen_version, session = session_version, dict(my_info)
+    room_tag = f"[Discovery-{session['room']}-{session['name'][:5]}]"  # Short identifier for logs
     logging.info(f"{room_tag} Thread starting.")
-
-    broadcast_addr = ("<broadcast>", BROADCAST_PORT)
-    broadcast_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    listen_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    engine = DiscoveryEngine(session, room_tag)
 
     try:
-        broadcast_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        broadcast_sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-        broadcast_sock.settimeout(1.0)  # Timeout for listening
-
-        listen_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        listen_sock.bind(("", BROADCAST_PORT))  # Listen on all interfaces
-        logging.info(f"{room_tag} Listening on UDP port {BROADCAST_PORT}")
+        listen_sock, send_sock, announce_addr = open_discovery_sockets(session, room_tag)
     except OSError as e:
         logging.error(
             f"{room_tag} Could not bind to UDP port {BROADCAST_PORT}: {e}. Thread exiting."
         )
         return  # Cannot continue without sockets
+    listen_sock.setblocking(False)
+
+    # A room/name switch interrupts the select() below through this socket pair
+    wake_recv, wake_send = socket.socketpair()
+    wake_recv.setblocking(False)
+    wake_send.setblocking(False)
+
+    def wake():
+        try:
+            wake_send.send(b"\0")
+        except OSError:
+            pass  # Buffer full: a wake-up is already pending
+
+    session_switches.add(wake)
 
-    last_heartbeat_time = 0
     while not shutdown_flag.is_set():
+        # 0. Apply a room/name switch in place
+        if session_version != seen_version:
+            seen_version, new_session = current_session()
+            room_changed = new_session["room"] != session["room"]
+            session = new_session
+            room_tag = f"[Discovery-{session['room']}-{session['name'][:5]}]"
+            engine.reconfigure(session, room_tag)
+            if room_changed and app.config.get("DISCOVERY_MODE") == "multicast":
+                # The multicast group follows the room
+                listen_sock.close()
+                send_sock.close()
+                try:
+                    listen_sock, send_sock, announce_addr = open_discovery_sockets(
+                        session, room_tag
+                    )
+                except OSError as e:
+                    logging.error(
+                        f"{room_tag} Could not join the new room's group: {e}. Thread exiting."
+                    )
+                    break
+                listen_sock.setblocking(False)
+
         # 1. Broadcast Heartbeat
-        current_time = time.time()
-        if current_time - last_heartbeat_time > HEARTBEAT_INTERVAL:
-            # Use the config fetched at the start of this thread's run
-            message = f"ALIVE|{room_number}|{name}|{zmq_port}|{my_peer_id}"
+        if time.time() >= engine.next_heartbeat:
             try:
-                broadcast_sock.sendto(message.encode("utf-8"), broadcast_addr)
-                last_heartbeat_time = current_time
+                send_sock.sendto(engine.build_heartbeat(), announce_addr)
             except OSError as e:
-                logging.warning(f"{room_tag} Could not send broadcast heartbeat: {e}")
+                logging.warning(f"{room_tag} Could not send heartbeat: {e}")
 
-        # 2. Listen for Peer Messages
+        # 2. Sleep until a datagram arrives, a timer is due (at most 1 s, to notice
+        # shutdown) or a switch wakes us, then drain whatever is queued without blocking
+        batch = []
         try:
-            data, addr = listen_sock.recvfrom(1024)
-            message = data.decode("utf-8")
-            sender_ip = addr[0]
-
-            # Ignore self messages robustly
-            if sender_ip == my_ip:
-                try:
-                    parts_check = message.split("|")
-                    if len(parts_check) >= 4 and int(parts_check[3]) == zmq_port:
-                        continue  # It's definitely me
-                except (ValueError, IndexError):
-                    pass  # Ignore malformed
-
-            parts = message.split("|")
-            if len(parts) == 5 and parts[0] == "ALIVE":
-                msg_type, peer_room, peer_name, peer_zmq_port_str, peer_id_rcv = parts
-                # IMPORTANT: Only process if the message is for the room this thread instance is managing
-                if peer_room == room_number:
-                    try:
-                        peer_zmq_port_int = int(peer_zmq_port_str)
-                        peer_addr = (sender_ip, peer_zmq_port_int)
-                        # Calculate expected peer_id based on sender IP and claimed ZMQ port
-                        expected_peer_id = generate_peer_id(
-                            sender_ip, peer_zmq_port_int
-                        )
-
-                        # Verify received peer_id matches calculated one
-                        if expected_peer_id != peer_id_rcv:
-                            logging.warning(
-                                f"{room_tag} Peer ID mismatch from {sender_ip}. Expected {expected_peer_id}, got {peer_id_rcv}. Ignoring."
-                            )
-                            continue
-
-                        now = time.time()
-                        is_new_peer = False
-                        peer_id_to_process = expected_peer_id  # Use the verified ID
-
-                        with peers_lock:
-                            if peer_id_to_process not in peers:
-                                is_new_peer = True
-                                logging.info(
-                                    f"{room_tag} Discovered new peer: {peer_name} ({peer_id_to_process})"
-                                )
-                            # Always update last_seen and potentially name/addr
-                            peers[peer_id_to_process] = {
-                                "name": peer_name,
-                                "addr": peer_addr,
-                                "last_seen": now,
-                            }
-
-                        if is_new_peer:
-                            # Notify web clients about the new peer
-                            notify_sse_clients(
-                                "peer_join",
-                                {"peer_id": peer_id_to_process, "name": peer_name},
-                            )
-                            # Create frame queue for this new peer
-                            with frame_queues_lock:
-                                if peer_id_to_process not in frame_queues:
-                                    frame_queues[peer_id_to_process] = queue.Queue(
-                                        maxsize=MAX_FRAME_QUEUE_SIZE
-                                    )
-                                    logging.debug(
-                                        f"{room_tag} Created frame queue for {peer_id_to_process}"
-                                    )
-
-                    except ValueError:
-                        logging.warning(
-                            f"{room_tag} Invalid port number received from {sender_ip}: {peer_zmq_port_str}"
-                        )
-                    except Exception as e:
-                        logging.error(
-                            f"{room_tag} Error processing discovery message from {sender_ip}: {e}",
-                            exc_info=True,
-                        )
-
-        except socket.timeout:
-            pass  # Normal timeout, continue loop
+            readable, _, _ = select.select(
+                [listen_sock, wake_recv], [], [], min(engine.next_timeout(), 1.0)
+            )
+            if wake_recv in readable:
+                wake_recv.recv(64)
+            while listen_sock in readable and len(batch) < engine.MAX_BATCH:
+                data, addr = listen_sock.recvfrom(DISCOVERY_MAX_DATAGRAM)
+                batch.append((data, addr[0], time.time()))
+        except BlockingIOError:
+            pass  # Nothing (more) queued
         except OSError as e:  # Handle potential socket errors during recvfrom
             if not shutdown_flag.is_set():  # Avoid logging errors during shutdown
                 logging.error(f"{room_tag} Error receiving discovery message: {e}")
                 time.sleep(1)  # Avoid busy-looping on recv error
+        try:
+            engine.handle_batch(batch)
         except Exception as e:
-            if not shutdown_flag.is_set():
-                logging.error(
-                    f"{room_tag} Unexpected error in discovery listening: {e}",
-                    exc_info=True,
-                )
-                time.sleep(1)
+            logging.error(f"{room_tag} Error processing discovery messages: {e}", exc_info=True)
 
         # 3. Check for Timed-out Peers
-        now = time.time()
-        timed_out_peers = []
-        with peers_lock:
-            # Iterate over copy of items in case dict changes during iteration elsewhere (less likely here but safer)
-            for peer_id, info in list(peers.items()):
-                if now - info["last_seen"] > PEER_TIMEOUT:
-                    timed_out_peers.append((peer_id, info["name"]))
-                    # Remove directly here while holding lock
-                    del peers[peer_id]
-                    # Also remove frame queue immediately
-                    with frame_queues_lock:
-                        if peer_id in frame_queues:
-                            del frame_queues[peer_id]
-                            logging.debug(
-                                f"{room_tag} Removed frame queue for timed out peer {peer_id}"
-                            )
-
-        # Process timeouts outside the peers_lock
-        for peer_id, peer_name in timed_out_peers:
-            logging.info(f"{room_tag} Peer timed out: {peer_name} ({peer_id})")
-            notify_sse_clients("peer_leave", {"peer_id": peer_id, "name": peer_name})
-            # Frame queue already removed above
+        engine.expire()
 
     # Cleanup
     logging.info(f"{room_tag} Thread shutting down.")
-    broadcast_sock.close()
+    session_switches.remove(wake)
+    wake_recv.close()
+    wake_send.close()
+    send_sock.close()
     listen_sock.close()
 
 
@@ -298,92 +3301,71 @@ def video_publisher_thread():
         zmq_pub_port = my_info["zmq_port"]
         room_number = my_info["room"]
         my_peer_id = my_info["peer_id"]
+        seen_version = session_version
     room_tag = f"[Publisher-{room_number}-{my_peer_id[:8]}]"
     logging.info(f"{room_tag} Thread starting.")
 
     context = zmq.Context.instance()  # Use instance() for shared context potentially
-    pub_socket = context.socket(zmq.PUB)
-    cap = None
-
     try:
-        pub_socket.bind(f"tcp://*:{zmq_pub_port}")
+        pub_socket = open_pub_socket(context, zmq_pub_port)
         logging.info(f"{room_tag} ZMQ Publisher bound to tcp://*:{zmq_pub_port}")
     except zmq.ZMQError as e:
         logging.error(
             f"{room_tag} Could not bind ZMQ PUB socket to port {zmq_pub_port}: {e}. Thread exiting."
         )
-        # pub_socket.close() # Socket might not be valid
         # context.term() # Don't terminate shared context here
         return
 
-    try:
-        cap = cv2.VideoCapture(0)  # Use camera 0
-        if not cap.isOpened():
-            raise IOError("Cannot open webcam")
-
-        cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-        # Optional: Check actual resolution set
-        actual_width = cap.get(cv2.CAP_PROP_FRAME_WIDTH)
-        actual_height = cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
-        logging.info(
-            f"{room_tag} Webcam opened with resolution {actual_width}x{actual_height}"
-        )
-
-    except Exception as e:
-        logging.error(f"{room_tag} Error opening webcam: {e}. Thread exiting.")
-        if cap:
-            cap.release()
+    # Frames come from the shared capture hub, which the self-view also reads from
+    if not capture_hub.acquire():
+        logging.error(f"{room_tag} Error opening webcam. Thread exiting.")
         pub_socket.close()
-        # context.term()
         return
 
-    # Topic uses the room and peer_id for this specific thread run
-    topic = f"{room_number}|{my_peer_id}".encode("utf-8")
-
-    while not shutdown_flag.is_set() and cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            logging.warning(f"{room_tag} Failed to grab frame from camera")
-            time.sleep(0.1)  # Avoid busy loop if camera fails temporarily
-            continue
-
-        # Encode frame as JPEG
-        ret_enc, buffer = cv2.imencode(
-            ".jpg", frame, [int(cv2.IMWRITE_JPEG_QUALITY), JPEG_QUALITY]
-        )
-        if not ret_enc:
-            logging.warning(f"{room_tag} Failed to encode frame")
-            continue
-
-        # Publish: topic + frame data
-        try:
-            # Send topic first, then the image bytes
-            pub_socket.send_multipart(
-                [topic, buffer.tobytes()], zmq.DONTWAIT
-            )  # Use DONTWAIT to avoid blocking if HWM reached
-        except zmq.Again:
-            # High water mark likely reached, message dropped by ZMQ
-            # logging.debug(f"{room_tag} ZMQ PUB High Water Mark reached, frame dropped.")
-            time.sleep(0.01)  # Small sleep if overloaded
-        except zmq.ZMQError as e:
-            if not shutdown_flag.is_set():  # Avoid errors during shutdown
-                logging.warning(f"{room_tag} Error sending frame via ZMQ PUB: {e}")
-                time.sleep(0.5)  # Back off if error sending
+    publisher = VideoPublisher(room_number, my_peer_id, room_tag)
+    last_seq = 0
+    while not shutdown_flag.is_set():
+        last_seq, frame, captured_at = capture_hub.wait_frame(last_seq)
+        if frame is None:
+            continue  # No new frame yet (camera slow or stalled)
+
+        if session_version != seen_version:
+            # Room switch: same socket and camera, new topics
+            seen_version, session = current_session()
+            if session["room"] != room_number:
+                room_number = session["room"]
+                room_tag = f"[Publisher-{room_number}-{my_peer_id[:8]}]"
+                publisher.switch_room(room_number, room_tag)
+        drain_subscriptions(pub_socket, publisher)
+        messages = publisher.prepare(last_seq, frame, captured_at)
+        sent = 0
+        for message in messages:
+            try:
+                # A subscriber at its HWM loses the message silently instead of blocking
+                # us; copy=False sends the encode buffers in place (pyzmq still copies
+                # parts below zmq.COPY_THRESHOLD)
+                pub_socket.send_multipart(message, zmq.DONTWAIT, copy=False)
+                sent += 1
+            except zmq.ZMQError as e:
+                if not shutdown_flag.is_set():  # Avoid errors during shutdown
+                    logging.warning(f"{room_tag} Error sending frame via ZMQ PUB: {e}")
+                    time.sleep(0.5)  # Back off if error sending
+                break
+        if messages:
+            publisher.record_results(sent, len(messages))
 
-        # Limit frame rate server-side
-        time.sleep(1 / 25)  # Aim for ~25 fps max publish rate
+        time.sleep(publisher.frame_done())
 
     # Cleanup
     logging.info(f"{room_tag} Thread shutting down.")
-    if cap:
-        cap.release()
+    publisher.close()
+    capture_hub.release()
     pub_socket.close()
     # Don't terminate shared context here: context.term()
 
 
 def video_subscriber_thread():
-    """Subscribes to peers' video streams and pushes frames to queues."""
+    """Subscribes to peers' video streams and pushes frames to their mailboxes."""
     threads_started.wait()
     if shutdown_flag.is_set():
         return
@@ -393,108 +3375,48 @@ def video_subscriber_thread():
             logging.error("Subscriber: my_info not set.")
             return
         room_number = my_info["room"]
-        my_peer_id = my_info[
-            "peer_id"
-        ]  # Needed to potentially ignore self-loopback if discovery fails
+        seen_version = session_version
     room_tag = f"[Subscriber-{room_number}]"
     logging.info(f"{room_tag} Thread starting.")
 
     context = zmq.Context.instance()
     sub_socket = context.socket(zmq.SUB)
-    sub_socket.setsockopt(
-        zmq.RCVTIMEO, 1000
-    )  # Timeout for receiving messages (milliseconds)
-    # Subscribe based on the room number for this run
-    topic_filter = f"{room_number}|".encode("utf-8")
-    sub_socket.setsockopt(zmq.SUBSCRIBE, topic_filter)
-    logging.info(f"{room_tag} Subscribed to topic filter: {topic_filter.decode()}")
+    # Receive timeout (milliseconds): also how soon a newly opened feed is subscribed when
+    # nothing else is arriving
+    sub_socket.setsockopt(zmq.RCVTIMEO, int(SUBSCRIPTION_SYNC_INTERVAL * 1000))
+    # Subscriptions are per peer and simulcast layer, managed by sync_layer_subscriptions
 
     connected_peer_addrs = set()  # Keep track of ZMQ connect() calls: {(ip, port), ...}
+    layer_subscriptions = {}  # { peer_id: layer name } subscribed on sub_socket
+    compositor = DeltaCompositor()  # Rebuilds full frames from delta-mode tile patches
+    next_sync = 0.0
 
     while not shutdown_flag.is_set():
-        # Dynamically connect/disconnect based on current peer list
-        target_peer_addrs = set()
-        with peers_lock:
-            # Get addresses of peers currently known for *any* room (discovery manages room filtering)
-            # We only need the addresses to connect the SUB socket
-            target_peer_addrs = {info["addr"] for info in peers.values()}
-
-        # Connect to new peers
-        new_connections = target_peer_addrs - connected_peer_addrs
-        for ip, port in new_connections:
-            connect_addr = f"tcp://{ip}:{port}"
-            try:
-                logging.info(f"{room_tag} Connecting ZMQ SUB to {connect_addr}")
-                sub_socket.connect(connect_addr)
-                connected_peer_addrs.add((ip, port))
-            except zmq.ZMQError as e:
-                logging.error(
-                    f"{room_tag} Failed to connect ZMQ SUB to {connect_addr}: {e}"
-                )
-
-        # Disconnect from disappeared peers
-        disconnected = connected_peer_addrs - target_peer_addrs
-        for ip, port in disconnected:
-            disconnect_addr = f"tcp://{ip}:{port}"
-            try:
-                logging.info(f"{room_tag} Disconnecting ZMQ SUB from {disconnect_addr}")
-                sub_socket.disconnect(disconnect_addr)
-                connected_peer_addrs.remove((ip, port))
-            except zmq.ZMQError as e:
-                # Can happen if connection already closed, usually safe to ignore warning
-                logging.warning(
-                    f"{room_tag} Error disconnecting ZMQ SUB from {disconnect_addr}: {e}"
+        if session_version != seen_version:
+            seen_version, session = current_session()
+            if session["room"] != room_number:
+                # Room switch: leave the old room's streams, keep the socket
+                drop_subscriptions(
+                    sub_socket, connected_peer_addrs, layer_subscriptions, room_number, room_tag
                 )
+                room_number = session["room"]
+                room_tag = f"[Subscriber-{room_number}]"
+                compositor = DeltaCompositor()
+                next_sync = 0.0
+
+        # Dynamically connect/disconnect and pick layers based on peers and viewers
+        now = time.monotonic()
+        if now >= next_sync:
+            sync_subscriptions(
+                sub_socket, connected_peer_addrs, layer_subscriptions, room_number, room_tag
+            )
+            next_sync = now + SUBSCRIPTION_SYNC_INTERVAL
 
         # Receive messages
         try:
-            multipart_msg = (
-                sub_socket.recv_multipart()
-            )  # Blocks until timeout or message
-            if len(multipart_msg) == 2:
-                topic, frame_data = multipart_msg
-                try:
-                    topic_str = topic.decode("utf-8")
-                    topic_parts = topic_str.split("|")
-
-                    if len(topic_parts) == 2:
-                        rcv_room, sender_peer_id = topic_parts
-
-                        # Check if the message is for the room this thread is managing
-                        if rcv_room == room_number:
-                            # Check if sender is still considered an active peer (mitigates late messages)
-                            peer_exists = False
-                            with peers_lock:
-                                peer_exists = sender_peer_id in peers
-
-                            if peer_exists:
-                                # Put frame in the corresponding queue for SSE
-                                with frame_queues_lock:
-                                    if sender_peer_id in frame_queues:
-                                        try:
-                                            # Store raw frame data bytes
-                                            frame_queues[sender_peer_id].put_nowait(
-                                                frame_data
-                                            )
-                                        except queue.Full:
-                                            # Queue is full, drop the frame (shows client UI is lagging)
-                                            logging.debug(
-                                                f"{room_tag} Frame queue full for {sender_peer_id}, dropping frame."
-                                            )
-                                            pass
-                                    # else: Queue might have been removed just before this check, ignore.
-                            # else: logging.debug(f"{room_tag} Received frame from inactive/unknown peer {sender_peer_id}. Ignoring.")
-                        # else: Message received for a different room, ZMQ filter might have race condition on unsubscribe? Ignore.
-
-                except UnicodeDecodeError:
-                    logging.warning(f"{room_tag} Received message with non-UTF8 topic.")
-                except Exception as e:  # Catch errors processing message parts
-                    logging.error(
-                        f"{room_tag} Error processing received ZMQ message parts: {e}"
-                    )
-
-        # else: Received message with unexpected part count
-
+            # Blocks until timeout or message; parts stay in their zmq.Frame buffers
+            multipart_msg = sub_socket.recv_multipart(copy=False)
+            handle_video_message(multipart_msg, room_number, compositor, room_tag)
         except zmq.Again:
             pass  # Normal receive timeout, loop continues
         except zmq.ZMQError as e:
@@ -518,54 +3440,79 @@ def video_subscriber_thread():
     # Don't terminate shared context here: context.term()
 
 
-def sse_frame_distributor_thread():
-    """Periodically checks frame queues and sends updates via SSE."""
-    threads_started.wait()
-    if shutdown_flag.is_set():
-        return
-    logging.info("[SSE Distributor] Thread starting.")
+# --- Thread Management ---
 
-    while not shutdown_flag.is_set():
-        frames_to_send = {}
-        with frame_queues_lock:
-            # Get one frame from each non-empty queue
-            # Iterate over a copy of keys in case dict changes during iteration
-            for peer_id in list(frame_queues.keys()):
-                q = frame_queues.get(peer_id)  # Get queue again safely
-                if q:
-                    try:
-                        frame_data = q.get_nowait()  # Get raw jpg bytes
-                        # Encode to base64 for JSON embedding in SSE
-                        b64_frame = base64.b64encode(frame_data).decode("utf-8")
-                        frames_to_send[peer_id] = b64_frame
-                    except queue.Empty:
-                        continue  # No new frame for this peer
-                    except Exception as e:
-                        logging.error(
-                            f"[SSE Distributor] Error processing frame from queue for {peer_id}: {e}"
-                        )
-
-        # Send collected frames via SSE
-        if frames_to_send:
-            # Use a non-blocking approach or thread pool if notify becomes slow?
-            # For now, assume notify_sse_clients is fast enough
-            for peer_id, b64_frame in frames_to_send.items():
-                notify_sse_clients(
-                    "video_update", {"peer_id": peer_id, "frame": b64_frame}
-                )
 
-        # Adjust sleep time based on desired update rate for the web UI
-        time.sleep(1 / 30)  # ~30 Hz update rate target
+class ThreadRuntime:
+    """Runs discovery, publisher and subscriber as daemon threads (the werkzeug mode)."""
+
+    def start(self):
+        threads.clear()  # Clear previous thread list
+
+        # Define threads
+        disc_thread = threading.Thread(
+            target=discovery_thread, name="DiscoveryThread", daemon=True
+        )
+        pub_thread = threading.Thread(
+            target=video_publisher_thread, name="VideoPublisherThread", daemon=True
+        )
+        sub_thread = threading.Thread(
+            target=video_subscriber_thread, name="VideoSubscriberThread", daemon=True
+        )
+        threads.extend([disc_thread, pub_thread, sub_thread])
+
+        # Start threads
+        for t in threads:
+            t.start()
+
+    def stop(self):
+        # Wait for threads to finish
+        active_threads = list(threads)  # Copy list for safe iteration
+        for t in active_threads:
+            try:
+                t.join(timeout=2.0)  # Wait for 2 seconds per thread
+                if t.is_alive():
+                    logging.warning(f"Thread {t.name} did not shut down gracefully.")
+            except Exception as e:
+                logging.error(f"Error joining thread {t.name}: {e}")
+        threads.clear()  # Clear the list
 
-    logging.info("[SSE Distributor] Thread shutting down.")
 
+# Runs the background loops; app_async.py swaps in its asyncio runtime before serving
+runtime = ThreadRuntime()
+session_switches = ChangeListeners()  # Notified after switch_session() bumps session_version
 
-# --- Thread Management ---
+
+def current_session():
+    """Returns (session_version, copy of my_info) for the loops to reconfigure from."""
+    with my_info_lock:
+        return session_version, dict(my_info)
+
+
+def switch_session(room, name):
+    """Moves the running loops to a new room and/or name in place.
+
+    Camera, ZMQ sockets and peer ID stay as they are: the publisher retopics, the
+    subscriber drops the old room's streams and discovery announces the change. On a
+    room change every page gets a reset event first, so it clears the old room's tiles
+    ahead of the new room's peer_join events.
+    """
+    global session_version
+    with my_info_lock:
+        room_changed = my_info.get("room") != room
+    if room_changed:
+        with sse_clients_lock:
+            for client in sse_clients:
+                client.resync([])
+    with my_info_lock:
+        my_info["room"] = room
+        my_info["name"] = name
+        session_version += 1
+    session_switches.notify()
 
 
 def start_background_threads():
     """Starts all necessary background threads IF they aren't running."""
-    global threads
     # Ensure this function is thread-safe if called concurrently (using config_lock externally)
     if threads_started.is_set():
         logging.warning("Attempted to start threads when already started.")
@@ -580,27 +3527,8 @@ def start_background_threads():
 
     logging.info(f"Starting background threads for room='{room}', name='{name}'...")
     shutdown_flag.clear()  # Ensure flag is clear before starting new threads
-    threads.clear()  # Clear previous thread list
-
-    # Define threads
-    disc_thread = threading.Thread(
-        target=discovery_thread, name="DiscoveryThread", daemon=True
-    )
-    pub_thread = threading.Thread(
-        target=video_publisher_thread, name="VideoPublisherThread", daemon=True
-    )
-    sub_thread = threading.Thread(
-        target=video_subscriber_thread, name="VideoSubscriberThread", daemon=True
-    )
-    sse_dist_thread = threading.Thread(
-        target=sse_frame_distributor_thread, name="SSEDistributorThread", daemon=True
-    )
-
-    threads.extend([disc_thread, pub_thread, sub_thread, sse_dist_thread])
-
-    # Start threads
-    for t in threads:
-        t.start()
+    runtime.start()
+    recorder.start()
 
     threads_started.set()  # Signal that threads are (attempting to) run
     logging.info("Background threads initiated.")
@@ -608,7 +3536,6 @@ def start_background_threads():
 
 def stop_background_threads():
     """Signals all background threads to stop and waits for them, clearing state."""
-    global threads
     # Ensure this function is thread-safe if called concurrently (using config_lock externally)
     if not threads_started.is_set():
         # logging.info("No background threads currently running to stop.")
@@ -618,30 +3545,164 @@ def stop_background_threads():
         room = my_info.get("room", "N/A")
     logging.info(f"Stopping background threads for room {room}...")
     shutdown_flag.set()  # Signal threads to stop via the event
-
-    # Wait for threads to finish
-    active_threads = list(threads)  # Copy list for safe iteration
-    for t in active_threads:
-        try:
-            t.join(timeout=2.0)  # Wait for 2 seconds per thread
-            if t.is_alive():
-                logging.warning(f"Thread {t.name} did not shut down gracefully.")
-        except Exception as e:
-            logging.error(f"Error joining thread {t.name}: {e}")
+    runtime.stop()  # Waits for them to finish
+    recorder.stop()  # Writes out frames still queued
 
     threads_started.clear()  # Signal that threads are stopped
-    threads.clear()  # Clear the list
 
     # Clear state associated with the session
-    with peers_lock:
-        peers.clear()
-    with frame_queues_lock:
-        frame_queues.clear()
+    peer_registry.clear()
+    # Peer feed generators notice threads_started is cleared and unregister themselves
     # Note: SSE clients might still be connected briefly, they will error out or timeout.
     # We could explicitly close their queues here if needed, but maybe not necessary.
     logging.info("Background threads stopped and state cleared.")
 
 
+# --- Warm Standby ---
+
+
+class JoinTimer:
+    """Time from /join to the publisher's first frame.
+
+    "ready" is the first frame the publisher could send (source opened, socket bound,
+    loops running), which is what warm standby shortens; "published" the first one that
+    actually went out, which also waits for a peer to discover us and subscribe.
+    """
+
+    def __init__(self):
+        self._joined_at = None
+        self._seconds = {}  # { stage: seconds after the join }
+
+    def start(self):
+        self._joined_at = time.monotonic()
+        self._seconds = {}
+
+    def mark(self, stage):
+        """Records stage the first time it is reached after a join; cheap otherwise."""
+        if self._joined_at is None or stage in self._seconds:
+            return
+        seconds = time.monotonic() - self._joined_at
+        self._seconds = dict(self._seconds, **{stage: seconds})
+        logging.info(f"[Join] First frame {stage} {seconds * 1000:.0f} ms after /join")
+
+    def stats(self):
+        return {f"first_frame_{stage}_ms": round(s * 1000, 1) for stage, s in self._seconds.items()}
+
+    def seconds(self):
+        return self._seconds
+
+
+join_timer = JoinTimer()
+Gauge(
+    "p2p_join_first_frame_seconds",
+    "Seconds from the latest /join to the publisher's first frame ready to send and "
+    "first frame published.",
+    lambda: join_timer.seconds(),
+    label="stage",
+)
+
+
+def reserve_zmq_port():
+    """Returns the ZMQ PUB port: --zmq-port, or a free one picked once and then kept.
+    Call with config_lock held."""
+    zmq_pub_port = app.config.get("ZMQ_PORT", 0)  # Get from app config or use default
+    if zmq_pub_port == 0:
+        # Assign a random port if not specified
+        temp_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        local_ip_for_bind = get_local_ip()  # Use local IP hint for binding ephemeral port
+        temp_sock.bind((local_ip_for_bind, 0))
+        zmq_pub_port = temp_sock.getsockname()[1]
+        temp_sock.close()
+        app.config["ZMQ_PORT"] = zmq_pub_port  # Store globally for consistency
+        logging.info(f"Using randomly assigned ZMQ PUB port: {zmq_pub_port}")
+    return zmq_pub_port
+
+
+class WarmStandby:
+    """Gets ready for /join in the background right after launch (--warm-standby).
+
+    While the setup page is shown it imports the heavy modules, opens the frame source
+    and waits for its first frame (cameras take a while to deliver one), and binds the
+    ZMQ PUB socket, so a join only has to start the loops. The source then stays open
+    for the life of the process, held by the standby; the socket goes to the first
+    publisher that asks for its port (take_pub_socket()).
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._thread = None
+        self._holds_capture = False
+        self._pub_socket = None
+        self._pub_port = None
+
+    def start(self):
+        if not self.enabled or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._prepare, name="StandbyThread", daemon=True)
+        self._thread.start()
+
+    def _prepare(self):
+        started = time.monotonic()
+        for module in HEAVY_MODULES:
+            module.load()
+        imported = time.monotonic()
+
+        holds_capture = capture_hub.acquire()
+        with self._lock:
+            self._holds_capture = holds_capture
+        if holds_capture:
+            capture_hub.wait_frame(0, timeout=CAPTURE_WORKER_START_TIMEOUT)
+        else:
+            logging.warning("[Standby] Cannot open the frame source; /join will try again.")
+        primed = time.monotonic()
+
+        with config_lock:
+            if threads_started.is_set():
+                return  # Joined meanwhile, the publisher bound its own socket
+            zmq_pub_port = reserve_zmq_port()
+            try:
+                pub_socket = create_pub_socket(zmq.Context.instance(), zmq_pub_port)
+            except zmq.ZMQError as e:
+                logging.warning(f"[Standby] Could not bind ZMQ PUB port {zmq_pub_port}: {e}")
+                pub_socket = None
+            with self._lock:
+                self._pub_socket, self._pub_port = pub_socket, zmq_pub_port
+        logging.info(
+            f"[Standby] Ready in {(time.monotonic() - started) * 1000:.0f} ms (imports "
+            f"{(imported - started) * 1000:.0f} ms, source {(primed - imported) * 1000:.0f} ms)"
+        )
+
+    def take_pub_socket(self, zmq_pub_port):
+        """Hands over the pre-bound PUB socket if it is bound to zmq_pub_port, else None."""
+        with self._lock:
+            if self._pub_socket is None or self._pub_port != zmq_pub_port:
+                return None
+            pub_socket, self._pub_socket = self._pub_socket, None
+            return pub_socket
+
+    def stop(self):
+        if self._thread is not None:
+            self._thread.join(timeout=CAPTURE_WORKER_START_TIMEOUT)
+            self._thread = None
+        with self._lock:
+            if self._pub_socket is not None:
+                self._pub_socket.close()
+                self._pub_socket = None
+            holds_capture, self._holds_capture = self._holds_capture, False
+        if holds_capture:
+            capture_hub.release()
+
+
+warm_standby = WarmStandby()
+
+
+def open_pub_socket(context, zmq_pub_port):
+    """The warm standby's PUB socket if it bound one for zmq_pub_port, else a new one."""
+    pub_socket = warm_standby.take_pub_socket(zmq_pub_port)
+    return pub_socket if pub_socket is not None else create_pub_socket(context, zmq_pub_port)
+
+
 # --- Flask Routes ---
 
 
@@ -696,20 +3757,7 @@ def join_chat():
             stop_background_threads()
 
         # Configure my_info for the first time
-        zmq_pub_port = app.config.get(
-            "ZMQ_PORT", 0
-        )  # Get from app config or use default
-        if zmq_pub_port == 0:
-            # Assign a random port if not specified
-            temp_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            local_ip_for_bind = (
-                get_local_ip()
-            )  # Use local IP hint for binding ephemeral port
-            temp_sock.bind((local_ip_for_bind, 0))
-            zmq_pub_port = temp_sock.getsockname()[1]
-            temp_sock.close()
-            app.config["ZMQ_PORT"] = zmq_pub_port  # Store globally for consistency
-            logging.info(f"Using randomly assigned ZMQ PUB port: {zmq_pub_port}")
+        zmq_pub_port = reserve_zmq_port()
 
         with my_info_lock:
             my_info.clear()  # Ensure clean slate
@@ -723,6 +3771,7 @@ def join_chat():
             )
 
         # Start the background threads now that info is set
+        join_timer.start()
         start_background_threads()
 
     # Redirect to the main page, which will now show the chat interface
@@ -786,21 +3835,8 @@ def switch_room():
                 f"Switching room/name for {peer_id}: From Room='{current_room}' Name='{current_name}' TO Room='{new_room}' Name='{new_name}'"
             )
 
-            # ---- Reconfiguration Process ----
-            # 1. Stop current threads & clear state
-            stop_background_threads()  # This now clears peers and frame_queues
-
-            # 2. Update configuration in my_info (keep IP, ZMQ port, peer_id)
-            with my_info_lock:
-                my_info["room"] = new_room
-                my_info["name"] = new_name
-                # Peer ID remains the same as ZMQ port is reused
-
-            # 3. Restart threads with the new configuration
-            # Give a tiny pause for OS/network resources to potentially release if needed
-            time.sleep(0.2)
-            start_background_threads()
-            # ---- Reconfiguration Complete ----
+            # Reconfigure the running loops in place (keeps IP, ZMQ port and peer_id)
+            switch_session(new_room, new_name)
 
             return jsonify({"status": "ok", "message": "Switched successfully."})
 
@@ -846,8 +3882,113 @@ def leave_chat():
 # --- Video Feed and SSE Routes ---
 
 
-def gen_self_frames():
-    """Generator function for streaming own video feed."""
+def mjpeg_part(jpeg, captured_at=None):
+    """Wraps one JPEG (any bytes-like object) in the format required by
+    multipart/x-mixed-replace. This is the only copy of a frame on its way to the client.
+
+    captured_at (time.time() at the sender) goes into an X-Capture-Timestamp part header,
+    which browsers ignore and loadtest.py uses to measure capture-to-viewer latency.
+    """
+    if captured_at is None:
+        head = b"--frame\r\nContent-Type: image/jpeg\r\n\r\n"
+    else:
+        head = (
+            b"--frame\r\nContent-Type: image/jpeg\r\nX-Capture-Timestamp: %.6f\r\n\r\n"
+            % captured_at
+        )
+    return b"".join((head, jpeg, b"\r\n"))
+
+
+def peer_feed_refusal(peer_id):
+    """Returns (message, status) if peer_id's feed cannot be served, otherwise None."""
+    if not threads_started.is_set():
+        return "Not joined.", 403
+    if peer_registry.get(peer_id) is None:
+        return "Unknown peer.", 404
+    return None
+
+
+def attach_feed_viewer(peer_id, width=None, throttle=None, internal=False):
+    viewer = FeedViewer(peer_id, width, throttle, internal)
+    with peer_feed_clients_lock:
+        peer_feed_clients.setdefault(peer_id, []).append(viewer)
+    return viewer
+
+
+def detach_feed_viewer(viewer):
+    with peer_feed_clients_lock:
+        viewers = peer_feed_clients.get(viewer.peer_id)
+        if viewers is not None:
+            try:
+                viewers.remove(viewer)
+            except ValueError:
+                pass  # Already removed
+            if not viewers:
+                del peer_feed_clients[viewer.peer_id]
+
+
+def has_mailbox_readers(peer_id):
+    """Whether any viewer of peer_id reads its mailbox (i.e. is not internal)."""
+    with peer_feed_clients_lock:
+        return any(not viewer.internal for viewer in peer_feed_clients.get(peer_id, ()))
+
+
+def peer_mailbox(peer_id):
+    # Look the mailbox up each time: it is replaced if the peer leaves and rejoins
+    record = peer_registry.get(peer_id)
+    return record.mailbox if record else None
+
+
+def parse_peer_list(text):
+    """The peer ids of a comma separated ?peers= list, or None (every peer) if absent."""
+    if text is None:
+        return None
+    return {peer_id for peer_id in text.split(",") if peer_id}
+
+
+def feed_throttle(fps=None, viewer_id=None):
+    """The FeedThrottle of a feed opened with ?fps= and ?viewer= (both optional)."""
+    budget = None
+    if viewer_id:
+        with viewer_budgets_lock:
+            budget = viewer_budgets.get(viewer_id)
+    return FeedThrottle(fps, budget)
+
+
+def register_sse_client(remote_addr, fps=None, peers=None):
+    """Creates the outbox of a new SSE connection, primed with its viewer id and the
+    current peer list. fps and peers declare the page's initial ViewerBudget."""
+    budget = ViewerBudget(fps, peers)
+    client = SSEClient(remote_addr, budget)
+    with viewer_budgets_lock:
+        viewer_budgets[budget.viewer_id] = budget
+    with sse_clients_lock:
+        sse_clients.append(client)
+        total = len(sse_clients)
+    logging.info(f"SSE client connected: {remote_addr} (Total: {total})")
+
+    # The page passes this id as ?viewer= to its feeds and to POST /api/viewer/<viewer_id>
+    client.push_control(format_sse("viewer", {"viewer_id": budget.viewer_id}))
+    # Immediately send current list of peers to the new client
+    for initial_peer_msg in current_peer_messages():
+        client.push_control(initial_peer_msg)
+    return client
+
+
+def unregister_sse_client(client):
+    logging.info(f"SSE client disconnected: {client.remote_addr}")
+    with viewer_budgets_lock:
+        viewer_budgets.pop(client.budget.viewer_id, None)
+    with sse_clients_lock:
+        try:
+            sse_clients.remove(client)
+            logging.debug(f"Removed SSE outbox for {client.remote_addr}")
+        except ValueError:
+            pass  # Outbox already removed
+
+
+def gen_self_frames(throttle):
+    """Generator function for streaming own video feed, capped and paused by throttle."""
     # Check if threads are supposed to be running
     if not threads_started.is_set():
         logging.warning("Attempted to get self video feed when not joined/running.")
@@ -855,59 +3996,271 @@ def gen_self_frames():
         # For simplicity, just stop here
         return
 
-    cap = cv2.VideoCapture(0)
-    if not cap.isOpened():
+    # Share the publisher's capture instead of opening the device a second time
+    if not capture_hub.acquire():
         logging.error("Cannot open webcam for self-view stream.")
         return
 
-    # Reduced resolution for self-view is often fine
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH, 320)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 240)
-
     logging.info("[SelfFeed] Starting video capture loop.")
-    while threads_started.is_set() and not shutdown_flag.is_set() and cap.isOpened():
-        success, frame = cap.read()
-        if not success:
-            logging.warning("[SelfFeed] Failed to get frame for self-view.")
-            time.sleep(0.5)  # Wait a bit if capture fails
-            continue
-        else:
-            # Encode with slightly lower quality for self-view perhaps
-            ret, buffer = cv2.imencode(
-                ".jpg", frame, [int(cv2.IMWRITE_JPEG_QUALITY), JPEG_QUALITY - 10]
+    pacer = register_pacer("self_view", SELF_VIEW_FPS, unique=True)
+    last_seq = 0
+    paused = False
+    try:
+        while threads_started.is_set() and not shutdown_flag.is_set():
+            if not throttle.active():
+                paused = True
+                throttle.wait(1.0)
+                continue
+            if paused:
+                paused = False
+                pacer.reset()
+            pacer.set_target(throttle.limit(capture_hub.limit_fps(SELF_VIEW_FPS)))
+            last_seq, frame, captured_at = capture_hub.wait_frame(last_seq)
+            if frame is None:
+                continue  # No new frame yet
+            # Reduced resolution and slightly lower quality for self-view; every open
+            # self-view tab shares this one cached encode
+            frame_bytes = capture_hub.get_jpeg(
+                last_seq, frame, SELF_VIEW_SIZE, JPEG_QUALITY - 10
             )
-            if not ret:
+            if frame_bytes is None:
                 logging.warning("[SelfFeed] Failed to encode self-view frame.")
                 continue
-            frame_bytes = buffer.tobytes()
-            # Yield the frame in the format required by multipart/x-mixed-replace
-            try:
-                yield (
-                    b"--frame\r\n"
-                    b"Content-Type: image/jpeg\r\n\r\n" + frame_bytes + b"\r\n"
-                )
-            except GeneratorExit:
-                # Client disconnected
-                logging.info("[SelfFeed] Client disconnected from self feed.")
-                break  # Exit loop cleanly
+            yield mjpeg_part(frame_bytes, captured_at)
             # Control streaming rate
-            time.sleep(1 / 20)  # Aim for ~20 fps for self view
-
-    logging.info("[SelfFeed] Stopping self-view stream.")
-    cap.release()
+            pacer.wait()
+    except GeneratorExit:
+        # Client disconnected
+        logging.info("[SelfFeed] Client disconnected from self feed.")
+    finally:
+        logging.info("[SelfFeed] Stopping self-view stream.")
+        unregister_pacer(pacer)
+        capture_hub.release()
 
 
 @app.route("/video_feed_self")
 def video_feed_self():
-    """Video streaming route for the client's own camera."""
+    """Video streaming route for the client's own camera.
+
+    Like every feed it takes an optional ?fps= cap and ?viewer= (see ViewerBudget).
+    """
+    throttle = feed_throttle(request.args.get("fps", type=float), request.args.get("viewer"))
     return Response(
-        gen_self_frames(), mimetype="multipart/x-mixed-replace; boundary=frame"
+        gen_self_frames(throttle), mimetype="multipart/x-mixed-replace; boundary=frame"
+    )
+
+
+def gen_peer_frames(viewer):
+    """Generator function for streaming a remote peer's JPEG frames unchanged.
+
+    Wakes as soon as the subscriber puts a frame into the peer's mailbox, but no sooner
+    than the viewer's frame-rate cap allows.
+    """
+    peer_id = viewer.peer_id
+    throttle = viewer.throttle
+    mailbox = None
+    logging.info(f"[PeerFeed] Viewer attached to {peer_id}.")
+    try:
+        while threads_started.is_set() and not shutdown_flag.is_set():
+            current = peer_mailbox(peer_id)
+            if current is None:
+                break  # Peer has left (timed out or room switched)
+            if current is not mailbox:
+                # The peer left and rejoined: its new mailbox counts versions from 0
+                mailbox = current
+                viewer.version = 0
+            if not throttle.active(peer_id):
+                # Page hidden or peer paged away; choose_layer() stops receiving it meanwhile
+                throttle.wait(1.0)
+                continue
+            delay = throttle.delay()
+            if delay:
+                throttle.wait(delay)
+                continue
+            version, frame_data, captured_at = mailbox.wait_newer(viewer.version, timeout=1.0)
+            if frame_data is None:
+                continue
+            if viewer.version and version > viewer.version + 1 and throttle.target_fps():
+                feed_frames_coalesced_total.inc(version - viewer.version - 1)
+            viewer.version = version
+            serialize_start = time.perf_counter()
+            part = mjpeg_part(frame_data, captured_at)
+            serialize_duration.observe(time.perf_counter() - serialize_start)
+            yield part
+            throttle.sent()
+    except GeneratorExit:
+        # Client disconnected
+        logging.info(f"[PeerFeed] Client disconnected from feed of {peer_id}.")
+    finally:
+        detach_feed_viewer(viewer)
+        logging.info(f"[PeerFeed] Stopping feed of {peer_id}.")
+
+
+@app.route("/video_feed/<peer_id>")
+def video_feed_peer(peer_id):
+    """Video streaming route for a remote peer's camera, relayed as received JPEG frames.
+
+    The optional ?w= query parameter is the width the page shows the feed at; the
+    subscriber receives the smallest simulcast layer that still covers it. ?fps= caps
+    the frame rate and ?viewer= makes the feed follow its page's ViewerBudget.
+    """
+    refusal = peer_feed_refusal(peer_id)
+    if refusal:
+        error, status = refusal
+        return Response(error, status=status)
+
+    throttle = feed_throttle(request.args.get("fps", type=float), request.args.get("viewer"))
+    viewer = attach_feed_viewer(peer_id, request.args.get("w", type=int), throttle)
+    response = Response(
+        gen_peer_frames(viewer),
+        mimetype="multipart/x-mixed-replace; boundary=frame",
+    )
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+def gen_mosaic_frames(throttle):
+    """Generator function for streaming the mosaic of all peers (see MosaicHub)."""
+    if not threads_started.is_set():
+        logging.warning("Attempted to get mosaic feed when not joined/running.")
+        return
+
+    mosaic_hub.acquire()
+    attached = True
+    logging.info("[MosaicFeed] Client attached.")
+    last_seq = 0
+    try:
+        while threads_started.is_set() and not shutdown_flag.is_set():
+            if not throttle.active():
+                if attached:
+                    # Nothing is composed for a hidden page; the last one out stops the hub
+                    mosaic_hub.release()
+                    attached = False
+                throttle.wait(1.0)
+                continue
+            if not attached:
+                mosaic_hub.acquire()
+                attached = True
+            delay = throttle.delay()
+            if delay:
+                throttle.wait(delay)
+                continue
+            last_seq, jpeg = mosaic_hub.wait_mosaic(last_seq)
+            if jpeg is None:
+                continue
+            yield mjpeg_part(jpeg)
+            throttle.sent()
+    except GeneratorExit:
+        logging.info("[MosaicFeed] Client disconnected from mosaic feed.")
+    finally:
+        if attached:
+            mosaic_hub.release()
+
+
+@app.route("/video_feed_mosaic")
+def video_feed_mosaic():
+    """One stream with every peer of the room tiled into a grid, composited and encoded
+    on this node: a single connection and decode for clients too weak for one per peer."""
+    throttle = feed_throttle(request.args.get("fps", type=float), request.args.get("viewer"))
+    response = Response(
+        gen_mosaic_frames(throttle), mimetype="multipart/x-mixed-replace; boundary=frame"
+    )
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+@app.route("/recordings")
+def recordings():
+    """Lists the recordings under --record-dir, for /recordings/<recording>/<peer>."""
+    if recorder.directory is None:
+        return jsonify({"status": "error", "message": "Recording is not enabled."}), 404
+    return jsonify(list_recordings())
+
+
+def gen_recording_frames(reader, position):
+    """Generator function replaying a recording from position at its original pace."""
+    clock = PlaybackClock()
+    try:
+        for position in range(position, len(reader)):
+            timestamp, jpeg = reader.frame(position)
+            time.sleep(clock.delay(timestamp))
+            yield mjpeg_part(jpeg)
+    finally:
+        reader.close()
+
+
+@app.route("/recordings/<recording>/<peer>")
+def recording_playback(recording, peer):
+    """Replays one peer of a recording as an MJPEG stream.
+
+    The optional ?t= query parameter is the position to start at, in seconds after the
+    recording started.
+    """
+    opened = open_recording(recording, peer, request.args.get("t", 0.0, type=float))
+    if opened is None:
+        return Response("Unknown recording.", status=404)
+    response = Response(
+        gen_recording_frames(*opened),
+        mimetype="multipart/x-mixed-replace; boundary=frame",
+    )
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+@app.route("/api/stats")
+def api_stats():
+    """Reports paced-loop fps and per-peer loss/latency/jitter statistics for this node."""
+    with pacers_lock:
+        pacing = {name: pacer.stats() for name, pacer in pacers.items()}
+    peers_stats = {
+        peer_id: record.stats.snapshot() for peer_id, record in peer_registry.snapshot().items()
+    }
+    with viewer_budgets_lock:
+        viewers = {viewer_id: budget.stats() for viewer_id, budget in viewer_budgets.items()}
+    return jsonify(
+        {"pacing": pacing, "peers": peers_stats, "join": join_timer.stats(), "viewers": viewers}
     )
 
 
+@app.route("/api/viewer/<viewer_id>", methods=["POST"])
+def update_viewer(viewer_id):
+    """Changes a page's ViewerBudget, e.g. {"fps": 0} when it is hidden.
+
+    The JSON body may set "fps" (null: uncapped, 0: paused) and "peers" (a list of peer
+    ids, null: every peer); a key left out keeps its current value.
+    """
+    with viewer_budgets_lock:
+        budget = viewer_budgets.get(viewer_id)
+    if budget is None:
+        return jsonify({"status": "error", "message": "Unknown viewer."}), 404
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"status": "error", "message": "Expected a JSON object."}), 400
+    fps = data.get("fps", budget.fps)
+    peers = data.get("peers", budget.peers)
+    if fps is not None and (isinstance(fps, bool) or not isinstance(fps, (int, float))):
+        return jsonify({"status": "error", "message": "fps must be a number or null."}), 400
+    if peers is not None and not (
+        isinstance(peers, (list, frozenset)) and all(isinstance(peer_id, str) for peer_id in peers)
+    ):
+        return jsonify({"status": "error", "message": "peers must be a list of ids or null."}), 400
+    budget.update(fps, peers)
+    return jsonify({"status": "ok", **budget.stats()})
+
+
+@app.route("/metrics")
+def metrics():
+    """Prometheus scrape endpoint for capture, publish, receive and SSE metrics."""
+    body = "\n".join(metric.render() for metric in metrics_registry) + "\n"
+    return Response(body, mimetype="text/plain; version=0.0.4")
+
+
 @app.route("/events")
 def events():
-    """Server-Sent Events endpoint for peer updates and video frames."""
+    """Server-Sent Events endpoint for peer join/leave updates (video uses /video_feed/<peer_id>).
+
+    Optional ?fps= and ?peers= (comma separated ids) declare the page's ViewerBudget.
+    """
     # Check if the user should be connected (threads running implies setup complete)
     if not threads_started.is_set():
         logging.warning(
@@ -917,32 +4270,13 @@ def events():
         # Let's return Forbidden, client JS should handle this.
         return Response("Not joined.", status=403)
 
-    # Each client gets their own queue for SSE messages
-    client_queue = queue.Queue(maxsize=50)  # Buffer for this specific client connection
-    with sse_clients_lock:
-        sse_clients.append(client_queue)
-    logging.info(
-        f"SSE client connected: {request.remote_addr} (Total: {len(sse_clients)})"
+    # Each client gets their own two-lane outbox for SSE messages
+    client = register_sse_client(
+        request.remote_addr,
+        request.args.get("fps", type=float),
+        parse_peer_list(request.args.get("peers")),
     )
 
-    # Immediately send current list of peers to the new client
-    current_peers_data = []
-    with peers_lock:
-        current_peers_data = [
-            {"peer_id": pid, "name": pinfo["name"]} for pid, pinfo in peers.items()
-        ]
-
-    for peer_data in current_peers_data:
-        try:
-            # Format message correctly
-            initial_peer_msg = f"event: peer_join\ndata: {json.dumps(peer_data)}\n\n"
-            client_queue.put_nowait(initial_peer_msg)
-        except queue.Full:
-            logging.warning(
-                f"SSE client queue full while sending initial peer list to {request.remote_addr}."
-            )
-            # Client might miss initial peers if queue fills instantly
-
     @stream_with_context
     def event_stream():
         """Generator for the SSE stream for this client."""
@@ -951,17 +4285,14 @@ def events():
             not client_disconnected and threads_started.is_set()
         ):  # Continue as long as main threads are running
             try:
-                # Wait for a message on this client's queue
-                message = client_queue.get(
-                    timeout=30
+                # Wait for a message on this client's outbox (control lane first)
+                message = client.get(
+                    timeout=SSE_KEEPALIVE_INTERVAL
                 )  # Timeout helps detect inactive connections/queues
+                if message is None:
+                    # Send a keep-alive comment to prevent connection timeouts by proxies/browsers
+                    message = ": keepalive\n\n"
                 yield message
-            except queue.Empty:
-                # Send a keep-alive comment to prevent connection timeouts by proxies/browsers
-                try:
-                    yield ": keepalive\n\n"
-                except Exception:  # Catch potential errors yielding keepalive if client closed connection
-                    client_disconnected = True
             except Exception as e:
                 # Catch potential errors yielding message if client closed connection
                 logging.warning(f"Error yielding SSE message: {e}")
@@ -976,23 +4307,20 @@ def events():
     response.headers["Cache-Control"] = "no-cache"
     response.headers["X-Accel-Buffering"] = "no"  # Useful for Nginx buffering issues
 
-    # Register cleanup for when client disconnects (though finally block in generator handles queue removal)
+    # Register cleanup for when client disconnects
     @response.call_on_close
     def on_close():
-        logging.info(f"SSE client disconnected (on_close): {request.remote_addr}")
-        with sse_clients_lock:
-            try:
-                sse_clients.remove(client_queue)
-                logging.debug(f"Removed SSE queue for {request.remote_addr}")
-            except ValueError:
-                pass  # Queue already removed (e.g., by generator's finally block)
+        unregister_sse_client(client)
 
     return response
 
 
 # --- Main Execution ---
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="P2P LAN Video Chat")
+
+
+def build_arg_parser(description="P2P LAN Video Chat"):
+    """Command line options shared by app.py and the asyncio entry point app_async.py."""
+    parser = argparse.ArgumentParser(description=description)
     # Keep port arguments, remove room/name
     parser.add_argument(
         "--flask-port",
@@ -1006,12 +4334,96 @@ if __name__ == "__main__":
         default=0,
         help="Specific ZMQ PUB port to bind (default: random available)",
     )
-    args = parser.parse_args()
+    parser.add_argument(
+        "--min-quality",
+        type=int,
+        default=MIN_JPEG_QUALITY,
+        help=f"Lowest JPEG quality the adaptive publisher may use (default: {MIN_JPEG_QUALITY})",
+    )
+    parser.add_argument(
+        "--max-quality",
+        type=int,
+        default=MAX_JPEG_QUALITY,
+        help=f"Highest JPEG quality the adaptive publisher may use (default: {MAX_JPEG_QUALITY})",
+    )
+    parser.add_argument(
+        "--min-fps",
+        type=int,
+        default=MIN_PUBLISH_FPS,
+        help=f"Lowest publish frame rate under load (default: {MIN_PUBLISH_FPS})",
+    )
+    parser.add_argument(
+        "--max-fps",
+        type=int,
+        default=MAX_PUBLISH_FPS,
+        help=f"Publish frame rate when the network is healthy (default: {MAX_PUBLISH_FPS})",
+    )
+    parser.add_argument(
+        "--delta",
+        action="store_true",
+        help="Skip unchanged frames and publish only changed tiles (delta mode)",
+    )
+    parser.add_argument(
+        "--source",
+        type=parse_frame_source,
+        default=CameraSource(),
+        metavar="SPEC",
+        help="Frame source: camera[:DEVICE], synthetic[:WxH][@FPS][,motion=PIXELS], "
+        "file:PATH (looped video) or images:DIR[@FPS] (looped JPEG files) (default: camera:0)",
+    )
+    parser.add_argument(
+        "--discovery",
+        choices=("broadcast", "multicast"),
+        default="broadcast",
+        help="Announce on LAN-wide broadcast, or on a multicast group per room so hosts only "
+        "receive their own room's heartbeats; all nodes of a room must use the same mode "
+        "(default: broadcast)",
+    )
+    parser.add_argument(
+        "--record-dir",
+        metavar="DIR",
+        help="Record every peer's received frames under DIR, for playback at /recordings "
+        "(default: off)",
+    )
+    parser.add_argument(
+        "--capture-process",
+        action="store_true",
+        help="Capture and JPEG-encode in a separate worker process, which hands frames over "
+        "a shared-memory ring, so the media pipeline runs on its own core",
+    )
+    parser.add_argument(
+        "--warm-standby",
+        action="store_true",
+        help="Right after launch, load the heavy modules, open the frame source and bind the "
+        "ZMQ socket in the background, so /join starts publishing sooner; keeps the source "
+        "open while not joined",
+    )
+    return parser
+
+
+def apply_args(args):
+    """Stores parsed command line options in app.config."""
+    app.config["DELTA_MODE"] = args.delta
+    app.config["DISCOVERY_MODE"] = args.discovery
+    capture_hub.source = CaptureWorker(args.source) if args.capture_process else args.source
+    recorder.directory = args.record_dir
+    warm_standby.enabled = args.warm_standby
+    # Bounds for the adaptive publish controller
+    app.config["MIN_JPEG_QUALITY"] = args.min_quality
+    app.config["MAX_JPEG_QUALITY"] = args.max_quality
+    app.config["MIN_PUBLISH_FPS"] = args.min_fps
+    app.config["MAX_PUBLISH_FPS"] = args.max_fps
 
     # Store ZMQ port choice in Flask app config for access in routes
     # If 0, it will be determined randomly on first join
     app.config["ZMQ_PORT"] = args.zmq_port
+
+
+if __name__ == "__main__":
+    args = build_arg_parser().parse_args()
+    apply_args(args)
     flask_port = args.flask_port
+    warm_standby.start()
 
     # Start Flask app (runs indefinitely until interrupted)
     local_ip = get_local_ip()
@@ -1033,4 +4445,5 @@ if __name__ == "__main__":
         logging.info("Ensuring background threads are stopped before exit.")
         with config_lock:  # Ensure atomicity with other operations
             stop_background_threads()
+        warm_standby.stop()
         logging.info("Application exiting.")
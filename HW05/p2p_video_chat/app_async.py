@@ -0,0 +1,825 @@
+# app_async.py
+"""Asyncio runtime for the P2P video chat node.
+
+Discovery, the ZMQ publisher and subscriber, and every streaming response (SSE, the
+self-view, peer and mosaic feeds, recording playback) run as coroutines on one event
+loop served by uvicorn, so an open connection costs a task instead of an OS thread.
+State, the page routes and the JSON/metrics routes are shared with app.py, which still
+runs as the threaded mode.
+
+Only the camera read loop, JPEG encoding, the mosaic compositor and the recorder's disk
+writes stay on threads, as they block.
+
+Usage: python app_async.py [--flask-port PORT] [--zmq-port PORT] [...same options as app.py]
+"""
+import asyncio
+import io
+import logging
+import sys
+import threading
+import time
+import urllib.parse
+
+import uvicorn
+
+import app as node
+
+# Imported on first use, as in app.py
+zmq = node.LazyModule("zmq", globals())
+zmq_asyncio = node.LazyModule("zmq.asyncio", globals(), "zmq_asyncio")
+
+# --- Configuration ---
+FEED_WAIT_TIMEOUT = 1.0  # Seconds a stream waits for new data before rechecking its state
+RUNTIME_CALL_TIMEOUT = 10.0  # Seconds a Flask view waits for the runtime to start/stop
+SHUTDOWN_GRACE = 2  # Seconds uvicorn gives open streams to finish on exit
+
+
+# --- Waking Coroutines ---
+
+
+class Waker:
+    """An asyncio.Event that producers on any thread can set through their ChangeListeners.
+
+    Also records a client disconnect, so one wait() covers both new data and hang-ups.
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self._loop_thread = threading.get_ident()
+        self.event = asyncio.Event()
+        self.closed = False  # Set once the HTTP client has disconnected
+
+    def __call__(self):
+        # Listener callback: runs on the producer's thread (capture or subscriber)
+        if threading.get_ident() == self._loop_thread:
+            self.event.set()
+            return
+        try:
+            self.loop.call_soon_threadsafe(self.event.set)
+        except RuntimeError:
+            pass  # Loop already closed during shutdown
+
+    def clear(self):
+        self.event.clear()
+
+    async def wait(self, timeout):
+        """Waits until woken. Returns False on timeout."""
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def watch_disconnect(self, receive):
+        """Consumes ASGI receive events until the client disconnects, then wakes the stream."""
+        while (await receive())["type"] != "http.disconnect":
+            pass
+        self.closed = True
+        self.event.set()
+
+
+# --- Background Coroutines ---
+
+
+class DiscoveryProtocol(asyncio.DatagramProtocol):
+    """Receives discovery heartbeats on BROADCAST_PORT.
+
+    Datagrams read in one pass of the event loop are handed to the engine as one batch.
+    waker wakes discovery_task when a batch moves the next heartbeat earlier (an early
+    reply to a new peer).
+    """
+
+    def __init__(self, engine, room_tag, waker):
+        self.engine = engine
+        self.room_tag = room_tag
+        self.waker = waker
+        self.pending = []
+
+    def datagram_received(self, data, addr):
+        if not self.pending:
+            asyncio.get_running_loop().call_soon(self.flush)
+        self.pending.append((data, addr[0], time.time()))
+
+    def flush(self):
+        batch, self.pending = self.pending, []
+        next_heartbeat = self.engine.next_heartbeat
+        try:
+            self.engine.handle_batch(batch)
+        except Exception as e:
+            logging.error(f"{self.room_tag} Error processing discovery messages: {e}", exc_info=True)
+        if self.engine.next_heartbeat < next_heartbeat:
+            self.waker()
+
+    def error_received(self, exc):
+        logging.error(f"{self.room_tag} Error receiving discovery message: {exc}")
+
+
+async def open_discovery_endpoints(engine, session, room_tag, waker):
+    """Returns (listen_transport, send_transport, announce_addr). Raises OSError."""
+    loop = asyncio.get_running_loop()
+    listen_sock, send_sock, announce_addr = node.open_discovery_sockets(session, room_tag)
+    listen_transport, _ = await loop.create_datagram_endpoint(
+        lambda: DiscoveryProtocol(engine, room_tag, waker), sock=listen_sock
+    )
+    send_transport, _ = await loop.create_datagram_endpoint(
+        asyncio.DatagramProtocol, sock=send_sock
+    )
+    return listen_transport, send_transport, announce_addr
+
+
+async def discovery_task(session, version):
+    """Broadcasts heartbeats and expires silent peers; replies arrive via DiscoveryProtocol."""
+    loop = asyncio.get_running_loop()
+    room_tag = f"[Discovery-{session['room']}-{session['name'][:5]}]"
+    logging.info(f"{room_tag} Task starting.")
+    engine = node.DiscoveryEngine(session, room_tag)
+    waker = Waker(loop)  # Set by switch_session() and by early replies to new peers
+
+    try:
+        listen_transport, send_transport, announce_addr = await open_discovery_endpoints(
+            engine, session, room_tag, waker
+        )
+    except OSError as e:
+        logging.error(
+            f"{room_tag} Could not bind to UDP port {node.BROADCAST_PORT}: {e}. Task exiting."
+        )
+        return
+
+    node.session_switches.add(waker)
+    try:
+        while True:
+            waker.clear()
+            if node.session_version != version:
+                # Room/name switch, applied in place
+                version, new_session = node.current_session()
+                room_changed = new_session["room"] != session["room"]
+                session = new_session
+                room_tag = f"[Discovery-{session['room']}-{session['name'][:5]}]"
+                engine.reconfigure(session, room_tag)
+                listen_transport.get_protocol().room_tag = room_tag
+                if room_changed and node.app.config.get("DISCOVERY_MODE") == "multicast":
+                    # The multicast group follows the room
+                    listen_transport.close()
+                    send_transport.close()
+                    try:
+                        listen_transport, send_transport, announce_addr = (
+                            await open_discovery_endpoints(engine, session, room_tag, waker)
+                        )
+                    except OSError as e:
+                        logging.error(
+                            f"{room_tag} Could not join the new room's group: {e}. Task exiting."
+                        )
+                        return
+            if time.time() >= engine.next_heartbeat:
+                try:
+                    send_transport.sendto(engine.build_heartbeat(), announce_addr)
+                except OSError as e:
+                    logging.warning(f"{room_tag} Could not send heartbeat: {e}")
+            engine.expire()
+            # Sleep until the next heartbeat or peer expiry is due, or a switch
+            await waker.wait(engine.next_timeout())
+    finally:
+        logging.info(f"{room_tag} Task shutting down.")
+        node.session_switches.remove(waker)
+        listen_transport.close()
+        send_transport.close()
+
+
+async def publisher_task(session, version, context):
+    """Publishes capture hub frames; encoding runs in the default executor."""
+    loop = asyncio.get_running_loop()
+    zmq_pub_port = session["zmq_port"]
+    room_tag = f"[Publisher-{session['room']}-{session['peer_id'][:8]}]"
+    logging.info(f"{room_tag} Task starting.")
+
+    try:
+        standby_socket = node.warm_standby.take_pub_socket(zmq_pub_port)
+        if standby_socket is not None:
+            pub_socket = zmq_asyncio.Socket.from_socket(standby_socket)
+        else:
+            pub_socket = node.create_pub_socket(context, zmq_pub_port)
+        logging.info(f"{room_tag} ZMQ Publisher bound to tcp://*:{zmq_pub_port}")
+    except zmq.ZMQError as e:
+        logging.error(
+            f"{room_tag} Could not bind ZMQ PUB socket to port {zmq_pub_port}: {e}. Task exiting."
+        )
+        return
+
+    # Opening the camera can take a while, keep it off the loop
+    if not await loop.run_in_executor(None, node.capture_hub.acquire):
+        logging.error(f"{room_tag} Error opening webcam. Task exiting.")
+        pub_socket.close()
+        return
+
+    publisher = node.VideoPublisher(session["room"], session["peer_id"], room_tag)
+    waker = Waker(loop)
+    node.capture_hub.listeners.add(waker)
+    last_seq = 0
+    try:
+        while True:
+            waker.clear()
+            seq, frame, captured_at = node.capture_hub.wait_frame(last_seq, timeout=0)
+            if frame is None:
+                await waker.wait(FEED_WAIT_TIMEOUT)
+                continue  # No new frame yet (camera slow or stalled)
+            last_seq = seq
+
+            if node.session_version != version:
+                # Room switch: same socket and camera, new topics
+                version, new_session = node.current_session()
+                if new_session["room"] != session["room"]:
+                    session = new_session
+                    room_tag = f"[Publisher-{session['room']}-{session['peer_id'][:8]}]"
+                    publisher.switch_room(session["room"], room_tag)
+
+            # XPUB subscription messages decide which simulcast layers get encoded
+            while await pub_socket.poll(0, zmq.POLLIN):
+                publisher.on_subscription(await pub_socket.recv())
+            messages = await loop.run_in_executor(
+                None, publisher.prepare, seq, frame, captured_at
+            )
+            sent = 0
+            for message in messages:
+                try:
+                    await pub_socket.send_multipart(message, flags=zmq.DONTWAIT, copy=False)
+                    sent += 1
+                except zmq.ZMQError as e:
+                    logging.warning(f"{room_tag} Error sending frame via ZMQ PUB: {e}")
+                    await asyncio.sleep(0.5)  # Back off if error sending
+                    break
+            if messages:
+                publisher.record_results(sent, len(messages))
+
+            await asyncio.sleep(publisher.frame_done())
+    finally:
+        logging.info(f"{room_tag} Task shutting down.")
+        node.capture_hub.listeners.remove(waker)
+        publisher.close()
+        pub_socket.close()
+        await loop.run_in_executor(None, node.capture_hub.release)
+
+
+async def subscriber_task(session, version, context):
+    """Receives peers' frames and hands them to the shared message handler."""
+    room_number = session["room"]
+    room_tag = f"[Subscriber-{room_number}]"
+    logging.info(f"{room_tag} Task starting.")
+
+    sub_socket = context.socket(zmq.SUB)
+
+    connected_peer_addrs = set()  # Keep track of ZMQ connect() calls: {(ip, port), ...}
+    layer_subscriptions = {}  # { peer_id: simulcast layer name }
+    compositor = node.DeltaCompositor()
+    next_sync = 0.0
+    try:
+        while True:
+            if node.session_version != version:
+                version, new_session = node.current_session()
+                if new_session["room"] != room_number:
+                    # Room switch: leave the old room's streams, keep the socket
+                    node.drop_subscriptions(
+                        sub_socket, connected_peer_addrs, layer_subscriptions, room_number, room_tag
+                    )
+                    room_number = new_session["room"]
+                    room_tag = f"[Subscriber-{room_number}]"
+                    compositor = node.DeltaCompositor()
+                    next_sync = 0.0
+
+            now = time.monotonic()
+            if now >= next_sync:
+                node.sync_subscriptions(
+                    sub_socket, connected_peer_addrs, layer_subscriptions, room_number, room_tag
+                )
+                next_sync = now + node.SUBSCRIPTION_SYNC_INTERVAL
+            try:
+                if await sub_socket.poll(int(node.SUBSCRIPTION_SYNC_INTERVAL * 1000), zmq.POLLIN):
+                    multipart_msg = await sub_socket.recv_multipart(copy=False)
+                    node.handle_video_message(
+                        multipart_msg, room_number, compositor, room_tag
+                    )
+            except zmq.ZMQError as e:
+                logging.error(f"{room_tag} ZMQ SUB socket error: {e}")
+                await asyncio.sleep(1)  # Avoid busy-looping on persistent error
+    finally:
+        logging.info(f"{room_tag} Task shutting down.")
+        sub_socket.close()
+
+
+class AsyncRuntime:
+    """Runs the background loops as tasks on the server's event loop.
+
+    start() and stop() are called by the shared start/stop_background_threads(), which
+    run in Flask views on executor threads, so they hand the work to the loop and wait.
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self._loop_thread = threading.get_ident()  # Created during startup, on the loop
+        self.context = None  # zmq.asyncio.Context, created by the first start
+        self._tasks = []
+
+    def start(self):
+        self._run_on_loop(self._start())
+
+    def stop(self):
+        self._run_on_loop(self._stop())
+
+    def _run_on_loop(self, coro):
+        if threading.get_ident() == self._loop_thread:
+            coro.close()
+            raise RuntimeError("AsyncRuntime must be started/stopped off the event loop thread")
+        asyncio.run_coroutine_threadsafe(coro, self.loop).result(RUNTIME_CALL_TIMEOUT)
+
+    async def _start(self):
+        if self.context is None:
+            self.context = zmq_asyncio.Context()
+        version, session = node.current_session()
+        self._tasks = [
+            asyncio.create_task(discovery_task(session, version), name="DiscoveryTask"),
+            asyncio.create_task(
+                publisher_task(session, version, self.context), name="VideoPublisherTask"
+            ),
+            asyncio.create_task(
+                subscriber_task(session, version, self.context), name="VideoSubscriberTask"
+            ),
+        ]
+
+    async def _stop(self):
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        for task, result in zip(tasks, await asyncio.gather(*tasks, return_exceptions=True)):
+            if isinstance(result, Exception):
+                logging.error(f"Task {task.get_name()} failed: {result!r}")
+
+
+# --- Request Helpers ---
+
+
+def query_text(scope, name):
+    """A query parameter of the request as text (possibly empty), or None if absent."""
+    values = urllib.parse.parse_qs(
+        scope["query_string"].decode("latin-1"), keep_blank_values=True
+    ).get(name)
+    return values[0] if values else None
+
+
+def query_int(scope, name):
+    """An integer query parameter of the request, or None if absent or malformed."""
+    values = urllib.parse.parse_qs(scope["query_string"].decode("latin-1")).get(name)
+    try:
+        return int(values[0]) if values else None
+    except ValueError:
+        return None
+
+
+def query_float(scope, name):
+    """A float query parameter of the request, or None if absent or malformed."""
+    values = urllib.parse.parse_qs(scope["query_string"].decode("latin-1")).get(name)
+    try:
+        return float(values[0]) if values else None
+    except ValueError:
+        return None
+
+
+# --- Streaming Routes ---
+
+
+async def send_plain(send, status, text):
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"text/plain; charset=utf-8")],
+        }
+    )
+    await send({"type": "http.response.body", "body": text.encode("utf-8")})
+
+
+async def start_stream(send, content_type, extra_headers=()):
+    headers = [(b"content-type", content_type.encode("latin-1"))]
+    headers.extend((name.encode("latin-1"), value.encode("latin-1")) for name, value in extra_headers)
+    await send({"type": "http.response.start", "status": 200, "headers": headers})
+
+
+async def send_chunk(send, body):
+    await send({"type": "http.response.body", "body": body, "more_body": True})
+
+
+async def end_stream(send, waker):
+    if not waker.closed:
+        await send({"type": "http.response.body", "body": b""})
+
+
+def node_running():
+    return node.threads_started.is_set() and not node.shutdown_flag.is_set()
+
+
+async def events_stream(scope, receive, send):
+    """Async /events: one task per SSE client, woken by its outbox's listeners."""
+    if not node.threads_started.is_set():
+        logging.warning(
+            "SSE connection attempt refused: Threads not running (user likely not joined)."
+        )
+        await send_plain(send, 403, "Not joined.")
+        return
+
+    loop = asyncio.get_running_loop()
+    client = node.register_sse_client(
+        (scope.get("client") or ("unknown",))[0],
+        query_float(scope, "fps"),
+        node.parse_peer_list(query_text(scope, "peers")),
+    )
+    waker = Waker(loop)
+    client.listeners.add(waker)
+    watcher = asyncio.create_task(waker.watch_disconnect(receive))
+    try:
+        await start_stream(
+            send,
+            "text/event-stream",
+            [("Cache-Control", "no-cache"), ("X-Accel-Buffering", "no")],
+        )
+        while not waker.closed and node.threads_started.is_set():
+            waker.clear()
+            message = client.get(timeout=0)
+            if message is None:
+                if await waker.wait(node.SSE_KEEPALIVE_INTERVAL):
+                    continue
+                # Send a keep-alive comment to prevent connection timeouts by proxies/browsers
+                message = ": keepalive\n\n"
+            await send_chunk(send, message.encode("utf-8"))
+        await end_stream(send, waker)
+    finally:
+        watcher.cancel()
+        client.listeners.remove(waker)
+        node.unregister_sse_client(client)
+
+
+def budget_listeners(throttle):
+    """The ChangeListeners of a feed's ViewerBudget, or an unused set if it follows none."""
+    return throttle.budget.listeners if throttle.budget else node.ChangeListeners()
+
+
+async def self_feed_stream(scope, receive, send):
+    """Async /video_feed_self, sharing the capture hub and its cached encodes."""
+    await start_stream(send, "multipart/x-mixed-replace; boundary=frame")
+    loop = asyncio.get_running_loop()
+    waker = Waker(loop)
+    if not node.threads_started.is_set():
+        logging.warning("Attempted to get self video feed when not joined/running.")
+        await end_stream(send, waker)
+        return
+    if not await loop.run_in_executor(None, node.capture_hub.acquire):
+        logging.error("Cannot open webcam for self-view stream.")
+        await end_stream(send, waker)
+        return
+
+    logging.info("[SelfFeed] Starting video capture loop.")
+    pacer = node.register_pacer("self_view", node.SELF_VIEW_FPS, unique=True)
+    throttle = node.feed_throttle(query_float(scope, "fps"), query_text(scope, "viewer"))
+    budget = budget_listeners(throttle)
+    budget.add(waker)
+    node.capture_hub.listeners.add(waker)
+    watcher = asyncio.create_task(waker.watch_disconnect(receive))
+    last_seq = 0
+    paused = False
+    try:
+        while not waker.closed and node_running():
+            waker.clear()
+            if not throttle.active():
+                paused = True
+                await waker.wait(FEED_WAIT_TIMEOUT)
+                continue
+            if paused:
+                paused = False
+                pacer.reset()
+            pacer.set_target(throttle.limit(node.capture_hub.limit_fps(node.SELF_VIEW_FPS)))
+            seq, frame, captured_at = node.capture_hub.wait_frame(last_seq, timeout=0)
+            if frame is None:
+                await waker.wait(FEED_WAIT_TIMEOUT)
+                continue
+            last_seq = seq
+            frame_bytes = await loop.run_in_executor(
+                None,
+                node.capture_hub.get_jpeg,
+                seq,
+                frame,
+                node.SELF_VIEW_SIZE,
+                node.JPEG_QUALITY - 10,
+            )
+            if frame_bytes is None:
+                logging.warning("[SelfFeed] Failed to encode self-view frame.")
+                continue
+            await send_chunk(send, node.mjpeg_part(frame_bytes, captured_at))
+            await asyncio.sleep(pacer.next_delay())
+        await end_stream(send, waker)
+    finally:
+        logging.info("[SelfFeed] Stopping self-view stream.")
+        watcher.cancel()
+        budget.remove(waker)
+        node.capture_hub.listeners.remove(waker)
+        node.unregister_pacer(pacer)
+        await loop.run_in_executor(None, node.capture_hub.release)
+
+
+async def mosaic_stream(scope, receive, send):
+    """Async /video_feed_mosaic, woken by every mosaic the shared compositor thread encodes."""
+    await start_stream(
+        send, "multipart/x-mixed-replace; boundary=frame", [("Cache-Control", "no-cache")]
+    )
+    loop = asyncio.get_running_loop()
+    waker = Waker(loop)
+    if not node.threads_started.is_set():
+        logging.warning("Attempted to get mosaic feed when not joined/running.")
+        await end_stream(send, waker)
+        return
+
+    throttle = node.feed_throttle(query_float(scope, "fps"), query_text(scope, "viewer"))
+    await loop.run_in_executor(None, node.mosaic_hub.acquire)
+    attached = True
+    logging.info("[MosaicFeed] Client attached.")
+    budget = budget_listeners(throttle)
+    budget.add(waker)
+    node.mosaic_hub.listeners.add(waker)
+    watcher = asyncio.create_task(waker.watch_disconnect(receive))
+    last_seq = 0
+    try:
+        while not waker.closed and node_running():
+            waker.clear()
+            if not throttle.active():
+                if attached:
+                    # Nothing is composed for a hidden page; the last one out stops the hub
+                    await loop.run_in_executor(None, node.mosaic_hub.release)
+                    attached = False
+                await waker.wait(FEED_WAIT_TIMEOUT)
+                continue
+            if not attached:
+                await loop.run_in_executor(None, node.mosaic_hub.acquire)
+                attached = True
+            delay = throttle.delay()
+            if delay:
+                await waker.wait(delay)
+                continue
+            seq, jpeg = node.mosaic_hub.wait_mosaic(last_seq, timeout=0)
+            if jpeg is None:
+                await waker.wait(FEED_WAIT_TIMEOUT)
+                continue
+            last_seq = seq
+            await send_chunk(send, node.mjpeg_part(jpeg))
+            throttle.sent()
+        await end_stream(send, waker)
+    finally:
+        watcher.cancel()
+        budget.remove(waker)
+        node.mosaic_hub.listeners.remove(waker)
+        if attached:
+            await loop.run_in_executor(None, node.mosaic_hub.release)
+
+
+async def peer_feed_stream(scope, receive, send, peer_id):
+    """Async /video_feed/<peer_id>: woken by the peer's mailbox, sends the latest frame."""
+    refusal = node.peer_feed_refusal(peer_id)
+    if refusal:
+        error, status = refusal
+        await send_plain(send, status, error)
+        return
+
+    throttle = node.feed_throttle(query_float(scope, "fps"), query_text(scope, "viewer"))
+    viewer = node.attach_feed_viewer(peer_id, query_int(scope, "w"), throttle)
+    waker = Waker(asyncio.get_running_loop())
+    budget = budget_listeners(throttle)
+    budget.add(waker)
+    watcher = asyncio.create_task(waker.watch_disconnect(receive))
+    mailbox = None
+    logging.info(f"[PeerFeed] Viewer attached to {peer_id}.")
+    try:
+        await start_stream(
+            send, "multipart/x-mixed-replace; boundary=frame", [("Cache-Control", "no-cache")]
+        )
+        while not waker.closed and node_running():
+            current = node.peer_mailbox(peer_id)
+            if current is None:
+                break  # Peer has left (timed out or room switched)
+            if current is not mailbox:
+                # Follow the mailbox when the peer leaves and rejoins
+                if mailbox is not None:
+                    mailbox.listeners.remove(waker)
+                mailbox = current
+                mailbox.listeners.add(waker)
+                viewer.version = 0  # A new mailbox counts versions from 0
+            waker.clear()
+            if not throttle.active(peer_id):
+                # Page hidden or peer paged away; choose_layer() stops receiving it meanwhile
+                await waker.wait(FEED_WAIT_TIMEOUT)
+                continue
+            delay = throttle.delay()
+            if delay:
+                await waker.wait(delay)
+                continue
+            version, frame_data, captured_at = mailbox.wait_newer(viewer.version, timeout=0)
+            if frame_data is None:
+                await waker.wait(FEED_WAIT_TIMEOUT)
+                continue
+            if viewer.version and version > viewer.version + 1 and throttle.target_fps():
+                node.feed_frames_coalesced_total.inc(version - viewer.version - 1)
+            viewer.version = version
+            serialize_start = time.perf_counter()
+            part = node.mjpeg_part(frame_data, captured_at)
+            node.serialize_duration.observe(time.perf_counter() - serialize_start)
+            # Waits while the client's socket buffer is full; the mailbox keeps only the latest
+            await send_chunk(send, part)
+            throttle.sent()
+        await end_stream(send, waker)
+    finally:
+        watcher.cancel()
+        budget.remove(waker)
+        if mailbox is not None:
+            mailbox.listeners.remove(waker)
+        node.detach_feed_viewer(viewer)
+        logging.info(f"[PeerFeed] Stopping feed of {peer_id}.")
+
+
+async def recording_stream(scope, receive, send, recording, peer):
+    """Async /recordings/<recording>/<peer>: replays the memory-mapped recording."""
+    loop = asyncio.get_running_loop()
+    opened = await loop.run_in_executor(
+        None, node.open_recording, recording, peer, query_float(scope, "t") or 0.0
+    )
+    if opened is None:
+        await send_plain(send, 404, "Unknown recording.")
+        return
+
+    reader, position = opened
+    waker = Waker(loop)
+    watcher = asyncio.create_task(waker.watch_disconnect(receive))
+    clock = node.PlaybackClock()
+    try:
+        await start_stream(
+            send, "multipart/x-mixed-replace; boundary=frame", [("Cache-Control", "no-cache")]
+        )
+        for position in range(position, len(reader)):
+            timestamp, jpeg = reader.frame(position)
+            await waker.wait(clock.delay(timestamp))  # Woken early only by a disconnect
+            if waker.closed:
+                break
+            await send_chunk(send, node.mjpeg_part(jpeg))
+        await end_stream(send, waker)
+    finally:
+        watcher.cancel()
+        reader.close()
+
+
+# --- Flask Bridge ---
+
+
+def wsgi_environ(scope, body):
+    """Builds a WSGI environ for an ASGI HTTP scope with an already read body."""
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope["headers"]:
+        name = name.decode("latin-1")
+        if name == "content-type":
+            key = "CONTENT_TYPE"
+        elif name == "content-length":
+            key = "CONTENT_LENGTH"
+        else:
+            key = "HTTP_" + name.upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if key in environ:
+            value = f"{environ[key]},{value}"
+        environ[key] = value
+    return environ
+
+
+def run_flask(environ):
+    """Runs one request through the Flask app. Returns (status, headers, body)."""
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response["status"] = int(status.split(" ", 1)[0])
+        response["headers"] = headers
+
+    result = node.app(environ, start_response)
+    try:
+        body = b"".join(result)
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+    return response["status"], response["headers"], body
+
+
+async def flask_route(scope, receive, send):
+    """Serves the non-streaming routes (pages, join/leave, /api/stats, /metrics) with Flask.
+
+    Views may block (joining stops and starts the runtime), so they run in the executor.
+    """
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+    status, headers, content = await asyncio.get_running_loop().run_in_executor(
+        None, run_flask, wsgi_environ(scope, body)
+    )
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (name.encode("latin-1"), value.encode("latin-1")) for name, value in headers
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": content})
+
+
+# --- ASGI Application ---
+
+
+def stop_node():
+    with node.config_lock:
+        node.stop_background_threads()
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            node.runtime = AsyncRuntime(asyncio.get_running_loop())
+            node.warm_standby.start()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            # Ensure tasks are stopped cleanly on exit
+            logging.info("Ensuring background tasks are stopped before exit.")
+            await asyncio.get_running_loop().run_in_executor(None, stop_node)
+            await asyncio.get_running_loop().run_in_executor(None, node.warm_standby.stop)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def asgi_app(scope, receive, send):
+    """Routes streaming endpoints to coroutines and everything else to Flask."""
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    path = scope["path"]
+    if path == "/events":
+        await events_stream(scope, receive, send)
+    elif path == "/video_feed_self":
+        await self_feed_stream(scope, receive, send)
+    elif path == "/video_feed_mosaic":
+        await mosaic_stream(scope, receive, send)
+    elif path.startswith("/video_feed/") and "/" not in path[len("/video_feed/"):]:
+        await peer_feed_stream(scope, receive, send, path[len("/video_feed/"):])
+    elif path.startswith("/recordings/") and path.count("/") == 3:
+        _, _, recording, peer = path.split("/")
+        await recording_stream(scope, receive, send, recording, peer)
+    else:
+        await flask_route(scope, receive, send)
+
+
+# --- Main Execution ---
+if __name__ == "__main__":
+    args = node.build_arg_parser("P2P LAN Video Chat (asyncio runtime)").parse_args()
+    node.apply_args(args)
+    flask_port = args.flask_port
+
+    local_ip = node.get_local_ip()
+    logging.info("Asyncio server starting...")
+    logging.info(
+        f" ----> Access setup at: http://127.0.0.1:{flask_port} or http://{local_ip}:{flask_port} <----"
+    )
+    uvicorn.run(
+        asgi_app,
+        host="0.0.0.0",
+        port=flask_port,
+        lifespan="on",
+        log_level="warning",
+        timeout_graceful_shutdown=SHUTDOWN_GRACE,
+    )
+    logging.info("Application exiting.")
@@ -0,0 +1,591 @@
+"""Load test for one P2P video chat node: where does it break?
+
+Runs N virtual peers in this process against a real node (app.py or app_async.py),
+which must be on this host or LAN since discovery is UDP broadcast/multicast. Every
+virtual peer announces itself with real discovery heartbeats and publishes pre-encoded
+JPEG frames on its own ZMQ PUB socket with the real topic format (room|peer_id|layer)
+and frame header. M stream viewers and K SSE clients are attached to the node over HTTP.
+
+Reported per run:
+  - subscriber throughput of the node (frames/s received from the virtual peers)
+  - mailbox drop rate (frames replaced before any viewer read them)
+  - viewer frame rate and capture-to-viewer latency (X-Capture-Timestamp part header)
+  - SSE delivery latency: from sending the heartbeat of a new peer to its peer_join
+    event arriving at each SSE client (a fresh "churn" peer announces itself regularly)
+  - CPU per node component (p2p_thread_cpu_seconds from /metrics, Unix only), and
+    of the whole node per received frame
+
+--sweep repeats the run for a list of values of one parameter, moving the node to a
+fresh room for every step (the node must already be joined, or is joined by us),
+and --csv writes one row per step, i.e. the scaling curve.
+
+    python app.py --source synthetic --flask-port 5000
+    python loadtest.py --node http://127.0.0.1:5000 --peers 8 --viewers 8 --sse 20
+    python loadtest.py --spawn --sweep peers=1,2,4,8,16 --csv scaling.csv
+    python loadtest.py --spawn --node-args='--delta' --peers 8
+"""
+
+import argparse
+import csv
+import http.client
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+
+import cv2
+import zmq
+
+import app as node
+
+LOADTEST_BASE_PORT = 7100  # ZMQ PUB port of the first virtual peer
+CHURN_PORT_OFFSET = 1000  # Churn peers use ports from base + offset (no socket behind them)
+CHURN_INTERVAL = 0.5  # Seconds between churn peer announcements
+NODE_START_TIMEOUT = 15.0  # Seconds to wait for a spawned node to answer HTTP
+HTTP_TIMEOUT = 5.0
+SWEEP_PARAMETERS = ("peers", "fps", "viewers", "sse")
+
+
+def percentile(values, share):
+    """Nearest-rank percentile of values (share in 0..1), or None if there are none."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+def round_or_none(value, digits=1):
+    return None if value is None else round(value, digits)
+
+
+# --- Node Control ---
+
+
+class NodeClient:
+    """HTTP access to the node under test."""
+
+    def __init__(self, url):
+        parsed = urllib.parse.urlsplit(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 80
+
+    def connect(self, timeout=HTTP_TIMEOUT):
+        return http.client.HTTPConnection(self.host, self.port, timeout=timeout)
+
+    def request(self, method, path, body=None, headers=None):
+        """Returns (status, body bytes)."""
+        conn = self.connect()
+        try:
+            conn.request(method, path, body=body, headers=headers or {})
+            response = conn.getresponse()
+            return response.status, response.read()
+        finally:
+            conn.close()
+
+    def wait_ready(self, timeout=NODE_START_TIMEOUT):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                self.request("GET", "/metrics")
+                return True
+            except OSError:
+                time.sleep(0.2)
+        return False
+
+    def enter_room(self, room, name):
+        """Moves the node to room: a hot switch if it is joined, a join otherwise."""
+        status, _ = self.request(
+            "POST",
+            "/switch_room",
+            json.dumps({"room_id": room, "username": name}),
+            {"Content-Type": "application/json"},
+        )
+        if status == 200:
+            return
+        form = urllib.parse.urlencode({"room_id": room, "username": name})
+        status, body = self.request(
+            "POST", "/join", form, {"Content-Type": "application/x-www-form-urlencoded"}
+        )
+        if status >= 400:
+            raise RuntimeError(f"Node refused to join {room}: {status} {body[:200]!r}")
+
+    def stats(self):
+        return json.loads(self.request("GET", "/api/stats")[1])
+
+    def metrics(self):
+        """Scrapes /metrics into { (name, labels): value }."""
+        samples = {}
+        for line in self.request("GET", "/metrics")[1].decode("utf-8").splitlines():
+            if not line or line.startswith("#"):
+                continue
+            series, _, value = line.rpartition(" ")
+            name, _, labels = series.partition("{")
+            try:
+                samples[(name, labels.rstrip("}"))] = float(value)
+            except ValueError:
+                pass
+        return samples
+
+
+def metric_sum(samples, name):
+    return sum(value for (sample, _), value in samples.items() if sample == name)
+
+
+def component_cpu(samples):
+    """{ component: cpu seconds } from a /metrics scrape."""
+    cpu = {}
+    for (name, labels), value in samples.items():
+        if name == "p2p_thread_cpu_seconds":
+            cpu[labels.partition('"')[2].rstrip('"')] = value
+    return cpu
+
+
+# --- Virtual Peers ---
+
+
+class VirtualPeers:
+    """N simulated peers: discovery heartbeats plus a ZMQ PUB socket each.
+
+    Frames are encoded once up front (one second of the synthetic pattern, every simulcast
+    layer) and replayed, so the harness spends its CPU on sending, not on encoding.
+    """
+
+    def __init__(self, count, fps, room, base_port, discovery):
+        self.count = count
+        self.fps = fps
+        self.room = room
+        self.discovery = discovery
+        self.ip = node.get_local_ip()
+        self.ports = [base_port + i for i in range(count)]
+        self.peer_ids = [node.generate_peer_id(self.ip, port) for port in self.ports]
+        self._churn_port = base_port + CHURN_PORT_OFFSET
+        self.churn_sent = {}  # { peer_id: time.time() its first heartbeat was sent }
+        self.frames_sent = 0
+        self.frames_dropped = 0  # zmq.Again: the node is not keeping up
+        self._stop = threading.Event()
+        self._threads = []
+        self._context = zmq.Context.instance()
+        self._sockets = []
+        self._frames = self._encode_frames()
+
+    def _encode_frames(self):
+        """[{ layer: jpeg }] for one second of synthetic video."""
+        source = node.SyntheticSource(node.CAPTURE_SIZE, self.fps)
+        source.open(node.CAPTURE_SIZE)
+        frames = []
+        for _ in range(max(1, self.fps)):
+            _, frame = source.next_frame()
+            layers = {}
+            for name, scale in node.SIMULCAST_LAYERS:
+                size = (int(node.CAPTURE_SIZE[0] * scale), int(node.CAPTURE_SIZE[1] * scale))
+                resized = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+                _, buffer = cv2.imencode(
+                    ".jpg", resized, [int(cv2.IMWRITE_JPEG_QUALITY), node.JPEG_QUALITY]
+                )
+                layers[name] = buffer.tobytes()
+            frames.append(layers)
+        source.close()
+        return frames
+
+    def start(self):
+        for port in self.ports:
+            sock = self._context.socket(zmq.PUB)
+            sock.setsockopt(zmq.SNDHWM, node.PUB_SNDHWM)
+            sock.setsockopt(zmq.LINGER, 0)
+            sock.bind(f"tcp://*:{port}")
+            self._sockets.append(sock)
+        for target, name in (
+            (self._publish_loop, "LoadPublisher"),
+            (self._announce_loop, "LoadDiscovery"),
+        ):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout=2.0)
+        for sock in self._sockets:
+            sock.close()
+
+    def _publish_loop(self):
+        pacer = node.FramePacer("loadtest", self.fps)
+        topics = [
+            {
+                name: f"{self.room}|{peer_id}|{name}".encode("utf-8")
+                for name, _ in node.SIMULCAST_LAYERS
+            }
+            for peer_id in self.peer_ids
+        ]
+        seq = 0
+        while not self._stop.is_set():
+            layers = self._frames[seq % len(self._frames)]
+            for sock, peer_topics in zip(self._sockets, topics):
+                # Every layer is offered; PUB drops the ones the node did not subscribe to
+                header = node.FRAME_HEADER.pack(node.FRAME_KIND_FULL, seq, time.time(), 0.0)
+                for name, topic in peer_topics.items():
+                    try:
+                        sock.send_multipart(
+                            [topic, header, layers[name]], zmq.DONTWAIT, copy=False
+                        )
+                    except zmq.Again:
+                        self.frames_dropped += 1
+                self.frames_sent += 1
+            seq += 1
+            time.sleep(pacer.next_delay())
+
+    def _heartbeat(self, port, name):
+        session = {"room": self.room, "name": name, "ip": self.ip, "zmq_port": port}
+        return node.DiscoveryEngine(session, "[LoadTest]").build_heartbeat()
+
+    def _announce_loop(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if self.discovery == "multicast":
+            destination = (node.room_multicast_group(self.room), node.BROADCAST_PORT)
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(self.ip))
+            sock.setsockopt(
+                socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, node.DISCOVERY_MULTICAST_TTL
+            )
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        else:
+            destination = ("<broadcast>", node.BROADCAST_PORT)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        next_heartbeat = next_churn = 0.0
+        try:
+            while not self._stop.is_set():
+                now = time.time()
+                if now >= next_heartbeat:
+                    for i, port in enumerate(self.ports):
+                        sock.sendto(self._heartbeat(port, f"load-{i}"), destination)
+                    next_heartbeat = now + node.HEARTBEAT_INTERVAL
+                if now >= next_churn:
+                    # A new peer for SSE latency; it has no stream and times out on the node
+                    port = self._churn_port
+                    self._churn_port += 1
+                    self.churn_sent[node.generate_peer_id(self.ip, port)] = time.time()
+                    sock.sendto(self._heartbeat(port, "churn"), destination)
+                    next_churn = now + CHURN_INTERVAL
+                self._stop.wait(min(next_heartbeat, next_churn) - time.time())
+        finally:
+            sock.close()
+
+
+# --- Simulated Viewers ---
+
+
+class StreamViewer(threading.Thread):
+    """Reads /video_feed/<peer_id> like a browser <img>, timing every frame."""
+
+    def __init__(self, client, peer_id, width, stop):
+        super().__init__(name=f"Viewer-{peer_id}", daemon=True)
+        self.client = client
+        self.path = f"/video_feed/{peer_id}" + (f"?w={width}" if width else "")
+        self.stop_event = stop
+        self.frames = 0
+        self.bytes = 0
+        self.latencies = []  # Seconds from capture (virtual peer clock) to arrival
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                self._stream()
+            except OSError:
+                pass  # Node dropped the stream (peer not known yet, or gone); retry
+            self.stop_event.wait(0.2)
+
+    def _stream(self):
+        conn = self.client.connect()
+        try:
+            conn.request("GET", self.path)
+            response = conn.getresponse()
+            if response.status != 200:
+                response.read()
+                return
+            buffer = b""
+            while not self.stop_event.is_set():
+                chunk = response.read1(65536)
+                if not chunk:
+                    return
+                arrived = time.time()
+                self.bytes += len(chunk)
+                buffer += chunk
+                buffer = self._parse(buffer, arrived)
+        finally:
+            conn.close()
+
+    def _parse(self, buffer, arrived):
+        """Counts the parts whose headers are complete in buffer; returns the rest."""
+        while True:
+            start = buffer.find(b"--frame\r\n")
+            if start < 0:
+                return buffer[-16:]  # Keep what could be the start of a boundary
+            end = buffer.find(b"\r\n\r\n", start)
+            if end < 0:
+                return buffer[start:]
+            self.frames += 1
+            for line in buffer[start:end].split(b"\r\n"):
+                if line.startswith(b"X-Capture-Timestamp:"):
+                    self.latencies.append(arrived - float(line.split(b":", 1)[1]))
+            buffer = buffer[end + 4 :]
+
+
+class SSEViewer(threading.Thread):
+    """Reads /events like the page's EventSource and times peer_join events."""
+
+    def __init__(self, client, churn_sent, stop):
+        super().__init__(name="SSEViewer", daemon=True)
+        self.client = client
+        self.churn_sent = churn_sent
+        self.stop_event = stop
+        self.events = 0
+        self.latencies = []  # Seconds from a churn peer's heartbeat to its peer_join here
+        self._seen = set()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                self._stream()
+            except OSError:
+                pass
+            self.stop_event.wait(0.2)
+
+    def _stream(self):
+        conn = self.client.connect(timeout=max(HTTP_TIMEOUT, node.SSE_KEEPALIVE_INTERVAL + 5))
+        try:
+            conn.request("GET", "/events")
+            response = conn.getresponse()
+            event = None
+            while not self.stop_event.is_set():
+                line = response.readline()
+                if not line:
+                    return
+                line = line.rstrip(b"\r\n")
+                if line.startswith(b"event:"):
+                    event = line[6:].strip()
+                elif line.startswith(b"data:") and event is not None:
+                    self.events += 1
+                    if event == b"peer_join":
+                        self._on_join(json.loads(line[5:]), time.time())
+                    event = None
+        finally:
+            conn.close()
+
+    def _on_join(self, data, arrived):
+        peer_id = data.get("peer_id")
+        sent = self.churn_sent.get(peer_id)
+        # Only joins that happened while connected (not the initial peer list)
+        if sent is not None and peer_id not in self._seen and arrived - sent < node.PEER_TIMEOUT:
+            self._seen.add(peer_id)
+            self.latencies.append(arrived - sent)
+
+
+# --- Runs ---
+
+
+def run_step(client, params, args, step):
+    """Runs one load level and returns its result row."""
+    room = f"{args.room}-{step}"
+    client.enter_room(room, "loadtest-node")
+    peers = VirtualPeers(params["peers"], params["fps"], room, args.base_port, args.discovery)
+    peers.start()
+    stop = threading.Event()
+    viewers = [
+        StreamViewer(client, peers.peer_ids[i % len(peers.peer_ids)], args.viewer_width, stop)
+        for i in range(params["viewers"] if peers.peer_ids else 0)
+    ]
+    sse_viewers = [SSEViewer(client, peers.churn_sent, stop) for _ in range(params["sse"])]
+    for thread in viewers + sse_viewers:
+        thread.start()
+
+    # Discovery, subscriptions and viewers settle before the measurement window
+    time.sleep(args.warmup)
+    for thread in viewers:
+        thread.frames, thread.latencies = 0, []
+    for thread in sse_viewers:
+        thread.latencies = []
+    before, started = client.metrics(), time.monotonic()
+    time.sleep(args.duration)
+    after, elapsed = client.metrics(), time.monotonic() - started
+    peer_stats = client.stats().get("peers", {})
+
+    stop.set()
+    for thread in viewers + sse_viewers:
+        thread.join(timeout=HTTP_TIMEOUT)
+    peers.stop()
+
+    received = metric_sum(after, "p2p_peer_frames_received_total") - metric_sum(
+        before, "p2p_peer_frames_received_total"
+    )
+    dropped = metric_sum(after, "p2p_peer_frames_dropped_total") - metric_sum(
+        before, "p2p_peer_frames_dropped_total"
+    )
+    viewer_latencies = [ms * 1000 for v in viewers for ms in v.latencies]
+    sse_latencies = [ms * 1000 for v in sse_viewers for ms in v.latencies]
+    losses = [s["loss_rate"] for peer_id, s in peer_stats.items() if peer_id in peers.peer_ids]
+    row = dict(params)
+    row.update(
+        {
+            "node_recv_fps": round(received / elapsed, 1),
+            "mailbox_drop_rate": round(dropped / received, 3) if received else None,
+            "stream_loss_rate": round(sum(losses) / len(losses), 3) if losses else None,
+            "viewer_fps": round(sum(v.frames for v in viewers) / elapsed / len(viewers), 1)
+            if viewers
+            else None,
+            "viewer_latency_p50_ms": round_or_none(percentile(viewer_latencies, 0.5)),
+            "viewer_latency_p95_ms": round_or_none(percentile(viewer_latencies, 0.95)),
+            "sse_latency_p50_ms": round_or_none(percentile(sse_latencies, 0.5)),
+            "sse_latency_p95_ms": round_or_none(percentile(sse_latencies, 0.95)),
+            "sse_latency_p99_ms": round_or_none(percentile(sse_latencies, 0.99)),
+            "harness_send_drops": peers.frames_dropped,
+        }
+    )
+    cpu_before = component_cpu(before)
+    cpu_total = 0.0
+    for component, used in sorted(component_cpu(after).items()):
+        used -= cpu_before.get(component, 0.0)
+        cpu_total += used
+        # Percent of one core over the window
+        row[f"cpu_{component}_pct"] = round(100 * used / elapsed, 1)
+    # Whole-node CPU per received frame, for comparing changes to the frame path
+    row["cpu_us_per_frame"] = round(1e6 * cpu_total / received, 1) if received else None
+    return row
+
+
+def parse_sweep(spec):
+    name, _, values = spec.partition("=")
+    if name not in SWEEP_PARAMETERS or not values:
+        raise argparse.ArgumentTypeError(
+            f"expected PARAM=V1,V2,... with PARAM one of {', '.join(SWEEP_PARAMETERS)}"
+        )
+    try:
+        return name, [int(value) for value in values.split(",")]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"sweep values must be integers: {values}")
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Load test for one P2P video chat node")
+    parser.add_argument(
+        "--node",
+        default=f"http://127.0.0.1:{node.DEFAULT_FLASK_PORT}",
+        help="Web address of the node under test",
+    )
+    parser.add_argument(
+        "--spawn",
+        nargs="?",
+        const="app.py",
+        metavar="SCRIPT",
+        help="Start the node ourselves (app.py, or app_async.py) with a synthetic source "
+        "on the --node port, and stop it afterwards",
+    )
+    parser.add_argument(
+        "--node-args",
+        default="",
+        metavar="ARGS",
+        help="Extra command line for a spawned node. It starts with a dash, so pass it "
+        "with =, e.g. --node-args=--delta",
+    )
+    parser.add_argument("--peers", type=int, default=4, help="Virtual peers (default: 4)")
+    parser.add_argument(
+        "--fps",
+        type=int,
+        default=node.PUBLISH_FPS,
+        help=f"Frames per second per virtual peer (default: {node.PUBLISH_FPS})",
+    )
+    parser.add_argument(
+        "--viewers", type=int, default=4, help="Stream viewers, spread over the peers (default: 4)"
+    )
+    parser.add_argument(
+        "--viewer-width",
+        type=int,
+        default=None,
+        help="?w= of the stream viewers (default: full layer)",
+    )
+    parser.add_argument("--sse", type=int, default=4, help="SSE clients (default: 4)")
+    parser.add_argument(
+        "--duration", type=float, default=10.0, help="Seconds measured per step (default: 10)"
+    )
+    parser.add_argument(
+        "--warmup", type=float, default=3.0, help="Seconds before measuring each step (default: 3)"
+    )
+    parser.add_argument(
+        "--sweep",
+        type=parse_sweep,
+        metavar="PARAM=V1,V2,...",
+        help=f"Repeat for each value of one of: {', '.join(SWEEP_PARAMETERS)}",
+    )
+    parser.add_argument("--csv", help="Write one row per step to this file")
+    parser.add_argument("--room", default="loadtest", help="Room name prefix (default: loadtest)")
+    parser.add_argument(
+        "--base-port",
+        type=int,
+        default=LOADTEST_BASE_PORT,
+        help=f"ZMQ port of the first virtual peer (default: {LOADTEST_BASE_PORT})",
+    )
+    parser.add_argument(
+        "--discovery",
+        choices=("broadcast", "multicast"),
+        default="broadcast",
+        help="Discovery mode of the node (default: broadcast)",
+    )
+    return parser
+
+
+def spawn_node(script, client, args):
+    command = [
+        sys.executable,
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), script),
+        "--flask-port",
+        str(client.port),
+        "--source",
+        f"synthetic:@{args.fps}",
+        "--discovery",
+        args.discovery,
+    ] + args.node_args.split()
+    logging.info(f"[LoadTest] Starting node: {' '.join(command)}")
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    if not client.wait_ready():
+        process.kill()
+        raise RuntimeError("Spawned node did not come up")
+    return process
+
+
+def main():
+    args = build_arg_parser().parse_args()
+    client = NodeClient(args.node)
+    process = spawn_node(args.spawn, client, args) if args.spawn else None
+
+    base = {name: getattr(args, name) for name in SWEEP_PARAMETERS}
+    name, values = args.sweep or (None, [None])
+    rows = []
+    try:
+        for step, value in enumerate(values):
+            params = dict(base)
+            if name:
+                params[name] = value
+            logging.info(f"[LoadTest] Step {step}: {params}")
+            row = run_step(client, params, args, step)
+            logging.info(f"[LoadTest] {json.dumps(row)}")
+            rows.append(row)
+    finally:
+        if process:
+            process.terminate()
+            process.wait(timeout=10)
+
+    if args.csv and rows:
+        fields = list(dict.fromkeys(key for row in rows for key in row))
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(rows)
+        logging.info(f"[LoadTest] Wrote {len(rows)} rows to {args.csv}")
+
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,15 @@ const CURRENT_NAME_ID = 'current-name';
 const NEW_ROOM_INPUT_ID = 'new_room_id';
 const NEW_NAME_INPUT_ID = 'new_username';
 const UPDATE_BUTTON_ID = 'update-settings-btn';
+const STREAM_WIDTH_TOLERANCE = 0.25; // Re-request a peer feed when its tile width changes by more than this share
+const RESIZE_DEBOUNCE_MS = 500;
+const PEERS_PER_PAGE = 8; // Only the current page's peers are streamed (and received by the node)
+const PEER_PAGER_ID = 'peer-pager';
+const PAGE_INFO_ID = 'page-info';
+const PREV_PAGE_BUTTON_ID = 'prev-page-btn';
+const NEXT_PAGE_BUTTON_ID = 'next-page-btn';
+const VIEWER_FPS = null; // Frame-rate cap for this page's feeds while visible (null: as sent)
+const HIDDEN_FPS = 0; // Frame rate while the tab is hidden (0 pauses every feed)
 
 // --- DOM Elements ---
 const statusElement = document.getElementById(STATUS_ELEMENT_ID);
@@ -20,11 +29,19 @@ const currentNameElement = document.getElementById(CURRENT_NAME_ID);
 const newRoomInput = document.getElementById(NEW_ROOM_INPUT_ID);
 const newNameInput = document.getElementById(NEW_NAME_INPUT_ID);
 const updateButton = document.getElementById(UPDATE_BUTTON_ID);
+const peerPager = document.getElementById(PEER_PAGER_ID);
+const pageInfoElement = document.getElementById(PAGE_INFO_ID);
+const prevPageButton = document.getElementById(PREV_PAGE_BUTTON_ID);
+const nextPageButton = document.getElementById(NEXT_PAGE_BUTTON_ID);
 
 
 // --- State ---
 let eventSource = null;
 const peerVideoElements = {}; // Keep track of peer video elements { peerId: imgElement }
+let currentPage = 0; // Index of the page of peer tiles being shown
+let viewerId = null; // This page's id on the server, from the 'viewer' SSE event
+let sentViewerBudget = null; // Last budget sent to the server, as JSON
+let viewerBudgetUpdates = Promise.resolve(); // Chain that keeps budget POSTs in order
 
 // --- Functions ---
 
@@ -39,6 +56,149 @@ function updateStatus(message) {
     console.log("Status:", message);
 }
 
+/**
+ * Stops a peer's video stream by detaching the image source, closing its HTTP connection.
+ * @param {HTMLImageElement} imgElement - The image element showing the peer feed.
+ */
+function stopPeerVideoStream(imgElement) {
+    imgElement.removeAttribute('src');
+    delete imgElement.dataset.streamWidth;
+}
+
+/**
+ * Points a peer's image at its feed, telling the server how wide the tile is shown so it
+ * receives the smallest simulcast layer that still looks sharp. Keeps the current stream
+ * unless the width changed noticeably, since every change reconnects the feed.
+ * @param {string} peerId - The unique identifier for the peer.
+ * @param {HTMLImageElement} imgElement - The image element showing the peer feed.
+ */
+function setPeerStreamSource(peerId, imgElement) {
+    const width = Math.round(imgElement.clientWidth * (window.devicePixelRatio || 1));
+    const current = Number(imgElement.dataset.streamWidth || 0);
+    if (current && Math.abs(width - current) <= current * STREAM_WIDTH_TOLERANCE) {
+        return;
+    }
+    imgElement.dataset.streamWidth = width;
+    const viewer = viewerId ? `&viewer=${viewerId}` : '';
+    // Binary multipart stream, decoded natively by the browser (no base64/data URLs)
+    imgElement.src = `/video_feed/${encodeURIComponent(peerId)}?w=${width}${viewer}`;
+}
+
+/**
+ * The frame rate and peers this page wants streamed right now: the current page of
+ * peer tiles, and nothing at all while the tab is hidden.
+ * @returns {object} Body for POST /api/viewer/<viewer_id>.
+ */
+function currentViewerBudget() {
+    const shown = videoGrid.querySelectorAll('.video-container:not(.self-video):not([hidden])');
+    return {
+        fps: document.hidden ? HIDDEN_FPS : VIEWER_FPS,
+        peers: Array.from(shown, container => container.dataset.peerId),
+    };
+}
+
+/**
+ * Tells the server what this page currently shows, if that changed since the last call.
+ * Every feed opened with ?viewer= follows it, so hidden or off-page feeds send nothing.
+ * Updates are queued one after another, so an older budget can never arrive last.
+ * @returns {Promise} Settles once this update has been sent (or found unnecessary).
+ */
+function updateViewerBudget() {
+    viewerBudgetUpdates = viewerBudgetUpdates.then(sendViewerBudget);
+    return viewerBudgetUpdates;
+}
+
+/**
+ * Sends the current budget, read when its turn in the queue comes. Never rejects.
+ */
+async function sendViewerBudget() {
+    if (!viewerId) {
+        return;
+    }
+    const budget = JSON.stringify(currentViewerBudget());
+    if (budget === sentViewerBudget) {
+        return;
+    }
+    sentViewerBudget = budget;
+    try {
+        const response = await fetch(`/api/viewer/${viewerId}`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: budget,
+        });
+        if (!response.ok) {
+            throw new Error(`${response.status} ${await response.text()}`);
+        }
+    } catch (error) {
+        console.error("Failed to update viewer budget:", error);
+        sentViewerBudget = null; // Retried on the next change
+    }
+}
+
+/**
+ * Adopts the viewer id the server assigned to this page and reopens every feed with
+ * it, so they follow the page's budget.
+ * @param {string} id - viewer_id from the 'viewer' SSE event.
+ */
+function setViewerId(id) {
+    viewerId = id;
+    sentViewerBudget = null;
+    const selfImg = document.getElementById(SELF_VIDEO_ID);
+    if (selfImg) {
+        selfImg.src = `/video_feed_self?viewer=${viewerId}`;
+    }
+    for (const peerId in peerVideoElements) {
+        stopPeerVideoStream(peerVideoElements[peerId]);
+    }
+    renderPeerPage();
+}
+
+/**
+ * Shows the current page of peer tiles and streams only those. Closing the feeds of
+ * off-page peers tells the node nobody watches them, so it stops receiving them. Also
+ * re-checks tile sizes, so call it whenever the grid may have reflowed.
+ */
+function renderPeerPage() {
+    const containers = Array.from(videoGrid.querySelectorAll('.video-container:not(.self-video)'));
+    const pageCount = Math.max(1, Math.ceil(containers.length / PEERS_PER_PAGE));
+    currentPage = Math.min(currentPage, pageCount - 1);
+    const first = currentPage * PEERS_PER_PAGE;
+    containers.forEach((container, index) => {
+        container.hidden = index < first || index >= first + PEERS_PER_PAGE;
+    });
+    // Separate pass so every tile is measured in the final layout
+    containers.forEach(container => {
+        const img = peerVideoElements[container.dataset.peerId];
+        if (!img) {
+            return;
+        }
+        if (container.hidden) {
+            stopPeerVideoStream(img);
+        } else {
+            setPeerStreamSource(container.dataset.peerId, img);
+        }
+    });
+
+    if (peerPager) {
+        peerPager.hidden = pageCount <= 1;
+        pageInfoElement.textContent = `Peers page ${currentPage + 1} / ${pageCount}`;
+        prevPageButton.disabled = currentPage === 0;
+        nextPageButton.disabled = currentPage >= pageCount - 1;
+    }
+    updateViewerBudget();
+}
+
+/**
+ * Moves to another page of peer tiles.
+ * @param {number} delta - Pages to move by (-1 or 1).
+ */
+function changePeerPage(delta) {
+    currentPage = Math.max(0, currentPage + delta);
+    renderPeerPage();
+}
+
 /**
  * Clears all peer video containers from the grid.
  */
@@ -46,6 +206,7 @@ function clearPeerVideoGrid() {
     console.log("Clearing peer video grid.");
     // Remove elements from tracking object
     for (const peerId in peerVideoElements) {
+        stopPeerVideoStream(peerVideoElements[peerId]);
         const container = document.getElementById(`video-container-${peerId}`);
         if (container) {
             container.remove();
@@ -55,6 +216,8 @@ function clearPeerVideoGrid() {
     // Double-check DOM (though above should be sufficient)
     const peerContainers = videoGrid.querySelectorAll('.video-container:not(.self-video)');
     peerContainers.forEach(container => container.remove());
+    currentPage = 0;
+    renderPeerPage();
 }
 
 /**
@@ -68,6 +231,7 @@ function ensurePeerVideoContainer(peerId, peerName) {
         const container = document.createElement('div');
         container.classList.add('video-container');
         container.id = `video-container-${peerId}`;
+        container.dataset.peerId = peerId;
         const title = document.createElement('h2');
         title.textContent = peerName;
         container.appendChild(title);
@@ -75,8 +239,13 @@ function ensurePeerVideoContainer(peerId, peerName) {
         img.id = `video-${peerId}`;
         img.alt = `Video feed from ${peerName}`;
         container.appendChild(img);
+        const stats = document.createElement('p');
+        stats.classList.add('peer-stats');
+        container.appendChild(stats);
         videoGrid.appendChild(container);
         peerVideoElements[peerId] = img;
+        // Streams it if it lands on the current page; it may also have shrunk the others
+        renderPeerPage();
     }
     const titleElement = document.querySelector(`#video-container-${peerId} h2`);
     if (titleElement && titleElement.textContent !== peerName) {
@@ -91,26 +260,29 @@ function ensurePeerVideoContainer(peerId, peerName) {
 function removePeerVideoContainer(peerId) {
     if (peerVideoElements[peerId]) {
         console.log(`Removing video container for peer: ${peerId}`);
+        stopPeerVideoStream(peerVideoElements[peerId]);
         const container = document.getElementById(`video-container-${peerId}`);
         if (container) {
             container.remove();
         }
         delete peerVideoElements[peerId];
+        renderPeerPage();
     }
 }
 
 /**
- * Updates the video frame for a specific peer.
- * @param {string} peerId - The unique identifier for the peer.
- * @param {string} frameData - Base64 encoded JPEG frame data.
+ * Shows the latest stream statistics under a peer's video.
+ * @param {object} data - peer_stats event payload (latency_ms, jitter_ms, loss_rate, ...).
  */
-function updatePeerVideoFrame(peerId, frameData) {
-    const imgElement = peerVideoElements[peerId];
-    if (imgElement) {
-        imgElement.src = `data:image/jpeg;base64,${frameData}`;
-    } else {
-        // console.warn(`Received frame for unknown peer ID: ${peerId}. Container might not be ready yet.`);
+function updatePeerStats(data) {
+    const container = document.getElementById(`video-container-${data.peer_id}`);
+    const statsElement = container && container.querySelector('.peer-stats');
+    if (!statsElement) {
+        return;
     }
+    const latency = data.latency_ms === null ? '?' : data.latency_ms.toFixed(0);
+    const loss = (data.loss_rate * 100).toFixed(1);
+    statsElement.textContent = `${latency} ms · jitter ${data.jitter_ms.toFixed(0)} ms · loss ${loss}%`;
 }
 
 /**
@@ -123,7 +295,9 @@ function connectEventSource() {
     }
 
     updateStatus("Connecting to event stream...");
-    eventSource = new EventSource('/events'); // Flask endpoint for SSE
+    const fps = document.hidden ? HIDDEN_FPS : VIEWER_FPS;
+    // Flask endpoint for SSE; the page's peer list follows once tiles exist
+    eventSource = new EventSource(fps === null ? '/events' : `/events?fps=${fps}`);
 
     eventSource.onopen = function() {
         updateStatus("Connected. Waiting for peers...");
@@ -137,6 +311,12 @@ function connectEventSource() {
         // Consider informing user they might need to manually rejoin or refresh if errors persist
     };
 
+    eventSource.addEventListener('viewer', function(event) {
+        try {
+            setViewerId(JSON.parse(event.data).viewer_id);
+        } catch (e) { console.error("Failed to parse viewer event:", e, event.data); }
+    });
+
     eventSource.addEventListener('peer_join', function(event) {
         try {
             const data = JSON.parse(event.data);
@@ -155,11 +335,16 @@ function connectEventSource() {
         } catch (e) { console.error("Failed to parse peer_leave event:", e, event.data); }
     });
 
-    eventSource.addEventListener('video_update', function(event) {
+    eventSource.addEventListener('peer_stats', function(event) {
         try {
-            const data = JSON.parse(event.data);
-            updatePeerVideoFrame(data.peer_id, data.frame);
-        } catch (e) { /* Ignore if parsing fails - might happen during transitions */ }
+            updatePeerStats(JSON.parse(event.data));
+        } catch (e) { console.error("Failed to parse peer_stats event:", e, event.data); }
+    });
+
+    // Server dropped our backlog (we fell too far behind); the current peer list follows
+    eventSource.addEventListener('reset', function() {
+        console.log("Event stream reset by server.");
+        clearPeerVideoGrid();
     });
 
     eventSource.onmessage = function(event) {
@@ -216,8 +401,8 @@ async function handleUpdateSettingsClick() {
             if (selfVideoTitleElement) selfVideoTitleElement.textContent = `Me (${finalName})`;
             document.title = `P2P Video Chat - Room ${finalRoom}`; // Update page title
 
-            // Clear old peers from the grid
-            clearPeerVideoGrid();
+            // Old peers were already cleared by the server's 'reset' event, which it sends
+            // ahead of the new room's peer_join events
 
             // Clear input fields
             newRoomInput.value = '';
@@ -255,6 +440,18 @@ document.addEventListener('DOMContentLoaded', () => {
         console.error("Update settings button not found!");
     }
     connectEventSource(); // Initial connection
+
+    let resizeTimer = null;
+    window.addEventListener('resize', () => {
+        clearTimeout(resizeTimer);
+        resizeTimer = setTimeout(renderPeerPage, RESIZE_DEBOUNCE_MS);
+    });
+    if (peerPager) {
+        prevPageButton.addEventListener('click', () => changePeerPage(-1));
+        nextPageButton.addEventListener('click', () => changePeerPage(1));
+    }
+    // Pauses every feed while the tab is in the background, resumes them when it is back
+    document.addEventListener('visibilitychange', updateViewerBudget);
 });
 
 // Optional: Clean up SSE connection on page unload
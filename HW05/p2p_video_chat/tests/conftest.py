@@ -0,0 +1,53 @@
+import os
+import sys
+import types
+
+import pytest
+
+# The node is a script, not a package: make app importable from here
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+
+
+class FakeClock:
+    """Stands in for the time module inside app, so pacing runs without sleeping."""
+
+    def __init__(self, start=1000.0):
+        self.now = start
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    module = types.SimpleNamespace(
+        monotonic=fake.monotonic,
+        time=fake.time,
+        sleep=fake.sleep,
+        perf_counter=app.time.perf_counter,
+        strftime=app.time.strftime,
+        localtime=app.time.localtime,
+    )
+    monkeypatch.setattr(app, "time", module)
+    return fake
+
+
+@pytest.fixture
+def registry():
+    """The shared peer table, emptied before and after the test."""
+    app.peer_registry.clear()
+    app.subscriber_loss.take_worst()
+    yield app.peer_registry
+    app.peer_registry.clear()
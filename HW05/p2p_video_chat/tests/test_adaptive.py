@@ -0,0 +1,111 @@
+from app import (
+    ANNOUNCE_HEADER,
+    ANNOUNCE_MAGIC,
+    RECEIVER_REPORT,
+    AdaptivePublishController,
+    DiscoveryEngine,
+    SubscriberLossReports,
+    generate_peer_id,
+    subscriber_loss,
+)
+
+ALICE = ("10.0.0.1", 6000)
+BOB = ("10.0.0.2", 6001)
+
+
+def engine(addr, name):
+    session = {"room": "lobby", "name": name, "ip": addr[0], "zmq_port": addr[1]}
+    return DiscoveryEngine(session, "[Test]")
+
+
+def run_window(controller, clock, encode=0.001, lost=None):
+    """Feeds one window of frames at the target fps and closes it. Returns update()."""
+    frames = int(controller.window * controller.fps)
+    for _ in range(frames):
+        controller.record_encode(encode)
+        controller.record_sent()
+    if lost is not None:
+        controller.record_receiver_loss(lost)
+    clock.advance(controller.window)
+    return controller.update()
+
+
+def test_reported_loss_degrades_quality_first(clock):
+    controller = AdaptivePublishController(min_quality=30, max_quality=70)
+    assert run_window(controller, clock, lost=0.2)
+    assert (controller.quality, controller.scale_index, controller.fps) == (60, 0, 25)
+
+
+def test_loss_below_limit_is_not_congestion(clock):
+    controller = AdaptivePublishController()
+    assert not run_window(controller, clock, lost=0.01)
+
+
+def test_slow_encode_lowers_resolution(clock):
+    controller = AdaptivePublishController()
+    assert run_window(controller, clock, encode=0.05)
+    assert controller.scale_index == 1
+
+
+def test_upgrades_only_after_healthy_windows_without_loss(clock):
+    controller = AdaptivePublishController(min_quality=30, max_quality=70)
+    assert run_window(controller, clock, lost=0.2)
+    # No new report: the last one still showed loss, so nothing is restored
+    for _ in range(AdaptivePublishController.HEALTHY_WINDOWS_TO_UPGRADE + 1):
+        assert not run_window(controller, clock)
+    controller.record_receiver_loss(0.0)
+    for _ in range(AdaptivePublishController.HEALTHY_WINDOWS_TO_UPGRADE - 1):
+        assert not run_window(controller, clock)
+    assert run_window(controller, clock)
+    assert controller.quality == 65
+
+
+def test_subscriber_loss_reports_worst_since_last_take():
+    reports = SubscriberLossReports()
+    assert reports.take_worst() is None
+    reports.add("a", 0.1)
+    reports.add("b", 0.4)
+    reports.add("a", 0.2)
+    assert reports.take_worst() == 0.4
+    assert reports.take_worst() is None
+    assert reports.snapshot() == {"a": 0.2, "b": 0.4}
+
+
+def test_receiver_report_for_our_stream(registry):
+    # Bob receives Alice's stream and loses one frame in four
+    registry.update({generate_peer_id(*ALICE): ("Alice", ALICE, 0.0)})
+    stats = registry.get(generate_peer_id(*ALICE)).stats
+    for seq in (1, 2, 4, 5, 6, 8):
+        stats.record_frame(seq, 0.0, 0.0, 0.0)
+    heartbeat = engine(BOB, "Bob").build_heartbeat()
+    registry.clear()
+
+    assert engine(ALICE, "Alice").parse(heartbeat, BOB[0])[4] == round(0.25 * 255) / 255
+    carol = engine(("10.0.0.3", 6000), "Carol")
+    assert carol.parse(heartbeat, BOB[0])[4] is None
+
+
+def test_truncated_receiver_reports_are_ignored(registry):
+    heartbeat = engine(BOB, "Bob").build_heartbeat()[:-1]  # Drop the zero report count
+    other = RECEIVER_REPORT.pack(bytes([10, 0, 0, 9]), 6000, 10)
+    own = RECEIVER_REPORT.pack(bytes([10, 0, 0, 1]), 6000, 51)
+    alice = engine(ALICE, "Alice")
+
+    assert alice.parse(heartbeat + bytes([2]) + other + own, BOB[0])[4] == 51 / 255
+    parsed = alice.parse(heartbeat + bytes([2]) + other + own[:-1], BOB[0])
+    assert parsed[:3] == (generate_peer_id(*BOB), "Bob", BOB[1])
+    assert parsed[4] is None
+
+
+def test_version_1_heartbeat_has_no_reports(registry):
+    header = ANNOUNCE_HEADER.pack(ANNOUNCE_MAGIC, 1, BOB[1], 5.0, 5)
+    own = RECEIVER_REPORT.pack(bytes([10, 0, 0, 1]), 6000, 51)
+    parsed = engine(ALICE, "Alice").parse(header + b"lobby\x03Bob" + b"\x01" + own, BOB[0])
+    assert parsed == (generate_peer_id(*BOB), "Bob", BOB[1], 5.0, None)
+
+
+def test_batch_hands_reported_loss_to_the_publisher(registry):
+    header = ANNOUNCE_HEADER.pack(ANNOUNCE_MAGIC, 2, BOB[1], 5.0, 5) + b"lobby\x03Bob"
+    own = RECEIVER_REPORT.pack(bytes([10, 0, 0, 1]), 6000, 102)
+    engine(ALICE, "Alice").handle_batch([(header + b"\x01" + own, BOB[0], 6.0)])
+    assert subscriber_loss.take_worst() == 102 / 255
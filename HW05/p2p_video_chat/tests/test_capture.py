@@ -0,0 +1,78 @@
+import queue
+import threading
+import time
+
+import numpy as np
+
+from app import CaptureHub, FrameSource
+
+SIZE = (64, 48)
+KEY = (SIZE[0], SIZE[1], 70)
+
+
+class ScriptedSource(FrameSource):
+    """Hands out the frames a test puts in, with the encodings a capture worker would."""
+
+    def __init__(self):
+        self.frames = queue.Queue()
+        self.may_open = threading.Event()
+        self.opening = threading.Event()
+        self.may_open.set()
+
+    def open(self, size):
+        self.opening.set()
+        return self.may_open.wait(5.0)
+
+    def read_encoded(self):
+        try:
+            jpeg = self.frames.get(timeout=0.05)
+        except queue.Empty:
+            return False, None, None, {}
+        return True, np.zeros((SIZE[1], SIZE[0], 3), dtype=np.uint8), time.time(), {KEY: jpeg}
+
+    def read(self):
+        raise AssertionError("The hub reads through read_encoded()")
+
+
+def next_frame(hub, source, last_seq, jpeg):
+    source.frames.put(jpeg)
+    seq, frame, _ = hub.wait_frame(last_seq, timeout=5.0)
+    assert frame is not None
+    return seq, frame
+
+
+def test_slow_open_does_not_block_frame_waiters():
+    source = ScriptedSource()
+    source.may_open.clear()
+    hub = CaptureHub(source, SIZE)
+    result = []
+    opener = threading.Thread(target=lambda: result.append(hub.acquire()))
+    opener.start()
+    try:
+        assert source.opening.wait(5.0)
+        started = time.monotonic()
+        assert hub.wait_frame(0, timeout=0.05) == (0, None, None)
+        assert time.monotonic() - started < 1.0
+    finally:
+        source.may_open.set()
+        opener.join(5.0)
+    assert result == [True]
+    hub.release()
+
+
+def test_source_encodings_stay_with_their_frame():
+    source = ScriptedSource()
+    hub = CaptureHub(source, SIZE)
+    assert hub.acquire()
+    try:
+        seq1, frame1 = next_frame(hub, source, 0, b"worker-1")
+        assert hub.get_jpeg(seq1, frame1, SIZE, 70) == b"worker-1"
+        seq2, _ = next_frame(hub, source, seq1, b"worker-2")
+
+        # A consumer one frame behind gets its own encode of the older frame...
+        stale = hub.get_jpeg(seq1, frame1, SIZE, 70)
+        assert bytes(stale[:2]) == b"\xff\xd8"
+        # ...and leaves the newer frame's encodings in place
+        assert hub.get_jpeg(seq2, None, SIZE, 70) == b"worker-2"
+    finally:
+        hub.release()
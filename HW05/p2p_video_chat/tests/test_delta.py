@@ -0,0 +1,93 @@
+import cv2
+import numpy as np
+
+from app import (
+    DeltaCompositor,
+    DeltaFrameEncoder,
+    encode_patches,
+    pack_patch_meta,
+    unpack_patch_meta,
+)
+
+SIZE = (640, 480)
+
+
+def blank():
+    return np.zeros((SIZE[1], SIZE[0], 3), dtype=np.uint8)
+
+
+def committed_encoder(frame, now=0.0):
+    encoder = DeltaFrameEncoder()
+    assert encoder.plan(frame, SIZE, now) == ("full", None)
+    encoder.commit()
+    return encoder
+
+
+def test_unchanged_frame_is_skipped():
+    encoder = committed_encoder(blank())
+    assert encoder.plan(blank(), SIZE, 0.1) == ("skip", None)
+
+
+def test_changed_tiles_become_one_rectangle_per_run():
+    encoder = committed_encoder(blank())
+    frame = blank()
+    frame[80:160, 160:320] = 255  # Two neighbouring tiles of the second tile row
+    frame[400:480, 0:80] = 255
+    kind, rects = encoder.plan(frame, SIZE, 0.1)
+    assert kind == "patch"
+    assert rects == [(160, 80, 160, 80), (0, 400, 80, 80)]
+    assert encoder.patch_rects(frame.shape, (320, 240)) == [(80, 40, 80, 40), (0, 200, 40, 40)]
+
+
+def test_committed_patch_moves_reference_only_for_sent_tiles():
+    encoder = committed_encoder(blank())
+    frame = blank()
+    frame[0:80, 0:80] = 255
+    assert encoder.plan(frame, SIZE, 0.1)[0] == "patch"
+    encoder.commit()
+    assert encoder.plan(frame, SIZE, 0.2) == ("skip", None)
+
+
+def test_uncommitted_patch_is_planned_again():
+    encoder = committed_encoder(blank())
+    frame = blank()
+    frame[0:80, 0:80] = 255
+    first = encoder.plan(frame, SIZE, 0.1)
+    assert encoder.plan(frame, SIZE, 0.2) == first
+
+
+def test_mostly_changed_frame_is_sent_full():
+    encoder = committed_encoder(blank())
+    frame = blank()
+    frame[:, :400] = 255
+    assert encoder.plan(frame, SIZE, 0.1) == ("full", None)
+
+
+def test_full_frame_on_refresh_size_change_and_reset():
+    encoder = committed_encoder(blank())
+    assert encoder.plan(blank(), SIZE, encoder.refresh_interval) == ("full", None)
+    encoder = committed_encoder(blank())
+    assert encoder.plan(blank(), (320, 240), 0.1) == ("full", None)
+    encoder.reset()
+    assert encoder.plan(blank(), SIZE, 0.1) == ("full", None)
+
+
+def test_patch_meta_round_trip():
+    rects = [(0, 0, 80, 80), (160, 80, 160, 80)]
+    assert unpack_patch_meta(pack_patch_meta(SIZE, rects)) == (SIZE, rects)
+
+
+def test_compositor_applies_patches_onto_last_full_frame():
+    compositor = DeltaCompositor()
+    meta = pack_patch_meta(SIZE, [(0, 0, 80, 80)])
+    assert compositor.on_patch("p", meta, [b""]) is None  # No full frame yet
+
+    ok, full = cv2.imencode(".jpg", blank())
+    compositor.on_full("p", full.tobytes())
+    frame = blank()
+    frame[0:80, 0:80] = 255
+    patches = encode_patches(frame, SIZE, [(0, 0, 80, 80)], 90)
+    jpeg = compositor.on_patch("p", meta, patches)
+    canvas = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+    assert canvas[40, 40].min() > 240
+    assert canvas[240, 320].max() < 15
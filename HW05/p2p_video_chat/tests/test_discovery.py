@@ -0,0 +1,97 @@
+import pytest
+
+from app import (
+    ANNOUNCE_HEADER,
+    ANNOUNCE_MAGIC,
+    PEER_TIMEOUT,
+    DiscoveryEngine,
+    generate_peer_id,
+)
+
+ALICE = ("10.0.0.1", 6000)
+BOB = ("10.0.0.2", 6001)
+
+
+def engine(addr, name, room="lobby"):
+    session = {"room": room, "name": name, "ip": addr[0], "zmq_port": addr[1]}
+    return DiscoveryEngine(session, "[Test]")
+
+
+def test_heartbeat_round_trip(registry):
+    heartbeat = engine(BOB, "Bob").build_heartbeat(now=123.5)
+    parsed = engine(ALICE, "Alice").parse(heartbeat, BOB[0])
+    assert parsed == (generate_peer_id(*BOB), "Bob", BOB[1], 123.5, None)
+
+
+def test_other_rooms_and_own_heartbeat_are_ignored(registry):
+    alice = engine(ALICE, "Alice")
+    assert alice.parse(engine(BOB, "Bob", room="other").build_heartbeat(), BOB[0]) is None
+    assert alice.parse(engine(BOB, "Bob", room="lobbyist").build_heartbeat(), BOB[0]) is None
+    assert alice.parse(alice.build_heartbeat(), ALICE[0]) is None
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"",
+        b"\x00\x01garbage",
+        ANNOUNCE_MAGIC,
+        ANNOUNCE_HEADER.pack(ANNOUNCE_MAGIC, 0, 6001, 1.0, 5) + b"lobby\x03Bob",
+        ANNOUNCE_HEADER.pack(ANNOUNCE_MAGIC, 2, 6001, 1.0, 5) + b"lob",
+        ANNOUNCE_HEADER.pack(ANNOUNCE_MAGIC, 2, 6001, 1.0, 5) + b"lobby",
+        b"ALIVE|lobby|Bob",
+        b"ALIVE|lobby|Bob|\xff|x",
+    ],
+)
+def test_bad_datagrams_are_rejected(registry, data):
+    assert engine(ALICE, "Alice").parse(data, BOB[0]) is None
+
+
+def test_long_names_are_cut_on_a_character_boundary(registry):
+    heartbeat = engine(BOB, "é" * 200).build_heartbeat()
+    name = engine(ALICE, "Alice").parse(heartbeat, BOB[0])[1]
+    assert name == "é" * 127
+
+
+def test_legacy_text_announcements(registry):
+    alice = engine(ALICE, "Alice")
+    peer_id = generate_peer_id(*BOB)
+    assert alice.parse(f"ALIVE|lobby|Bob|6001|{peer_id}".encode(), BOB[0]) == (
+        peer_id,
+        "Bob",
+        6001,
+        None,
+        None,
+    )
+    assert alice.parse(f"ALIVE|lobby|Bob|6001|{peer_id}|7.5".encode(), BOB[0])[3] == 7.5
+    assert alice.parse(f"ALIVE|other|Bob|6001|{peer_id}".encode(), BOB[0]) is None
+    assert alice.parse(f"ALIVE|lobby|Bob|6001|{peer_id}".encode(), "10.0.0.9") is None
+    assert alice.parse(f"ALIVE|lobby|Bob|port|{peer_id}".encode(), BOB[0]) is None
+
+
+def test_batch_adds_peers_and_expires_them(registry):
+    alice = engine(ALICE, "Alice")
+    bob = engine(BOB, "Bob")
+    peer_id = generate_peer_id(*BOB)
+    alice.next_heartbeat = float("inf")
+
+    alice.handle_batch([(b"junk", "10.0.0.7", 100.0), (bob.build_heartbeat(95.0), BOB[0], 100.0)])
+    record = registry.get(peer_id)
+    assert (record.name, record.addr, record.last_seen) == ("Bob", BOB, 100.0)
+    assert record.stats.clock_offset() == 5.0
+    assert alice.next_heartbeat < float("inf")  # Newcomers are answered early
+
+    alice.handle_batch([(bob.build_heartbeat(105.0), BOB[0], 110.0)])
+    alice.expire(100.0 + PEER_TIMEOUT)  # Stale deadline of the first heartbeat
+    assert registry.get(peer_id) is record
+    alice.expire(110.0 + PEER_TIMEOUT)
+    assert registry.get(peer_id) is None
+
+
+def test_switching_rooms_forgets_peers(registry):
+    alice = engine(ALICE, "Alice")
+    alice.handle_batch([(engine(BOB, "Bob").build_heartbeat(), BOB[0], 1.0)])
+    assert len(registry) == 1
+    alice.reconfigure({"room": "other", "name": "Alice", "ip": ALICE[0], "zmq_port": 6000}, "[T]")
+    assert len(registry) == 0
+    assert alice.next_heartbeat == 0.0
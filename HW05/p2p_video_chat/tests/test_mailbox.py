@@ -0,0 +1,50 @@
+import threading
+
+from app import FrameMailbox
+
+
+def test_wait_newer_times_out_without_a_new_frame():
+    mailbox = FrameMailbox()
+    assert mailbox.wait_newer(0, timeout=0.01) == (0, None, None)
+    mailbox.put(b"one", 1.0)
+    assert mailbox.wait_newer(1, timeout=0.01) == (1, None, None)
+
+
+def test_wait_newer_returns_latest_frame_at_once():
+    mailbox = FrameMailbox()
+    mailbox.put(b"one", 1.0)
+    mailbox.put(b"two", 2.0)
+    assert mailbox.wait_newer(0, timeout=0) == (2, b"two", 2.0)
+
+
+def test_wait_newer_wakes_on_put():
+    mailbox = FrameMailbox()
+    timer = threading.Timer(0.05, mailbox.put, args=(b"late", 3.0))
+    timer.start()
+    try:
+        assert mailbox.wait_newer(0, timeout=5.0) == (1, b"late", 3.0)
+    finally:
+        timer.cancel()
+
+
+def test_only_unread_frames_count_as_dropped():
+    mailbox = FrameMailbox()
+    assert not mailbox.put(b"one")
+    assert mailbox.put(b"two")  # "one" was never read
+    mailbox.wait_newer(0, timeout=0)
+    assert not mailbox.put(b"three")
+    assert mailbox.dropped == 1
+
+
+def test_put_notifies_listeners():
+    mailbox = FrameMailbox()
+    calls = []
+
+    def callback():
+        calls.append(mailbox.version)
+
+    mailbox.listeners.add(callback)
+    mailbox.put(b"one")
+    mailbox.listeners.remove(callback)
+    mailbox.put(b"two")
+    assert calls == [1]
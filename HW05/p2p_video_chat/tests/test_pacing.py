@@ -0,0 +1,36 @@
+import pytest
+
+from app import FramePacer
+
+
+def test_pacer_sleeps_only_for_what_is_left_of_the_interval(clock):
+    pacer = FramePacer("test", 10)
+    assert pacer.next_delay() == pytest.approx(0.1)
+    clock.advance(0.1 + 0.03)  # Sleep plus 30 ms of work
+    assert pacer.next_delay() == pytest.approx(0.07)
+    assert pacer.skipped_total == 0
+
+
+def test_late_pacer_skips_missed_deadlines(clock):
+    pacer = FramePacer("test", 10)
+    pacer.next_delay()
+    clock.advance(0.35)  # Deadlines at 0.1, 0.2 and 0.3 passed
+    delay = pacer.next_delay()
+    assert pacer.skipped_total == 2
+    assert delay == pytest.approx(0.05)  # Realigned to the 0.4 slot, no catching up
+
+
+def test_pacer_reset_forgives_idle_time(clock):
+    pacer = FramePacer("test", 10)
+    pacer.next_delay()
+    clock.advance(30.0)
+    pacer.reset()
+    assert pacer.next_delay() == pytest.approx(0.1)
+    assert pacer.skipped_total == 0
+
+
+def test_pacer_measures_achieved_fps(clock):
+    pacer = FramePacer("test", 10, report_interval=0.95)
+    for _ in range(11):
+        pacer.wait()  # The 11th frame is done one second after the window started
+    assert pacer.stats()["achieved_fps"] == pytest.approx(11.0)
@@ -0,0 +1,114 @@
+import os
+
+import pytest
+
+import app
+from app import RECORD_MAX_GAP, PlaybackClock, Recorder, RecordingReader, RecordingWriter
+
+
+@pytest.fixture
+def record_dir(tmp_path, monkeypatch, registry):
+    monkeypatch.setattr(app.recorder, "directory", str(tmp_path))
+    return tmp_path
+
+
+def write_recording(root, frames, started_at=1000.0):
+    """frames: [(peer_id, arrived_at, jpeg)]. Returns the recording's name."""
+    writer = RecordingWriter(str(root), "lobby", started_at)
+    for peer_id, arrived_at, jpeg in frames:
+        writer.append(peer_id, arrived_at, jpeg)
+    writer.close()
+    return os.path.basename(writer.path)
+
+
+def test_reader_seeks_by_arrival_time(record_dir):
+    frames = [("p", 1000.0 + i * 0.5, b"jpeg%d" % i) for i in range(6)]
+    name = write_recording(record_dir, frames)
+    reader = RecordingReader(os.path.join(record_dir, name), "p")
+    try:
+        assert len(reader) == 6
+        assert reader.seek(0.0) == 0
+        assert reader.seek(1001.0) == 2  # Exactly on a frame
+        assert reader.seek(1001.2) == 3  # Between frames: the next one
+        assert reader.seek(2000.0) == 6
+        timestamp, jpeg = reader.frame(3)
+        assert (timestamp, bytes(jpeg)) == (1001.5, b"jpeg3")
+    finally:
+        reader.close()
+
+
+def test_open_recording_starts_at_offset(record_dir):
+    frames = [("p", 1000.0 + i, b"x") for i in range(5)] + [("q", 1002.5, b"y")]
+    name = write_recording(record_dir, frames)
+
+    reader, position = app.open_recording(name, "p", offset=2.5)
+    reader.close()
+    assert position == 3
+    assert app.open_recording(name, "missing") is None
+    assert app.open_recording("../" + name, "p") is None
+    assert app.open_recording("nothing-here", "p") is None
+
+
+def test_list_recordings_reports_time_ranges(record_dir):
+    name = write_recording(record_dir, [("p", 1001.0, b"a"), ("p", 1003.0, b"b")])
+    (recording,) = app.list_recordings()
+    assert recording["recording"] == name
+    assert recording["room"] == "lobby"
+    (peer,) = recording["peers"]
+    assert (peer["peer"], peer["frames"], peer["first"], peer["last"]) == ("p", 2, 1.0, 3.0)
+
+
+def test_recorder_writes_offered_frames(record_dir):
+    recorder = Recorder()
+    recorder.directory = str(record_dir)
+    recorder.offer("lobby", "p", b"dropped")  # Not started: ignored
+    recorder.start()
+    for i in range(3):
+        recorder.offer("lobby", "p", b"frame%d" % i)
+    recorder.stop()
+
+    (recording,) = app.list_recordings()
+    reader = RecordingReader(os.path.join(record_dir, recording["recording"]), "p")
+    try:
+        assert [bytes(reader.frame(i)[1]) for i in range(len(reader))] == [
+            b"frame0",
+            b"frame1",
+            b"frame2",
+        ]
+    finally:
+        reader.close()
+
+
+def test_playback_clock_shortens_pauses_and_realigns(clock):
+    playback = PlaybackClock()
+    assert playback.delay(50.0) == 0.0
+    assert playback.delay(50.2) == pytest.approx(0.2)
+    assert playback.delay(80.0) == pytest.approx(RECORD_MAX_GAP)  # Nothing was received
+    clock.advance(RECORD_MAX_GAP + 5.0)  # The reader fell behind
+    assert playback.delay(80.1) == 0.0
+    assert playback.delay(80.2) == pytest.approx(0.1)
+
+
+def test_recorder_viewers_keep_peers_received_without_counting_as_readers(registry):
+    registry.update({"p": ("Pat", ("10.0.0.5", 6000), 0.0)})
+    viewers = {}
+    Recorder._sync_viewers(viewers)
+    try:
+        assert app.choose_layer("p") == app.SIMULCAST_LAYERS[0][0]
+        assert not app.has_mailbox_readers("p")
+        assert app._feed_viewer_counts() == {}
+
+        mailbox = registry.get("p").mailbox
+        for frame in (b"one", b"two", b"three"):
+            mailbox.put(frame, watched=app.has_mailbox_readers("p"))
+        assert mailbox.dropped == 0
+
+        browser = app.attach_feed_viewer("p")
+        assert app.has_mailbox_readers("p")
+        assert app._feed_viewer_counts() == {"p": 1}
+        app.detach_feed_viewer(browser)
+    finally:
+        registry.clear()
+        Recorder._sync_viewers(viewers)
+    assert viewers == {}
+    assert "p" not in app.peer_feed_clients
@@ -0,0 +1,40 @@
+from app import PeerRegistry
+
+
+def test_registry_snapshot_is_not_changed_by_joins_and_leaves():
+    registry = PeerRegistry()
+    registry.update({"a": ("Ann", ("10.0.0.1", 6000), 1.0)})
+    before = registry.snapshot()
+
+    added = registry.update({"b": ("Ben", ("10.0.0.2", 6000), 2.0)})
+    assert [record.peer_id for record in added] == ["b"]
+    assert list(before) == ["a"]
+    assert registry.snapshot() is not before
+    assert registry.snapshot()["a"] is before["a"]
+
+    during = registry.snapshot()
+    assert registry.remove_if("a", lambda record: True) is before["a"]
+    assert list(during) == ["a", "b"]
+    assert list(registry.snapshot()) == ["b"]
+
+
+def test_registry_refresh_updates_record_in_place():
+    registry = PeerRegistry()
+    registry.update({"a": ("Ann", ("10.0.0.1", 6000), 1.0)})
+    table = registry.snapshot()
+    assert registry.update({"a": ("Anna", ("10.0.0.1", 6001), 5.0)}) == []
+    assert registry.snapshot() is table  # Nothing joined, nothing copied
+    record = registry.get("a")
+    assert (record.name, record.addr, record.last_seen) == ("Anna", ("10.0.0.1", 6001), 5.0)
+
+
+def test_registry_remove_if_and_clear():
+    registry = PeerRegistry()
+    registry.update({"a": ("Ann", None, 1.0), "b": ("Ben", None, 2.0)})
+    assert registry.remove_if("a", lambda record: record.last_seen > 1.0) is None
+    assert registry.remove_if("missing", lambda record: True) is None
+    table = registry.snapshot()
+    departed = registry.clear()
+    assert sorted(record.peer_id for record in departed) == ["a", "b"]
+    assert len(registry) == 0
+    assert len(table) == 2
@@ -0,0 +1,75 @@
+import app
+from app import SSE_CONTROL_LANE_LIMIT, SSEClient, ViewerBudget, format_sse
+
+
+def drain(client):
+    messages = []
+    while (message := client.get(0)) is not None:
+        messages.append(message)
+    return messages
+
+
+def test_control_lane_goes_first_and_keeps_everything():
+    client = SSEClient("test", ViewerBudget())
+    client.push_media("a", "stats a")
+    client.push_control("join 1")
+    client.push_control("join 2")
+    assert drain(client) == ["join 1", "join 2", "stats a"]
+
+
+def test_media_lane_keeps_latest_per_key_in_arrival_order():
+    client = SSEClient("test", ViewerBudget())
+    client.push_media("a", "a1")
+    client.push_media("b", "b1")
+    client.push_media("a", "a2")
+    assert client.depth() == 2
+    assert drain(client) == ["b1", "a2"]
+
+
+def test_get_times_out_when_empty():
+    client = SSEClient("test", ViewerBudget())
+    assert client.get(0.01) is None
+
+
+def test_full_control_lane_asks_for_resync():
+    client = SSEClient("test", ViewerBudget())
+    for i in range(SSE_CONTROL_LANE_LIMIT):
+        assert client.push_control(f"event {i}")
+    assert not client.push_control("one too many")
+
+    client.push_media("a", "stats")
+    client.resync(["join"])
+    assert drain(client) == [format_sse("reset", {}), "join"]
+
+
+def test_notify_routes_lanes_and_skips_hidden_peers(monkeypatch, registry):
+    shows_all = SSEClient("all", ViewerBudget())
+    shows_a = SSEClient("a", ViewerBudget(peers=["a"]))
+    hidden = SSEClient("hidden", ViewerBudget(fps=0))
+    monkeypatch.setattr(app, "sse_clients", [shows_all, shows_a, hidden])
+
+    app.notify_sse_clients("peer_join", {"peer_id": "b"})
+    app.notify_sse_clients("peer_stats", {"n": 1}, coalesce_key="b")
+    app.notify_sse_clients("peer_stats", {"n": 2}, coalesce_key="b")
+    app.notify_sse_clients("peer_stats", {"n": 1}, coalesce_key="a")
+
+    join = format_sse("peer_join", {"peer_id": "b"})
+    assert drain(shows_all) == [
+        join,
+        format_sse("peer_stats", {"n": 2}),
+        format_sse("peer_stats", {"n": 1}),
+    ]
+    assert drain(shows_a) == [join, format_sse("peer_stats", {"n": 1})]
+    assert drain(hidden) == [join]  # Control events reach hidden pages too
+
+
+def test_notify_resyncs_a_stalled_client(monkeypatch, registry):
+    registry.update({"p": ("Pat", ("10.0.0.5", 6000), 0.0)})
+    stalled = SSEClient("stalled", ViewerBudget())
+    monkeypatch.setattr(app, "sse_clients", [stalled])
+    for i in range(SSE_CONTROL_LANE_LIMIT + 1):
+        app.notify_sse_clients("peer_leave", {"peer_id": str(i)})
+    assert drain(stalled) == [
+        format_sse("reset", {}),
+        format_sse("peer_join", {"peer_id": "p", "name": "Pat"}),
+    ]
@@ -0,0 +1,97 @@
+import pytest
+
+from app import PeerStreamStats
+
+
+def record(stats, seqs, transit=0.01, start=100.0):
+    for seq in seqs:
+        captured_at = start + seq * 0.04
+        stats.record_frame(seq, captured_at, 0.005, captured_at + transit)
+
+
+def test_counts_gaps_as_loss():
+    stats = PeerStreamStats()
+    record(stats, [1, 2, 3, 6, 7])
+    snapshot = stats.snapshot()
+    assert snapshot["received"] == 5
+    assert snapshot["lost"] == 2
+    assert snapshot["loss_rate"] == pytest.approx(2 / 7, abs=1e-4)
+    assert snapshot["reordered"] == 0
+
+
+def test_late_frame_fills_gap_and_counts_as_reordered():
+    stats = PeerStreamStats()
+    record(stats, [1, 2, 4, 3, 5])
+    snapshot = stats.snapshot()
+    assert snapshot["lost"] == 0
+    assert snapshot["reordered"] == 1
+
+
+def test_sender_restart_resets_sequence():
+    stats = PeerStreamStats()
+    record(stats, range(5000, 5010))
+    record(stats, [1, 2, 3])
+    snapshot = stats.snapshot()
+    assert snapshot["received"] == 3
+    assert snapshot["lost"] == 0
+
+
+def test_restart_sequence_keeps_totals_without_counting_the_gap():
+    stats = PeerStreamStats()
+    record(stats, [1, 2, 4])  # One lost
+    stats.restart_sequence()
+    record(stats, [500, 501, 502])  # Sent while we were not subscribed in between
+    snapshot = stats.snapshot()
+    assert snapshot["received"] == 6
+    assert snapshot["lost"] == 1
+
+
+def test_interval_loss_covers_only_frames_since_previous_call():
+    stats = PeerStreamStats()
+    assert stats.take_interval_loss() is None
+    record(stats, [1, 2, 3, 4])
+    assert stats.take_interval_loss() == 0
+    record(stats, [6, 7, 8, 10])  # 5 and 9 lost
+    assert stats.take_interval_loss() == pytest.approx(2 / 6)
+    assert stats.take_interval_loss() is None
+
+
+def test_interval_loss_after_restart_sequence():
+    stats = PeerStreamStats()
+    record(stats, [1, 2, 3])
+    stats.take_interval_loss()
+    stats.restart_sequence()
+    record(stats, [900, 901])
+    assert stats.take_interval_loss() == 0
+
+
+def test_constant_transit_has_no_jitter():
+    stats = PeerStreamStats()
+    record(stats, range(1, 50), transit=0.02)
+    assert stats.snapshot()["jitter_ms"] == 0.0
+
+
+def test_varying_transit_raises_jitter():
+    stats = PeerStreamStats()
+    for seq in range(1, 50):
+        captured_at = 100.0 + seq * 0.04
+        transit = 0.01 if seq % 2 else 0.03
+        stats.record_frame(seq, captured_at, 0.005, captured_at + transit)
+    jitter_ms = stats.snapshot()["jitter_ms"]
+    assert 0 < jitter_ms <= 20.0
+
+
+def test_latency_needs_a_clock_offset():
+    stats = PeerStreamStats()
+    record(stats, [1])
+    assert stats.snapshot()["latency_ms"] is None
+
+    stats = PeerStreamStats()
+    # The remote clock is 5 s behind; the smallest heartbeat delay is taken as offset
+    stats.record_clock_sample(200.0, 205.001)
+    stats.record_clock_sample(201.0, 206.050)
+    stats.record_frame(1, 300.0, 0.005, 305.021)
+    snapshot = stats.snapshot()
+    assert snapshot["clock_offset_ms"] == pytest.approx(5001.0)
+    assert snapshot["latency_ms"] == pytest.approx(20.0, abs=0.01)
+
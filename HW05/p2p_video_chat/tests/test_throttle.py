@@ -0,0 +1,49 @@
+import pytest
+
+from app import FeedThrottle, ViewerBudget
+
+
+def test_throttle_takes_the_lower_of_feed_and_page_fps():
+    budget = ViewerBudget(fps=5)
+    assert FeedThrottle(10, budget).target_fps() == 5
+    assert FeedThrottle(2, budget).target_fps() == 2
+    assert FeedThrottle(None, budget).target_fps() == 5
+    assert FeedThrottle(0).target_fps() is None
+    assert FeedThrottle(8).limit(25) == 8
+    assert FeedThrottle().limit(25) == 25
+
+
+def test_throttle_spaces_frames_without_saving_up_slots(clock):
+    throttle = FeedThrottle(4)
+    assert throttle.delay() == 0.0
+    throttle.sent()
+    assert throttle.delay() == pytest.approx(0.25)
+    clock.advance(0.3)  # Sent 50 ms late: the slot after it stays on schedule
+    throttle.sent()
+    assert throttle.delay() == pytest.approx(0.2)
+    clock.advance(10.0)  # Idle: no burst of saved-up slots afterwards
+    assert throttle.delay() == 0.0
+    throttle.sent()
+    assert throttle.delay() == pytest.approx(0.25)
+
+
+def test_hidden_page_pauses_its_feeds():
+    budget = ViewerBudget(peers=["a"])
+    throttle = FeedThrottle(budget=budget)
+    assert throttle.active("a")
+    assert not throttle.active("b")
+    assert throttle.active()
+
+    budget.update(fps=0, peers=["a"])
+    assert throttle.target_fps() == 0
+    assert not throttle.active("a")
+    assert throttle.delay() == 0.0
+
+
+def test_budget_update_wakes_waiting_feed():
+    budget = ViewerBudget()
+    version = budget.version
+    budget.update(fps=3)
+    assert budget.wait_changed(version, timeout=0) == version + 1
+    assert budget.wait_changed(version + 1, timeout=0.01) == version + 1
+    assert budget.stats() == {"fps": 3.0, "peers": None}